@@ -1,5 +1,7 @@
+import importlib
 import os
 import sys
+import time
 
 # Ensure the project's root directory is in the system path.
 # This allows for consistent module resolution (e.g., importing `functions`).
@@ -8,17 +10,14 @@ parent_dir = os.path.dirname(current_dir)
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-# --- Workflow Class Imports ---
-# Each new workflow must be imported here to be recognized by the dispatcher.
-from workflow_scripts.FLUX_Kontext import FLUX_Kontext
-from workflow_scripts.IP_Adapter_SDXL import IP_Adapter_SDXL
-from workflow_scripts.ChromaV44 import ChromaV44
 from functions import Functions
+from graph_engine import GraphWorkflow, WorkflowGraph
+from residency import ResidencyManager
+from startup import StartupTimer, required_node_types
 
 
-# Final steps in 'dispatcher.py':
-# 10. Import your new workflow: from workflow_scripts.[workflow_name] import [ClassName]
-# 11. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": [ClassName]
+# Final step in 'dispatcher.py':
+# 10. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": "workflow_scripts.[workflow_name].[ClassName]"
 
 class WorkflowDispatcher:
     """
@@ -26,41 +25,130 @@ class WorkflowDispatcher:
     
     This class is responsible for:
     - Setting up the necessary paths for ComfyUI and its custom nodes.
-    - Registering all available workflow classes.
+    - Registering all available workflow classes, which are only imported when they are first used.
     - Instantiating workflow objects upon request.
+    - Keeping loaded workflows resident on the GPU within a VRAM budget (see `activate`).
     """
     
-    def __init__(self):
+    def __init__(self, vram_budget_gb: float = None, host_ram_budget_gb: float = None, tracer=None, nodes_only: bool = False):
         """
         Initializes the dispatcher and prepares the environment for ComfyUI.
+
+        Args:
+            vram_budget_gb: The VRAM all resident workflows may use together.
+                Defaults to 85% of the GPU's memory.
+            host_ram_budget_gb: The pinned host RAM evicted workflows may use for the warm standby.
+                Defaults to 25% of the physical memory, 0 disables the warm standby.
+            tracer: An optional NodeTracer (see tracing.py) that measures every node call.
+            nodes_only: Only import ComfyUI and the custom nodes the workflows need, without
+                setting up the residency manager. Used by the fork server before it forks workers.
         """
         self.functions = Functions()
-        
-        # Set up the environment by adding required paths for ComfyUI to function correctly.
-        self.functions.add_comfyui_directory_to_sys_path()
-        self.functions.add_extra_model_paths()
-        
-        # Import ComfyUI's node mappings, which are essential for running workflows.
-        try:
-            from nodes import NODE_CLASS_MAPPINGS
-            self.NODE_CLASS_MAPPINGS = NODE_CLASS_MAPPINGS
-        except ImportError:
-            print("Warning: Could not import NODE_CLASS_MAPPINGS from ComfyUI.")
-            self.NODE_CLASS_MAPPINGS = {}
-            
-        # Discover and load any custom nodes.
-        self.functions.import_custom_nodes()
+        timer = StartupTimer()
 
         # --- Workflow Registration ---
-        # Add an entry to this dictionary mapping a unique string name to the workflow's class definition.
+        # Add an entry to this dictionary mapping a unique string name to the module and name of the workflow's class.
+        # The module is imported when the workflow is first activated.
         self.workflow_class = {
-            "FLUX_Kontext": FLUX_Kontext, 
-            "IP_Adapter_SDXL": IP_Adapter_SDXL,
-            "ChromaV44": ChromaV44,
+            "FLUX_Kontext": "workflow_scripts.FLUX_Kontext.FLUX_Kontext",
+            "IP_Adapter_SDXL": "workflow_scripts.IP_Adapter_SDXL.IP_Adapter_SDXL",
+            "ChromaV44": "workflow_scripts.ChromaV44.ChromaV44",
             # Example:
-            # "YourWorkflowName": YourWorkflowClassName,
+            # "YourWorkflowName": "workflow_scripts.YourWorkflowName.YourWorkflowClassName",
         }
 
+        # Exported ComfyUI workflows (the JSON files in 'Workflows/') that run directly through
+        # graph_engine.py, without a hand-ported script. The static part of the graph is found and
+        # loaded once automatically. "image" is the id of the LoadImage node that receives the job's
+        # image, "inputs" sets widgets per job: "<node id>.<input name>": template with {label},
+        # {first_name}, {last_name}, {animal_name} or {animal_type}. "output" picks the SaveImage
+        # node if the graph has several active ones.
+        # The "_graph" workflows run the exported JSON as it is, with the models and reference images
+        # saved in it, which may differ from the hand-ported scripts of the same name.
+        self.graph_workflows = {
+            "FLUX_Kontext_graph": {"graph": "FLUX_Kontext.json", "image": 17, "inputs": {"59.text": "{label}"}},
+            "ChromaV44_graph": {"graph": "ChromaV44.json", "image": 89, "inputs": {"142.text": "{label}"}},
+            "IP_Adapter_SDXL_graph": {"graph": "IP_Adapter_SDXL.json", "image": 50},
+            # Example:
+            # "YourWorkflowName": {"graph": "YourWorkflow.json", "image": 17, "inputs": {"59.text": "{label}"}},
+        }
+
+        # Set up the environment by adding required paths for ComfyUI to function correctly.
+        with timer.phase("ComfyUI paths"):
+            self.functions.add_comfyui_directory_to_sys_path()
+            self.functions.add_extra_model_paths()
+        
+        # Import ComfyUI's node mappings, which are essential for running workflows.
+        with timer.phase("ComfyUI nodes"):
+            try:
+                from nodes import NODE_CLASS_MAPPINGS
+                self.NODE_CLASS_MAPPINGS = NODE_CLASS_MAPPINGS
+            except ImportError:
+                print("Warning: Could not import NODE_CLASS_MAPPINGS from ComfyUI.")
+                self.NODE_CLASS_MAPPINGS = {}
+            
+        # Discover and load the custom nodes the registered workflows use.
+        with timer.phase("Custom nodes"):
+            modules = [path.rsplit(".", 1)[0] for path in self.workflow_class.values()]
+            node_types = required_node_types(modules)
+            for name, settings in self.graph_workflows.items():
+                node_types |= WorkflowGraph.from_file(settings["graph"], settings.get("output")).node_types()
+            self.functions.import_custom_nodes(node_types)
+        if nodes_only:
+            print(timer.summary())
+            return
+
+        # With tracing enabled, the workflows get node mappings that measure every node call
+        self.tracer = tracer
+        if tracer is not None:
+            self.NODE_CLASS_MAPPINGS = tracer.wrap_mappings(self.NODE_CLASS_MAPPINGS)
+
+        # Tracks which workflows are loaded and evicts the least recently used ones when VRAM runs out
+        with timer.phase("Residency setup"):
+            self.residency = ResidencyManager(self.create_single_workflow_obj, vram_budget_gb, host_ram_budget_gb)
+        print(timer.summary())
+
+
+    def workflow_names(self) -> list:
+        """Returns the names of all registered workflows, scripts and graphs."""
+        return list(self.workflow_class) + list(self.graph_workflows)
+
+
+    def get_workflow_class(self, workflow: str):
+        """
+        Imports the module of a registered workflow on first use and returns its class.
+
+        Raises:
+            ValueError: If the requested workflow name is not registered.
+        """
+        if workflow in self.graph_workflows:
+            return GraphWorkflow
+        if workflow not in self.workflow_class:
+            raise ValueError(f"Workflow '{workflow}' is not defined in the dispatcher.")
+        module_name, class_name = self.workflow_class[workflow].rsplit(".", 1)
+        if module_name not in sys.modules:
+            start_time = time.time()
+            importlib.import_module(module_name)
+            print(f"Imported workflow {workflow} in {time.time() - start_time:.2f} seconds")
+        return getattr(sys.modules[module_name], class_name)
+
+
+    def activate(self, workflow: str):
+        """
+        Returns a loaded instance of the given workflow.
+
+        Workflows stay loaded after use. Switching back to a workflow that is still resident
+        costs nothing; otherwise it is loaded, and the least recently used workflows are
+        evicted if the VRAM budget requires it.
+
+        Args:
+            workflow (str): The name of the workflow to activate.
+
+        Returns:
+            The workflow object, ready for `generate()`.
+        """
+        return self.residency.activate(workflow)
+
 
     def create_workflow_obj(self):
         """
@@ -70,11 +158,8 @@ class WorkflowDispatcher:
             dict: A dictionary mapping workflow names to their instantiated objects.
         """
         workflows = {}
-        for name, cls in self.workflow_class.items():
-            workflow_instance = cls(self.functions)
-            # Inject the node mappings into the instance for its use.
-            workflow_instance.NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
-            workflows[name] = workflow_instance
+        for name in self.workflow_names():
+            workflows[name] = self.create_single_workflow_obj(name)
         return workflows
         
 
@@ -91,11 +176,11 @@ class WorkflowDispatcher:
         Raises:
             ValueError: If the requested workflow name is not registered.
         """
-        if workflow not in self.workflow_class:
-            raise ValueError(f"Workflow '{workflow}' is not defined in the dispatcher.")
-        
-        cls = self.workflow_class[workflow]
-        workflow_instance = cls(self.functions)
+        cls = self.get_workflow_class(workflow)
+        if workflow in self.graph_workflows:
+            workflow_instance = cls(self.functions, workflow, **self.graph_workflows[workflow])
+        else:
+            workflow_instance = cls(self.functions)
         # Inject the node mappings into the instance.
         workflow_instance.NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         return workflow_instance    
\ No newline at end of file
@@ -0,0 +1,183 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Supported output formats: name -> (file suffix, content type)
+FORMATS = {
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+    "jpeg": (".jpg", "image/jpeg"),
+}
+
+
+# Renditions uploaded along with the full image: multipart field name -> longest side in pixels
+DEFAULT_RENDITIONS = {"display": 768, "thumbnail": 256}
+
+
+def tensor_to_uint8(image) -> np.ndarray:
+    """
+    Converts an image tensor from ComfyUI into an 8-bit [H, W, C] array.
+
+    The conversion to uint8 runs on the device the tensor lives on (usually the GPU), so only
+    a quarter of the data has to be copied to the host compared to float32.
+
+    Args:
+        image: A float tensor in the range 0..1, e.g. [1, H, W, C] or [C, H, W].
+
+    Returns:
+        np.ndarray: The image as uint8 array with the channels last.
+    """
+    import torch
+
+    # Same result as the former NumPy path: scale, clip, truncate
+    arr = (image * 255).clamp(0, 255).to(torch.uint8).cpu().numpy()
+
+    # Remove singleton dimensions (e.g., [1, H, W, C] -> [H, W, C])
+    arr = np.squeeze(arr)
+
+    # Transpose if the channel is the first dimension (e.g., [C, H, W] -> [H, W, C])
+    if arr.ndim == 3 and arr.shape[0] in [1, 3, 4]:
+        arr = np.transpose(arr, (1, 2, 0))
+    return arr
+
+
+class EncodedImage:
+    """
+    An image that is being encoded in the background.
+
+    Behaves like the io.BytesIO the workflows used to return: `getvalue()` returns the encoded
+    bytes, waiting for the encoder thread if it is not done yet. `filename` and `content_type`
+    describe the chosen format for the upload.
+    """
+
+    def __init__(self, future, filename: str, content_type: str, key: str = None, renditions: dict = None):
+        """
+        Args:
+            future: The encoder task. Its result are the encoded bytes, or a dict of them if `key` is set.
+            filename: The file name used for the upload.
+            content_type: The MIME type of the format.
+            key: The entry of the future's result dict this image refers to.
+            renditions: Smaller versions of this image, multipart field name -> EncodedImage.
+        """
+        self._future = future
+        self._key = key
+        self.filename = filename
+        self.content_type = content_type
+        self.renditions = renditions or {}
+
+    def getvalue(self) -> bytes:
+        result = self._future.result()
+        return result if self._key is None else result[self._key]
+
+    def done(self) -> bool:
+        return self._future.done()
+
+
+class ImageEncoder:
+    """
+    Encodes generated images in a worker thread.
+
+    PNG, lossless WebP and JPEG are supported. PIL releases the GIL while compressing, so the
+    GPU thread can continue with the next job while the previous image is encoded.
+
+    Besides the full-size image, smaller renditions (e.g. a display size for the web page and
+    a thumbnail) can be produced from the same array, so the backend never has to decode and
+    resize the full image itself.
+    """
+
+    def __init__(self, output_format: str = "png", png_compress_level: int = 3, webp_method: int = 4,
+                 jpeg_quality: int = 95, workers: int = 2, renditions: dict = None, rendition_format: str = "jpeg"):
+        """
+        Args:
+            output_format: "png", "webp" (lossless) or "jpeg".
+            png_compress_level: zlib level 0-9. Higher levels give slightly smaller files but take much longer.
+            webp_method: Effort of the lossless WebP encoder, 0 (fast) to 6 (small).
+            jpeg_quality: JPEG quality 1-100.
+            workers: Number of encoder threads.
+            renditions: Smaller versions to produce, name -> longest side in pixels,
+                e.g. {"display": 768, "thumbnail": 256}. The name is used as multipart field name.
+            rendition_format: The format of the renditions.
+        """
+        for name in (output_format, rendition_format):
+            if name not in FORMATS:
+                raise ValueError(f"Unknown output format: {name}. Available: {list(FORMATS)}")
+        self.output_format = output_format
+        self.png_compress_level = png_compress_level
+        self.webp_method = webp_method
+        self.jpeg_quality = jpeg_quality
+        # Largest rendition first, so each one can be scaled down from the previous one
+        self.renditions = dict(sorted((renditions or {}).items(), key=lambda item: -item[1]))
+        self.rendition_format = rendition_format
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-encoder")
+
+    @property
+    def suffix(self) -> str:
+        return FORMATS[self.output_format][0]
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS[self.output_format][1]
+
+    def encode(self, arr: np.ndarray) -> bytes:
+        """Encodes a uint8 [H, W, C] array in the configured format, on the calling thread."""
+        return self._save(Image.fromarray(arr), self.output_format)
+
+    def encode_renditions(self, arr: np.ndarray) -> dict:
+        """Scales the array down to every rendition size and encodes the results. Returns name -> bytes."""
+        img = Image.fromarray(arr)
+        results = {}
+        for name, size in self.renditions.items():
+            # thumbnail() keeps the aspect ratio and never enlarges the image
+            img = img.copy()
+            img.thumbnail((size, size), Image.LANCZOS)
+            results[name] = self._save(img, self.rendition_format)
+        return results
+
+    def _save(self, img: Image.Image, output_format: str) -> bytes:
+        buffer = io.BytesIO()
+        if output_format == "png":
+            img.save(buffer, format="PNG", compress_level=self.png_compress_level)
+        elif output_format == "webp":
+            img.save(buffer, format="WEBP", lossless=True, method=self.webp_method)
+        else:
+            if img.mode == "RGBA":
+                img = img.convert("RGB")  # JPEG has no alpha channel
+            img.save(buffer, format="JPEG", quality=self.jpeg_quality, subsampling=0)
+        return buffer.getvalue()
+
+    def submit(self, arr: np.ndarray, name: str = "result") -> EncodedImage:
+        """Starts encoding an array (and its renditions) in the background and returns immediately."""
+        future = self._executor.submit(self.encode, arr)
+
+        renditions = {}
+        if self.renditions:
+            rendition_future = self._executor.submit(self.encode_renditions, arr)
+            suffix, content_type = FORMATS[self.rendition_format]
+            for rendition in self.renditions:
+                renditions[rendition] = EncodedImage(rendition_future, f"{name}_{rendition}{suffix}", content_type, key=rendition)
+
+        return EncodedImage(future, name + self.suffix, self.content_type, renditions=renditions)
+
+
+# The encoder used by Functions.converte_image, replaced by configure()
+_encoder = ImageEncoder(renditions=DEFAULT_RENDITIONS)
+_encoder_lock = threading.Lock()
+
+
+def configure(output_format: str = "png", png_compress_level: int = 3, webp_method: int = 4, jpeg_quality: int = 95,
+              renditions: dict = None, rendition_format: str = "jpeg"):
+    """Selects the output format and the renditions for all generated images."""
+    global _encoder
+    with _encoder_lock:
+        _encoder = ImageEncoder(output_format, png_compress_level, webp_method, jpeg_quality,
+                                renditions=renditions, rendition_format=rendition_format)
+    sizes = ", ".join(f"{name} {size}px" for name, size in _encoder.renditions.items())
+    print(f"Output format: {output_format}" + (f" | Renditions ({rendition_format}): {sizes}" if sizes else ""))
+
+
+def get_encoder() -> ImageEncoder:
+    """Returns the configured encoder."""
+    return _encoder
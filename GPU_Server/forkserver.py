@@ -0,0 +1,261 @@
+import atexit
+import importlib
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import torch
+
+from supervisor import RESTART_EXIT_CODE, RESTART_COUNT_ENV
+
+# Set in the forked workers, so restart_program() exits instead of re-executing the script
+FORK_CHILD_ENV = "IAP_FORK_CHILD"
+
+# Modules imported once by the fork server. They must not initialize CUDA or start threads:
+# a forked child can't use a CUDA context created by its parent. ComfyUI itself and the custom
+# nodes are imported afterwards by `import_nodes`, see defer_cuda_init.
+DEFAULT_PRELOAD = (
+    "numpy",
+    "PIL.Image",
+    "requests",
+    "yaml",
+    "einops",
+    "safetensors.torch",
+    "torchvision",
+    "transformers",
+    "aiohttp",
+    "folder_paths",  # ComfyUI's model path registry, plain Python
+)
+
+
+@contextmanager
+def defer_cuda_init():
+    """
+    Answers the CUDA queries ComfyUI makes at import time from NVML, without creating a CUDA context.
+
+    ComfyUI's model management asks for the current device, its name and its memory when it is
+    imported, and each of these calls would initialize CUDA in the fork server. While this
+    context is active they are answered by the NVIDIA management library instead, which gives
+    the same values. Other CUDA calls still initialize CUDA; the fork server checks for that
+    afterwards (see ForkServer.fork_safe).
+
+    Yields:
+        bool: False if NVML is not available and nothing was replaced.
+    """
+    os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")  # torch.cuda.is_available() without CUDA
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+    except Exception as e:
+        print(f"[fork-server] NVML is not available ({e}), ComfyUI may initialize CUDA")
+        yield False
+        return
+
+    try:
+        # Device 0 of this process, the first of CUDA_VISIBLE_DEVICES (set by the supervisor)
+        visible = [device.strip() for device in os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",") if device.strip()]
+        handle = pynvml.nvmlDeviceGetHandleByIndex(int(visible[0]) if visible and visible[0].isdigit() else 0)
+        name = pynvml.nvmlDeviceGetName(handle)
+        name = name.decode() if isinstance(name, bytes) else name
+        major, minor = pynvml.nvmlDeviceGetCudaComputeCapability(handle)
+        device_count = len(visible) if visible else pynvml.nvmlDeviceGetCount()
+    except Exception as e:
+        print(f"[fork-server] Could not query the GPU through NVML: {e}")
+        pynvml.nvmlShutdown()
+        yield False
+        return
+
+    def mem_get_info(device=None):
+        info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+        return info.free, info.total
+
+    replacements = {
+        "is_available": lambda: True,
+        "device_count": lambda: device_count,
+        "current_device": lambda: 0,
+        "get_device_name": lambda device=None: name,
+        "get_device_capability": lambda device=None: (major, minor),
+        "get_device_properties": lambda device=None: SimpleNamespace(
+            name=name, major=major, minor=minor, total_memory=mem_get_info()[1]),
+        "mem_get_info": mem_get_info,
+        # Nothing is allocated yet
+        "memory_stats": lambda device=None: {"reserved_bytes.all.current": 0, "active_bytes.all.current": 0},
+        "memory_allocated": lambda device=None: 0,
+        "memory_reserved": lambda device=None: 0,
+    }
+    originals = {key: getattr(torch.cuda, key) for key in replacements if hasattr(torch.cuda, key)}
+    for key, replacement in replacements.items():
+        setattr(torch.cuda, key, replacement)
+    try:
+        yield True
+    finally:
+        for key in replacements:
+            if key in originals:
+                setattr(torch.cuda, key, originals[key])
+            else:
+                delattr(torch.cuda, key)
+        pynvml.nvmlShutdown()
+
+
+class ForkServer:
+    """
+    Runs the worker in forked child processes of a long-lived parent.
+
+    The parent imports the slow, fork-safe modules once (see DEFAULT_PRELOAD) and then forks
+    a child that runs the worker. With `import_nodes` it also imports ComfyUI and the custom
+    nodes once, so the children start with the nodes already registered. When the child asks
+    for a hard reset by exiting with
+    RESTART_EXIT_CODE, its VRAM is freed by the exit and the parent forks a fresh child, which
+    starts with everything the parent imported instead of starting a new interpreter.
+
+    Like multiprocessing, children leave with os._exit(); the atexit handlers (e.g. the removal
+    of temporary files) are run explicitly before.
+    """
+
+    def __init__(self, target, preload=DEFAULT_PRELOAD, setup=None, import_nodes=None):
+        """
+        Args:
+            target: Called in every child, e.g. a function that runs `poll_job`.
+            preload: Names of the modules to import in the parent. Missing modules are skipped.
+            setup: Optional function called once in the parent before the modules are imported,
+                e.g. to add the ComfyUI directory to sys.path.
+            import_nodes: Optional function called once in the parent after the preload, with the
+                CUDA queries made at import time answered from NVML (see defer_cuda_init), e.g. to
+                import ComfyUI's nodes and the custom nodes. If it fails, every child does it itself.
+        """
+        self.target = target
+        self.preload = preload
+        self.setup = setup
+        self.import_nodes = import_nodes
+        self.child_pid = None
+        self.restarts = 0
+        self.shutdown_requested = False
+        # Restarts before this process was started (e.g. by a supervisor) are counted on top
+        self.base_restarts = int(os.environ.get(RESTART_COUNT_ENV, 0))
+
+    def fork_safe(self) -> bool:
+        """Returns True if this process may still fork workers that use the GPU."""
+        if not hasattr(os, "fork"):
+            print("[fork-server] os.fork() is not available on this platform")
+            return False
+        if torch.cuda.is_initialized():
+            print("[fork-server] CUDA is already initialized in the fork server, children could not use the GPU")
+            return False
+        return True
+
+    def preload_modules(self):
+        """Imports the preload modules, stopping at the first one that isn't fork-safe."""
+        start_time = time.time()
+        loaded = 0
+        for name in self.preload:
+            try:
+                importlib.import_module(name)
+            except Exception as e:  # Optional dependencies, and modules that fail without a GPU
+                print(f"[fork-server] Skipping preload of {name}: {e}")
+                continue
+            if torch.cuda.is_initialized():
+                print(f"[fork-server] Importing {name} initialized CUDA")
+                return
+            loaded += 1
+        if threading.active_count() > 1:
+            print(f"[fork-server] Warning: {threading.active_count() - 1} thread(s) running before fork")
+        print(f"[fork-server] Preloaded {loaded} module(s) in {time.time() - start_time:.2f} seconds")
+
+    def preload_nodes(self):
+        """Runs `import_nodes` without letting ComfyUI initialize CUDA at import time."""
+        start_time = time.time()
+        with defer_cuda_init():
+            try:
+                self.import_nodes()
+            except Exception as e:
+                print(f"[fork-server] Importing the nodes failed, the workers import them themselves: {e}")
+                return
+        print(f"[fork-server] Imported ComfyUI and the custom nodes in {time.time() - start_time:.2f} seconds")
+
+    def _handle_signal(self, sig, frame):
+        """Forwards Ctrl+C and SIGTERM to the child, which then stops gracefully."""
+        if not self.shutdown_requested:
+            print("[fork-server] Shutdown requested - stopping the worker...")
+        self.shutdown_requested = True
+        if self.child_pid is not None:
+            try:
+                os.kill(self.child_pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+
+    def _run_child(self):
+        """Runs the target in the forked child and never returns."""
+        exit_code = 1
+        try:
+            # A process group of its own, so Ctrl+C reaches the child only through the parent
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.environ[FORK_CHILD_ENV] = "1"
+            os.environ[RESTART_COUNT_ENV] = str(self.base_restarts + self.restarts)
+            self.target()
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            # os._exit() skips the atexit handlers, e.g. the removal of temporary files (functions.py)
+            try:
+                atexit._run_exitfuncs()
+            except Exception:
+                traceback.print_exc()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    def run(self) -> int:
+        """
+        Forks workers until one exits for another reason than a restart.
+
+        Falls back to running the target in this process if forking is not possible.
+
+        Returns:
+            The exit code of the last worker.
+        """
+        if self.setup is not None:
+            self.setup()
+        self.preload_modules()
+        if self.import_nodes is not None and not torch.cuda.is_initialized():
+            self.preload_nodes()
+        if not self.fork_safe():
+            print("[fork-server] Running the worker in this process instead")
+            self.target()
+            return 0
+
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+
+        while True:
+            # Anything still buffered would otherwise be printed by the child as well
+            sys.stdout.flush()
+            sys.stderr.flush()
+            fork_time = time.time()
+            pid = os.fork()
+            if pid == 0:
+                self._run_child()
+            self.child_pid = pid
+            print(f"[fork-server] Forked worker (PID {pid}), restart {self.restarts}")
+            if self.shutdown_requested:  # Requested while forking, before the child could be signaled
+                os.kill(pid, signal.SIGINT)
+
+            _, status = os.waitpid(pid, 0)
+            self.child_pid = None
+            exit_code = os.waitstatus_to_exitcode(status)
+            uptime = time.time() - fork_time
+
+            if exit_code != RESTART_EXIT_CODE or self.shutdown_requested:
+                print(f"[fork-server] Worker exited with code {exit_code} after {uptime:.0f}s")
+                return exit_code
+            print(f"[fork-server] Worker requested a restart after {uptime:.0f}s, forking a fresh one")
+            self.restarts += 1
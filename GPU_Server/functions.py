@@ -1,12 +1,233 @@
+import atexit
+import inspect
 import io
 import tempfile
+from contextlib import contextmanager
 from typing import Any
 import numpy as np
 from PIL import Image
 import os
 import sys
+import threading
+import weakref
+from collections import OrderedDict
 from typing import Union, Sequence, Mapping
 
+import encoding
+from startup import startup_cache
+
+
+def node_class_name(node: Any) -> str:
+    """Returns the class name of a node instance, also if it is wrapped by the tracer (see tracing.py)."""
+    return getattr(node, "node_class_name", type(node).__name__)
+
+
+class SharedLoaderCache:
+    """
+    Process-wide, reference-counted cache for the results of loader nodes.
+
+    Workflows that load the same model with the same arguments (e.g. the Janus model in
+    FLUX_Kontext and IP_Adapter_SDXL) get the same result object instead of a second copy.
+    Every workflow that requested an entry is recorded as an owner; the entry is dropped
+    once the last owner released it, so shared models survive a workflow switch as long as
+    any loaded workflow still uses them.
+
+    Only calls whose arguments are plain values (strings, numbers, booleans) are cached.
+    Loaders that take another model as input (e.g. LoraLoader) are simply executed.
+    """
+
+    CACHEABLE_TYPES = (str, int, float, bool, type(None))
+
+    def __init__(self):
+        self.entries = {}  # key -> {"result": loader result, "owners": set of workflow names}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def load(self, owner: str, loader: Any, method: str, **kwargs) -> Any:
+        """
+        Calls `loader.method(**kwargs)`, or returns the cached result of an identical earlier call.
+
+        Args:
+            owner: The name of the workflow requesting the model.
+            loader: The loader node instance, e.g. NODE_CLASS_MAPPINGS["VAELoader"]().
+            method: The name of the loader's function, e.g. "load_vae".
+            **kwargs: The arguments for the loader function.
+
+        Returns:
+            The loader's result.
+        """
+        if not all(isinstance(value, self.CACHEABLE_TYPES) for value in kwargs.values()):
+            return getattr(loader, method)(**kwargs)
+
+        loader_name = node_class_name(loader)
+        key = (loader_name, method, tuple(sorted(kwargs.items())))
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["owners"].add(owner)
+                self.hits += 1
+                print(f"Reusing {loader_name} result for {owner} (shared with {', '.join(sorted(entry['owners'] - {owner})) or 'nobody'})")
+                return entry["result"]
+
+        # Load outside the lock, loading a model can take a long time
+        result = getattr(loader, method)(**kwargs)
+        with self._lock:
+            entry = self.entries.setdefault(key, {"result": result, "owners": set()})
+            entry["owners"].add(owner)
+            self.misses += 1
+            return entry["result"]
+
+    def release(self, owner: str) -> int:
+        """
+        Removes an owner from all entries and drops the entries nobody uses anymore.
+
+        Returns:
+            int: The number of dropped entries.
+        """
+        with self._lock:
+            dropped = 0
+            for key in list(self.entries):
+                owners = self.entries[key]["owners"]
+                owners.discard(owner)
+                if not owners:
+                    del self.entries[key]
+                    dropped += 1
+            return dropped
+
+    def shared_results(self, owners) -> list:
+        """Returns the cached results that are in use by any of the given owners."""
+        with self._lock:
+            return [entry["result"] for entry in self.entries.values() if entry["owners"] & set(owners)]
+
+
+# The single cache instance shared by all workflows of this process
+shared_loader_cache = SharedLoaderCache()
+
+
+class ConditioningCache:
+    """
+    Bounded LRU cache for text conditionings.
+
+    Workflows encode the same static prompts (negative prompts, style texts) for every job.
+    The cache keys each result by the encoder node, the CLIP/T5 model and the text, so only
+    genuinely new text has to run through the text encoder. The model is tracked with a weak
+    reference: once a model is unloaded, its entries can never be returned for a new model
+    that happens to get the same id(). Entries remember the workflows that encoded them, so
+    the entries of an unloaded workflow are dropped with it (see `release`).
+    """
+
+    def __init__(self, max_entries: int = 64):
+        """
+        Args:
+            max_entries: The number of conditionings kept before the least recently used one is dropped.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (encoder, id(clip), text) -> (weak reference to clip, conditioning, owners)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def encode(self, encoder: Any, clip: Any, text: str, owner: str = None) -> Any:
+        """
+        Returns `encoder.encode(clip=clip, text=text)`, computing it only if it is not cached.
+
+        Args:
+            encoder: The text encode node instance, e.g. NODE_CLASS_MAPPINGS["CLIPTextEncode"]().
+            clip: The CLIP/T5 model the text is encoded with.
+            text: The prompt.
+            owner: The name of the workflow that uses the conditioning. Entries without an
+                owner are only dropped when the cache is full.
+
+        Returns:
+            The encoder's result, e.g. a tuple containing the conditioning.
+        """
+        key = (node_class_name(encoder), id(clip), text)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0]() is clip:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if owner is not None:
+                    entry[2].add(owner)
+                return entry[1]
+
+        result = encoder.encode(clip=clip, text=text)
+        try:
+            clip_ref = weakref.ref(clip)
+        except TypeError:
+            # Without a weak reference we can't tell a reused id() apart, so don't cache
+            return result
+
+        with self._lock:
+            self.misses += 1
+            self.entries[key] = (clip_ref, result, {owner} if owner is not None else set())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+    def release(self, owner: str) -> int:
+        """
+        Removes an owner from all entries and drops the entries no other workflow uses.
+
+        Returns:
+            int: The number of dropped entries.
+        """
+        with self._lock:
+            dropped = 0
+            for key in list(self.entries):
+                owners = self.entries[key][2]
+                if owner in owners:
+                    owners.discard(owner)
+                    if not owners:
+                        del self.entries[key]
+                        dropped += 1
+            return dropped
+
+
+# The single conditioning cache shared by all workflows of this process
+conditioning_cache = ConditioningCache()
+
+
+class BatchNoise:
+    """
+    Noise source for SamplerCustomAdvanced that gives every image of a batch its own seed.
+
+    The noise of each image is exactly the noise a single-image run with that seed would use,
+    so batching does not change the results of a job.
+    """
+
+    def __init__(self, seeds: list):
+        self.seeds = list(seeds)
+        self.seed = self.seeds[0]  # Read by ComfyUI for previews and logging
+
+    def generate_noise(self, input_latent: dict):
+        import torch
+        import comfy.sample
+
+        samples = input_latent["samples"]
+        return torch.cat([
+            comfy.sample.prepare_noise(samples[i:i + 1], seed)
+            for i, seed in enumerate(self.seeds)
+        ])
+
+
+# Set once import_custom_nodes set up ComfyUI's nodes; workers forked by the fork server inherit it
+_custom_nodes_imported = False
+
+# Temporary files created by get_path_from_bytes that have not been deleted yet
+_temp_files = set()
+
+
+@atexit.register
+def _remove_temp_files():
+    for path in list(_temp_files):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 
 class Functions:
     def __init__(self):
@@ -47,10 +268,20 @@ class Functions:
         """
         Recursively looks at parent folders starting from the given path until it finds the given name.
         Returns the path as a Path object if found, or None otherwise.
+
+        Searches from the current working directory are remembered in the startup cache,
+        so the next start doesn't have to list all parent folders again.
         """
         # If no starting path is provided, use the current working directory
         if path is None:
-            path = os.getcwd()
+            cache_key = f"{name}@{os.getcwd()}"
+            cached = startup_cache.get("paths", {}).get(cache_key)
+            if cached is not None and os.path.exists(cached):
+                return cached
+            path_name = self.find_path(name, os.getcwd())
+            if path_name is not None:
+                startup_cache.set("paths", dict(startup_cache.get("paths", {}), **{cache_key: path_name}))
+            return path_name
 
         # Check if the target name exists in the current directory
         if name in os.listdir(path):
@@ -69,6 +300,57 @@ class Functions:
         return self.find_path(name, parent_directory)
 
 
+    def load_shared(self, owner: str, loader: Any, method: str, **kwargs) -> Any:
+        """
+        Runs a loader node through the process-wide cache, so identical models are only loaded once.
+
+        Models loaded with load_shared are reused by other workflows loading the same file with the
+        same arguments, and stay loaded as long as any loaded workflow uses them. Pass the workflow's
+        `shared_owner` (its class name), so its models are released when it is unloaded.
+
+        Example:
+            vaeloader_32 = load_shared("FLUX_Kontext", vaeloader, "load_vae", vae_name="ae.safetensors")
+
+        Args:
+            owner: The name of the workflow requesting the model.
+            loader: The loader node instance.
+            method: The name of the loader's function.
+            **kwargs: The arguments for the loader function.
+
+        Returns:
+            The loader's result, possibly shared with other workflows.
+        """
+        return shared_loader_cache.load(owner, loader, method, **kwargs)
+
+
+    def encode_text(self, encoder: Any, clip: Any, text: str, owner: str = None) -> Any:
+        """
+        Encodes a prompt through the process-wide conditioning cache.
+
+        Use it for texts that repeat between jobs (negative prompts, style prompts) and call it
+        once in 'load_once' to pre-warm the cache. Per-job texts like captions can still be
+        encoded directly.
+
+        Example:
+            cliptextencode_66 = encode_text(cliptextencode, get_value_at_index(dualcliploader_45, 0), "low quality", shared_owner)
+
+        Args:
+            encoder: The text encode node instance.
+            clip: The CLIP/T5 model.
+            text: The prompt.
+            owner: The workflow name (`shared_owner`), so its conditionings are freed when it is unloaded.
+
+        Returns:
+            The encoder's result, possibly from the cache.
+        """
+        return conditioning_cache.encode(encoder, clip, text, owner)
+
+
+    def release_shared(self, owner: str) -> int:
+        """Releases all cached models of a workflow. Models other workflows still use are kept."""
+        return shared_loader_cache.release(owner)
+
+
     def add_comfyui_directory_to_sys_path(self) -> None:
         """
         Add 'ComfyUI' to the sys.path
@@ -108,21 +390,33 @@ class Functions:
             print("Could not find the extra_model_paths config file.")
 
 
-    def import_custom_nodes(self) -> None:
+    def import_custom_nodes(self, required_types: set = None) -> None:
         """Find all custom nodes in the custom_nodes folder and add those node objects to NODE_CLASS_MAPPINGS
 
         This function sets up a new asyncio event loop, initializes the PromptServer,
         creates a PromptQueue, and initializes the custom nodes.
+
+        Args:
+            required_types: The node types the workflows use (see startup.required_node_types).
+                If given, only the custom node packs that define them are imported, looked up in
+                an index of which pack defines which node. Without it, every pack is imported.
         """
         try:
             import asyncio
             import execution
-            from nodes import init_extra_nodes
+            import nodes
             import server
         except ImportError as e:
             print(f"Could not import required modules for custom nodes: {e}")
             return
 
+        # The fork server may have imported them already, before forking this worker
+        global _custom_nodes_imported
+        if _custom_nodes_imported and required_types is not None and set(required_types) <= set(nodes.NODE_CLASS_MAPPINGS):
+            print("Custom nodes are already imported")
+            return
+        _custom_nodes_imported = True
+
         # A new asyncio event loop is required for the server and queue setup
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
@@ -131,45 +425,100 @@ class Functions:
         server_instance = server.PromptServer(loop)
         execution.PromptQueue(server_instance)
 
-        # This function discovers and registers the custom nodes
-        init_extra_nodes()
+        # Newer ComfyUI versions load nodes in coroutines
+        def run(result):
+            return loop.run_until_complete(result) if inspect.isawaitable(result) else result
 
+        if required_types is None:
+            # This function discovers and registers the custom nodes
+            run(nodes.init_extra_nodes())
+            return
 
+        # ComfyUI's own extra nodes (comfy_extras) are always loaded
+        try:
+            run(nodes.init_extra_nodes(init_custom_nodes=False))
+        except TypeError:
+            print("This ComfyUI version can't skip custom nodes, importing all of them")
+            run(nodes.init_extra_nodes())
+            return
 
+        missing = set(required_types) - set(nodes.NODE_CLASS_MAPPINGS)
+        if not missing:
+            print("The workflows only use built-in nodes, no custom node packs imported")
+            return
 
-    def converte_image(self, generatedImage: Any) -> io.BytesIO:
+        packs = self.custom_node_packs()
+        builtin_types = set(nodes.NODE_CLASS_MAPPINGS)
+        # The index is valid as long as no pack was added, removed or changed at its top level
+        fingerprint = {name: os.stat(path).st_mtime for name, path in packs.items()}
+        index = startup_cache.get("node_index", {})
+        node_packs = index.get("nodes", {}) if index.get("packs") == fingerprint else {}
+
+        loaded = set()
+        if missing <= set(node_packs):
+            for name in sorted({node_packs[node_type] for node_type in missing}):
+                run(nodes.load_custom_node(packs[name], ignore=builtin_types))
+                loaded.add(name)
+            missing -= set(nodes.NODE_CLASS_MAPPINGS)
+            print(f"Imported {len(loaded)} of {len(packs)} custom node pack(s): {', '.join(sorted(loaded))}")
+            if not missing:
+                return
+            print(f"Node index is out of date, {sorted(missing)} not found")
+
+        # Import every other pack and remember which node types it defines
+        print(f"Indexing {len(packs)} custom node pack(s)...")
+        node_packs = {node_type: pack for node_type, pack in node_packs.items() if pack in loaded}
+        for name, path in packs.items():
+            if name in loaded:
+                continue
+            known_types = set(nodes.NODE_CLASS_MAPPINGS)
+            run(nodes.load_custom_node(path, ignore=builtin_types))
+            for node_type in set(nodes.NODE_CLASS_MAPPINGS) - known_types:
+                node_packs[node_type] = name
+        startup_cache.set("node_index", {"packs": fingerprint, "nodes": node_packs})
+
+        missing -= set(nodes.NODE_CLASS_MAPPINGS)
+        if missing:
+            print(f"Warning: no custom node pack defines {sorted(missing)}")
+
+
+    def custom_node_packs(self) -> dict:
+        """Returns the installed custom node packs (folders or single .py files) by name, like ComfyUI finds them."""
+        import folder_paths
+        packs = {}
+        for custom_nodes_dir in folder_paths.get_folder_paths("custom_nodes"):
+            if not os.path.isdir(custom_nodes_dir):
+                continue
+            for name in sorted(os.listdir(custom_nodes_dir)):
+                path = os.path.join(custom_nodes_dir, name)
+                if name.startswith(".") or name == "__pycache__" or name.endswith(".disabled"):
+                    continue
+                if os.path.isfile(path) and not name.endswith(".py"):
+                    continue
+                packs.setdefault(name, path)
+        return packs
+
+
+
+
+    def converte_image(self, generatedImage: Any):
         """
-        Converts a generated image tensor into a PNG byte buffer.
+        Converts a generated image tensor into an encoded image buffer.
+
+        The tensor is converted to uint8 on the GPU before it is copied to the host, and the
+        encoding (PNG, WebP or JPEG, see encoding.py) runs in a background thread. The returned
+        buffer behaves like io.BytesIO: `getvalue()` waits for the encoder if necessary.
 
         Args:
             generatedImage: The raw output from a ComfyUI node, typically a PyTorch tensor.
 
         Returns:
-            An in-memory binary buffer (io.BytesIO) containing the PNG image data.
+            An EncodedImage with `getvalue()`, `filename` and `content_type`.
         """
         # Extract the tensor from the potentially nested result
         image = self.get_value_at_index(generatedImage, 0)
-        # Move tensor to CPU and convert to a NumPy array
-        arr = image.cpu().numpy()
-
-        # Remove singleton dimensions (e.g., [1, H, W, C] -> [H, W, C])
-        arr = np.squeeze(arr)
-
-        # Transpose if the channel is the first dimension (e.g., [C, H, W] -> [H, W, C])
-        if arr.ndim == 3 and arr.shape[0] in [1, 3, 4]:
-            arr = np.transpose(arr, (1, 2, 0))
-
-        # Normalize from [0, 1] float to [0, 255] uint8 range
-        arr = np.clip(arr * 255, 0, 255).astype(np.uint8)
-
-        # Create a PIL Image from the array
-        img = Image.fromarray(arr)
-
-        # Save the image to an in-memory buffer as PNG
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format="PNG")
-        img_buffer.seek(0)  # Rewind the buffer to the beginning
-        return img_buffer
+        arr = encoding.tensor_to_uint8(image)
+        return encoding.get_encoder().submit(arr)
 
 
     def format_text_for_field(self, text, line_length=13, lines=3):
@@ -194,18 +543,132 @@ class Functions:
         return "\n".join(wrapped)
     
     
+    def batch_conditioning(self, conditionings: list) -> list:
+        """
+        Stacks the conditionings of several jobs into one conditioning for a batched sampler pass.
+
+        All text embeddings must have the same token length: padding shorter ones would let the
+        sampler attend to the padding tokens, so a batched job would no longer match the same job
+        run alone. Group the jobs by `conditioning[0][0].shape[1]` and sample each group separately.
+        Tensors in the extra data (e.g. pooled outputs or attention masks) are stacked the same way.
+
+        Args:
+            conditionings: One ComfyUI conditioning ([[tensor, dict]]) per job, each for a single image.
+
+        Returns:
+            A conditioning whose batch dimension has one entry per job, in the same order.
+
+        Raises:
+            ValueError: If the embeddings or the tensors of an extra differ in shape between the jobs.
+        """
+        import torch
+
+        tensors = [conditioning[0][0] for conditioning in conditionings]
+        if any(tensor.shape[1:] != tensors[0].shape[1:] for tensor in tensors):
+            raise ValueError(f"Can't batch conditionings of different shapes: {[tuple(t.shape) for t in tensors]}")
+        stacked = torch.cat(tensors)
+
+        extras = dict(conditionings[0][0][1])
+        for key, value in extras.items():
+            values = [conditioning[0][1].get(key) for conditioning in conditionings]
+            if not any(isinstance(v, torch.Tensor) for v in values):
+                continue
+            if not all(isinstance(v, torch.Tensor) and v.shape[1:] == values[0].shape[1:] for v in values):
+                raise ValueError(f"Can't batch the '{key}' of the conditionings, it differs in shape between the jobs")
+            extras[key] = torch.cat(values)
+
+        return [[stacked, extras]]
+
+
+    def load_image_from_bytes(self, image_bytes: bytes) -> tuple:
+        """
+        Decodes an image in memory into the output format of ComfyUI's LoadImage node.
+
+        This replaces writing the received image to a temporary file and reading it back with
+        LoadImage: no disk I/O, and nothing is left behind.
+
+        Args:
+            image_bytes: The raw bytes of the image (PNG, JPEG, WebP, ...).
+
+        Returns:
+            A tuple (IMAGE, MASK) like LoadImage returns: the image as a float tensor [1, H, W, 3]
+            in the range 0..1, and the inverted alpha channel as a mask [1, H, W]
+            (an empty 64x64 mask if the image has no alpha channel).
+        """
+        import torch
+        from PIL import ImageOps
+
+        img = Image.open(io.BytesIO(image_bytes))
+        # Apply the EXIF orientation, phone photos are often stored rotated
+        img = ImageOps.exif_transpose(img)
+
+        if img.mode == "I":
+            img = img.point(lambda i: i * (1 / 255))
+        if img.mode == "P" and "transparency" in img.info:
+            img = img.convert("RGBA")
+
+        image = np.array(img.convert("RGB")).astype(np.float32) / 255.0
+        image = torch.from_numpy(image)[None,]
+
+        if "A" in img.getbands():
+            mask = np.array(img.getchannel("A")).astype(np.float32) / 255.0
+            mask = 1.0 - torch.from_numpy(mask)
+        else:
+            mask = torch.zeros((64, 64), dtype=torch.float32, device="cpu")
+
+        return (image, mask.unsqueeze(0))
+
+
+    @contextmanager
+    def temp_image_file(self, image_bytes: bytes):
+        """
+        Writes image bytes to a temporary file for nodes that only accept a path, and deletes it afterwards.
+
+        Example:
+            with temp_image_file(image_bytes) as tmp_path:
+                loadimage_17 = loadimage.load_image(image=tmp_path)
+
+        Args:
+            image_bytes: The raw bytes of the image.
+
+        Yields:
+            The path to the temporary file. Its suffix matches the actual image format.
+        """
+        tmp_path = self.get_path_from_bytes(image_bytes)
+        try:
+            yield tmp_path
+        finally:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            _temp_files.discard(tmp_path)
+
+
     def get_path_from_bytes(self, image_bytes: bytes) -> str:
         """
         Saves image bytes to a temporary file and returns the file path.
         This is useful when a node or function requires a file path instead of in-memory data.
 
+        Prefer `load_image_from_bytes`, or `temp_image_file` if a path is really needed.
+        Files created here are deleted when the program exits at the latest.
+
         Args:
             image_bytes: The raw bytes of the image.
 
         Returns:
             The absolute path to the newly created temporary image file.
         """
-        # Create a temporary file that is not deleted on close, with a .png suffix
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
+        # Name the file after the real format, so nodes that look at the suffix are not misled
+        try:
+            suffix = "." + (Image.open(io.BytesIO(image_bytes)).format or "png").lower()
+        except Exception:
+            suffix = ".png"
+        if suffix == ".jpeg":
+            suffix = ".jpg"
+
+        # Create a temporary file that is not deleted on close
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
             tmp.write(image_bytes)
-            return tmp.name
+        _temp_files.add(tmp.name)
+        return tmp.name
@@ -0,0 +1,404 @@
+import asyncio
+import inspect
+import json
+import math
+import os
+import random
+from collections import defaultdict
+
+import torch
+
+from functions import node_class_name
+
+# The exported ComfyUI workflows (UI format, saved with "Export" in ComfyUI)
+WORKFLOWS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Workflows")
+
+# Node modes in the exported graph
+MODE_MUTED = 2   # The node and everything that needs it is skipped
+MODE_BYPASS = 4  # The node passes its inputs through to its outputs
+
+# Input types that are shown as widgets and therefore have an entry in `widgets_values`
+WIDGET_TYPES = {"INT", "FLOAT", "STRING", "BOOLEAN", "COMBO"}
+
+# Values of the "control after generate" widget that change the seed for every run
+RANDOM_CONTROLS = {"randomize", "increment", "decrement"}
+SEED_MAX = 0xffffffffffffffff
+
+# Values the hidden inputs of a node get, there is no prompt server that could provide them
+HIDDEN_INPUTS = {"PROMPT": {}, "EXTRA_PNGINFO": {}, "DYNPROMPT": None}
+
+
+def _run_awaitable(result):
+    """Nodes of the newer ComfyUI API may be coroutines, run them to completion."""
+    if not inspect.isawaitable(result):
+        return result
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(result)
+    finally:
+        loop.close()
+
+
+class _AwaitedNode:
+    """
+    Wraps a node for the shared loader cache, so a coroutine result is awaited before it is cached.
+
+    Otherwise the cache would store the coroutine itself, and the next workflow that gets it
+    from the cache would await it a second time.
+    """
+
+    def __init__(self, node):
+        self._node = node
+        self.node_class_name = node_class_name(node)  # The cache key stays the one of the node
+
+    def __getattr__(self, name):
+        function = getattr(self._node, name)
+        return lambda **kwargs: _run_awaitable(function(**kwargs))
+
+
+class WorkflowGraph:
+    """
+    The structure of an exported ComfyUI workflow: its nodes, links and the image it produces.
+
+    Only the JSON is read, so this works before ComfyUI and the custom nodes are imported
+    (e.g. to find the node types the workflow needs). Frontend-only nodes are resolved here:
+    Reroutes are followed, PrimitiveNodes become plain values, bypassed nodes pass their
+    matching input through and muted nodes are left out.
+    """
+
+    def __init__(self, data: dict, output: int = None):
+        """
+        Args:
+            data: The parsed workflow JSON.
+            output: The id of the SaveImage node whose image is the result. Defaults to the
+                only SaveImage node that is neither muted nor bypassed.
+        """
+        self.nodes = {node["id"]: node for node in data["nodes"]}
+        self.links = {link[0]: (link[1], link[2]) for link in data["links"]}  # link id -> (source node, output slot)
+        self.output = self._find_output(output)  # (node, output slot) of the final image
+
+    @classmethod
+    def from_file(cls, path: str, output: int = None) -> "WorkflowGraph":
+        """Loads a workflow JSON, relative paths are looked up in the 'Workflows' directory."""
+        if not os.path.isabs(path):
+            path = os.path.join(WORKFLOWS_DIR, path)
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), output)
+
+    def _find_output(self, output: int = None) -> tuple:
+        if output is None:
+            candidates = [node_id for node_id, node in self.nodes.items()
+                          if node["type"] == "SaveImage" and node.get("mode", 0) not in (MODE_MUTED, MODE_BYPASS)]
+            if len(candidates) != 1:
+                raise ValueError(f"Expected exactly one active SaveImage node, found {len(candidates)}; pass 'output'")
+            output = candidates[0]
+        if output not in self.nodes:
+            raise ValueError(f"Output node {output} is not part of the workflow")
+        source = self.resolve_input(output, "images")
+        if source is None or source[0] != "node":
+            raise ValueError(f"Output node {output} has no image connected")
+        return source[1], source[2]
+
+    def resolve_link(self, link_id: int):
+        """
+        Follows a link back to the node that actually produces the value.
+
+        Returns:
+            ("node", node id, output slot), ("value", value, randomized) for PrimitiveNodes,
+            or None if the link is missing or comes from a muted node.
+        """
+        if link_id is None or link_id not in self.links:
+            return None
+        node_id, slot = self.links[link_id]
+        node = self.nodes[node_id]
+        mode = node.get("mode", 0)
+
+        if node["type"] == "PrimitiveNode":
+            values = node.get("widgets_values") or [None]
+            randomized = len(values) > 1 and values[1] in RANDOM_CONTROLS
+            return "value", values[0], randomized
+        if node["type"] == "Reroute":
+            return self.resolve_link(node["inputs"][0].get("link"))
+        if mode == MODE_MUTED:
+            return None
+        if mode == MODE_BYPASS:
+            # Like the ComfyUI frontend: the first connected input of the same type takes the output's place
+            output_type = node["outputs"][slot]["type"]
+            for node_input in node.get("inputs", []):
+                if node_input["type"] == output_type and node_input.get("link") is not None:
+                    return self.resolve_link(node_input["link"])
+            return None
+        return "node", node_id, slot
+
+    def resolve_input(self, node_id: int, name: str):
+        """Resolves the link connected to the named input of a node (see `resolve_link`)."""
+        for node_input in self.nodes[node_id].get("inputs", []):
+            if node_input["name"] == name:
+                return self.resolve_link(node_input.get("link"))
+        return None
+
+    def connections(self, node_id: int) -> dict:
+        """Returns the resolved sources of all connected inputs of a node: input name -> source."""
+        result = {}
+        for node_input in self.nodes[node_id].get("inputs", []):
+            source = self.resolve_link(node_input.get("link"))
+            if source is not None:
+                result[node_input["name"]] = source
+        return result
+
+    def required_nodes(self) -> set:
+        """Returns the nodes the output depends on. Previews and other side branches are left out."""
+        required = set()
+        pending = [self.output[0]]
+        while pending:
+            node_id = pending.pop()
+            if node_id in required:
+                continue
+            required.add(node_id)
+            pending.extend(source[1] for source in self.connections(node_id).values() if source[0] == "node")
+        return required
+
+    def node_types(self) -> set:
+        """Returns the node types that are executed, e.g. to decide which custom nodes to import."""
+        return {self.nodes[node_id]["type"] for node_id in self.required_nodes()}
+
+    def topological_order(self, node_ids) -> list:
+        """
+        Orders the given nodes so that every node comes after the nodes it depends on.
+
+        Raises:
+            ValueError: If the nodes contain a cycle.
+        """
+        node_ids = set(node_ids)
+        dependents = defaultdict(set)
+        missing = {}
+        for node_id in node_ids:
+            sources = {source[1] for source in self.connections(node_id).values()
+                       if source[0] == "node" and source[1] in node_ids}
+            missing[node_id] = len(sources)
+            for source in sources:
+                dependents[source].add(node_id)
+
+        ready = sorted(node_id for node_id, count in missing.items() if count == 0)
+        order = []
+        while ready:
+            node_id = ready.pop(0)
+            order.append(node_id)
+            for dependent in sorted(dependents[node_id]):
+                missing[dependent] -= 1
+                if missing[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) != len(node_ids):
+            raise ValueError(f"The workflow contains a cycle between nodes {sorted(node_ids - set(order))}")
+        return order
+
+
+def widget_inputs(node_class) -> list:
+    """
+    Returns the widget inputs of a node class in the order of `widgets_values`.
+
+    Every entry is (input name, input options, number of extra widget values that follow), e.g.
+    the "control after generate" value after a seed or the upload button after LoadImage's image.
+    """
+    spec = node_class.INPUT_TYPES()
+    result = []
+    for section in ("required", "optional"):
+        for name, config in spec.get(section, {}).items():
+            input_type = config[0]
+            options = config[1] if len(config) > 1 and isinstance(config[1], dict) else {}
+            if not (isinstance(input_type, (list, tuple)) or input_type in WIDGET_TYPES) or options.get("forceInput"):
+                continue
+            extra = 0
+            if options.get("control_after_generate") or (input_type == "INT" and name in ("seed", "noise_seed")):
+                extra += 1
+            if options.get("image_upload"):
+                extra += 1
+            result.append((name, options, extra))
+    return result
+
+
+class GraphWorkflow:
+    """
+    Runs an exported ComfyUI workflow directly, without a hand-ported script.
+
+    The graph is split automatically:
+    - Per-job nodes: the node that receives the job's image, nodes with per-job inputs (see
+      `inputs`), nodes with a randomized seed, nodes that report themselves as always changed,
+      and every node that depends on one of them. They run in `generate()`.
+    - Static nodes: everything else (model loaders, fixed prompts, reference images, ...).
+      They run once in `load_once()` and their results are reused for every job. Static nodes
+      without connected inputs go through the shared loader cache, like `load_shared` in the scripts.
+
+    It has the same interface as the workflow scripts (`start_load_once`, `generate`, `config`),
+    so the dispatcher and the residency manager treat both alike.
+    """
+
+    def __init__(self, arg_function, name: str, graph: str, image: int, inputs: dict = None, output: int = None):
+        """
+        Args:
+            arg_function: The shared Functions instance.
+            name: The workflow name, used as owner of shared models.
+            graph: The workflow JSON, relative to the 'Workflows' directory.
+            image: The id of the LoadImage node that receives the job's image.
+            inputs: Per-job widget values, "<node id>.<input name>" -> template, e.g.
+                {"59.text": "{label}"}. Templates can use {label} (the formatted name label),
+                {first_name}, {last_name}, {animal_name} and {animal_type}.
+            output: The id of the SaveImage node, if the graph has more than one.
+        """
+        self.functions = arg_function
+        self.name = name
+        self.graph = WorkflowGraph.from_file(graph, output)
+        self.image_node = image
+        self.job_inputs = defaultdict(dict)  # node id -> {input name: template}
+        for key, template in (inputs or {}).items():
+            node_id, _, input_name = key.partition(".")
+            self.job_inputs[int(node_id)][input_name] = template
+
+        if self.image_node not in self.graph.nodes:
+            raise ValueError(f"Image node {self.image_node} is not part of the workflow {graph}")
+        for node_id in self.job_inputs:
+            if node_id not in self.graph.nodes:
+                raise ValueError(f"Input node {node_id} is not part of the workflow {graph}")
+
+    def start_load_once(self):
+        self.config = self.load_once()
+
+    def _node_class(self, node_type: str):
+        # dict.get, because NODE_CLASS_MAPPINGS may be traced (see tracing.py) and return factories
+        node_class = dict.get(self.NODE_CLASS_MAPPINGS, node_type)
+        if node_class is None:
+            raise ValueError(f"Node type '{node_type}' used by {self.name} is not available, is its custom node pack installed?")
+        return node_class
+
+    def _plan_node(self, node_id: int) -> dict:
+        """Collects the inputs of a node: connected nodes, widget values, seeds and per-job templates."""
+        node = self.graph.nodes[node_id]
+        node_class = self._node_class(node["type"])
+        connections = self.graph.connections(node_id)
+        saved = node.get("widgets_values") or []
+
+        plan = {"links": {}, "values": {}, "random": {}, "templates": dict(self.job_inputs.get(node_id, {}))}
+        # Widget values first, a connected input replaces them below
+        position = 0
+        for name, options, extra in widget_inputs(node_class):
+            if isinstance(saved, dict):  # Some custom nodes save their widgets by name
+                if name in saved:
+                    plan["values"][name] = saved[name]
+                continue
+            if position >= len(saved):
+                break
+            plan["values"][name] = saved[position]
+            if extra and isinstance(saved[position], int) and position + 1 < len(saved) \
+                    and saved[position + 1] in RANDOM_CONTROLS:
+                plan["random"][name] = options.get("max", SEED_MAX)
+            position += 1 + extra
+        if isinstance(saved, list) and position < len(saved):
+            print(f"Warning: {self.name} node {node_id} ({node['type']}) has {len(saved) - position} unused widget values, "
+                  f"the installed node may differ from the exported one")
+
+        for name, source in connections.items():
+            plan["values"].pop(name, None)
+            plan["random"].pop(name, None)
+            if source[0] == "node":
+                plan["links"][name] = (source[1], source[2])
+            else:
+                plan["values"][name] = source[1]
+                if source[2]:
+                    plan["random"][name] = SEED_MAX
+
+        hidden = node_class.INPUT_TYPES().get("hidden", {})
+        for name, hidden_type in hidden.items():
+            plan["values"][name] = str(node_id) if hidden_type == "UNIQUE_ID" else HIDDEN_INPUTS.get(hidden_type)
+        return plan
+
+    def _always_changes(self, node_class, plan: dict) -> bool:
+        """True if the node's IS_CHANGED says it has to run every time (it returns NaN then)."""
+        if not hasattr(node_class, "IS_CHANGED") or plan["links"]:
+            return False
+        try:
+            result = node_class.IS_CHANGED(**plan["values"])
+        except Exception:
+            return False
+        return isinstance(result, float) and math.isnan(result)
+
+    def _run_node(self, node_id: int, results: dict, job_values: dict, shared: bool = False):
+        """Executes a node with its inputs taken from `results` and returns its outputs."""
+        plan = self.plans[node_id]
+        kwargs = dict(plan["values"])
+        for name, (source, slot) in plan["links"].items():
+            kwargs[name] = self.functions.get_value_at_index(results[source], slot)
+        for name, maximum in plan["random"].items():
+            kwargs[name] = random.randint(0, maximum)
+        for name, template in plan["templates"].items():
+            kwargs[name] = template.format(**job_values) if isinstance(template, str) else template
+
+        node = self.instances[node_id]
+        method = self._node_class(self.graph.nodes[node_id]["type"]).FUNCTION
+        if shared:
+            result = self.functions.load_shared(self.name, _AwaitedNode(node), method, **kwargs)
+        else:
+            result = _run_awaitable(getattr(node, method)(**kwargs))
+        # Nodes of the newer ComfyUI API return a NodeOutput object
+        if hasattr(result, "result") and not isinstance(result, (tuple, list, dict)):
+            result = result.result
+        return result
+
+    def load_once(self):
+        # --- Split the graph ---
+        required = self.graph.required_nodes()
+        order = self.graph.topological_order(required)
+        if self.image_node not in required:
+            print(f"Warning: the output of {self.name} does not depend on the job image (node {self.image_node})")
+
+        self.plans = {}
+        self.instances = {}
+        per_job = set()
+        for node_id in order:
+            node_class = self._node_class(self.graph.nodes[node_id]["type"])
+            plan = self._plan_node(node_id)
+            self.plans[node_id] = plan
+            self.instances[node_id] = self.NODE_CLASS_MAPPINGS[self.graph.nodes[node_id]["type"]]()
+            if node_id == self.image_node or plan["random"] or plan["templates"] \
+                    or any(source in per_job for source, _ in plan["links"].values()) \
+                    or self._always_changes(node_class, plan):
+                per_job.add(node_id)
+        self.per_job_order = [node_id for node_id in order if node_id in per_job]
+        static_order = [node_id for node_id in order if node_id not in per_job]
+        print(f"{self.name}: {len(static_order)} static node(s) run once, {len(self.per_job_order)} per job")
+
+        # --- Run the static part ---
+        static_outputs = {}
+        with torch.inference_mode():
+            for node_id in static_order:
+                plan = self.plans[node_id]
+                shared = not plan["links"]
+                static_outputs[node_id] = self._run_node(node_id, static_outputs, {}, shared=shared)
+
+        # Only what the per-job nodes use is kept, intermediate results are freed
+        used = {source for node_id in self.per_job_order for source, _ in self.plans[node_id]["links"].values()}
+        if self.graph.output[0] not in per_job:
+            used.add(self.graph.output[0])
+        return {"static_outputs": {node_id: static_outputs[node_id] for node_id in used if node_id in static_outputs}}
+
+    def generate(self, workflow_name: str, image_bytes: bytes, animal_type: str, first_name: str, last_name: str, animal_name: str):
+        job_values = {
+            "label": self.functions.format_text_for_field(first_name + " " + last_name + " " + animal_name),
+            "first_name": first_name,
+            "last_name": last_name,
+            "animal_name": animal_name,
+            "animal_type": animal_type,
+        }
+        results = dict(self.config["static_outputs"])
+        with torch.inference_mode():
+            for node_id in self.per_job_order:
+                if node_id == self.image_node:
+                    results[node_id] = self.functions.load_image_from_bytes(image_bytes)
+                else:
+                    results[node_id] = self._run_node(node_id, results, job_values)
+
+            output_node, output_slot = self.graph.output
+            images = self.functions.get_value_at_index(results[output_node], output_slot)
+            # A job uploads exactly one image; converte_image would silently keep only the first of a batch
+            if images.shape[0] != 1:
+                raise ValueError(f"Output node {output_node} of {self.name} returned {images.shape[0]} images, expected 1")
+            return self.functions.converte_image((images,))
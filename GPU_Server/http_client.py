@@ -0,0 +1,200 @@
+import base64
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Set by the fork server for its workers: the access token it obtained, so they don't log in again
+TOKEN_ENV = "IAP_BACKEND_TOKEN"
+
+
+class BackendClient:
+    """
+    The single HTTP layer for all requests to the backend server.
+
+    - Connections are kept alive and pooled, so polling does not open a new TCP/TLS
+      connection for every request. Each thread (GPU loop, fetcher, uploader) gets its own
+      session, as `requests.Session` is not guaranteed to be thread-safe.
+    - The JWT's `exp` claim is decoded and a background thread requests a new token shortly
+      before it expires.
+    - If a request is answered with 401 anyway, the token is refreshed and the request is
+      retried once, transparently for the caller.
+    - Every request has a timeout, so a stalled connection can't block a thread forever.
+    """
+
+    def __init__(self, base_url: str, password: str, pool_size: int = 4, refresh_margin: float = 300,
+                 timeout: float = 30):
+        """
+        Args:
+            base_url: The URL of the backend server, e.g. "http://localhost:8001".
+            password: The password used to obtain an access token.
+            pool_size: The number of connections kept open per thread.
+            refresh_margin: Seconds before expiry at which the token is refreshed.
+            timeout: Seconds to wait for the server for requests that don't pass their own
+                `timeout`. Must be longer than the long-poll wait.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.password = password
+        self.pool_size = pool_size
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+
+        self.token = None
+        self.token_expiry = None  # Unix timestamp from the JWT's exp claim, None if unknown
+        self._token_lock = threading.Lock()
+        self._local = threading.local()
+        self._sessions = []  # The sessions of all threads, closed by close()
+        self._sessions_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._token_changed = threading.Event()
+        self._refresher = None
+
+    @property
+    def session(self) -> requests.Session:
+        """Returns the pooled session of the calling thread."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def login(self, start_refresher: bool = True) -> str:
+        """
+        Obtains a new access token and starts the background refresher.
+
+        Args:
+            start_refresher: False only fetches the token, e.g. in the fork server, which hands
+                it to its workers (see `use_token`) and must not start threads before forking.
+
+        Raises:
+            requests.HTTPError: If the backend rejects the password or fails.
+        """
+        with self._token_lock:
+            self._request_token()
+        if start_refresher:
+            self._start_refresher()
+        return self.token
+
+    def use_token(self, token: str) -> str:
+        """
+        Uses a token obtained by another process and starts the background refresher.
+
+        An expired token is refreshed right away by the refresher or on the first 401 answer.
+        """
+        with self._token_lock:
+            self.token = token
+            self.token_expiry = self.decode_expiry(token)
+            self._token_changed.set()
+        self._start_refresher()
+        return self.token
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """Sends an authenticated GET request to the backend."""
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """Sends an authenticated POST request to the backend."""
+        return self.request("POST", path, **kwargs)
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Sends an authenticated request. A 401 answer triggers one token refresh and one retry.
+        If the refresh fails, the original 401 response is returned.
+
+        Args:
+            method: The HTTP method, e.g. "GET".
+            path: The path relative to the backend URL, e.g. "/job".
+            **kwargs: Passed on to `requests.Session.request`.
+
+        Returns:
+            The response of the (possibly retried) request.
+        """
+        url = f"{self.base_url}{path}"
+        kwargs.setdefault("timeout", self.timeout)
+        used_token = self.token
+        response = self.session.request(method, url, headers=self._auth_headers(used_token), **kwargs)
+        if response.status_code != 401:
+            return response
+
+        print("Unauthorized, refreshing token...")
+        with self._token_lock:
+            # Another thread may have refreshed the token while our request was in flight
+            if self.token == used_token:
+                try:
+                    self._request_token()
+                except Exception as e:
+                    # Leave the 401 to the caller instead of letting the refresh error look like a job failure
+                    print(f"Token refresh failed: {e}")
+                    return response
+        return self.session.request(method, url, headers=self._auth_headers(self.token), **kwargs)
+
+    def close(self):
+        """Stops the background refresher and closes the pooled connections of all threads."""
+        self._stop.set()
+        self._token_changed.set()
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+
+    def _auth_headers(self, token: str) -> dict:
+        return {"Authorization": f"Bearer {token}"}
+
+    def _request_token(self):
+        """Requests a new token from /token. The caller must hold the token lock."""
+        response = self.session.post(f"{self.base_url}/token", data={"password": self.password}, timeout=self.timeout)
+        response.raise_for_status()  # Raise an exception for HTTP errors (e.g., 401, 500)
+        self.token = response.json()["access_token"]
+        self.token_expiry = self.decode_expiry(self.token)
+        self._token_changed.set()
+
+    def _start_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        """Refreshes the token `refresh_margin` seconds before it expires."""
+        while not self._stop.is_set():
+            self._token_changed.clear()
+            if self.token_expiry is None:
+                # Without an exp claim there is nothing to schedule; 401 answers are still handled
+                self._token_changed.wait()
+                continue
+
+            # Wake up early if the token was refreshed elsewhere (e.g. after a 401)
+            delay = max(10, self.token_expiry - self.refresh_margin - time.time())
+            if self._token_changed.wait(delay):
+                continue
+
+            try:
+                with self._token_lock:
+                    self._request_token()
+                print("Access token refreshed")
+            except Exception as e:
+                print(f"Failed to refresh access token: {e}. Retrying in 30 seconds...")
+                self._stop.wait(30)
+
+    @staticmethod
+    def decode_expiry(token: str):
+        """
+        Reads the `exp` claim from a JWT without verifying the signature.
+
+        Returns:
+            The expiry as a Unix timestamp, or None if the token has no readable exp claim.
+        """
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)  # Restore the base64 padding JWTs strip off
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+            return float(claims["exp"])
+        except (IndexError, KeyError, TypeError, ValueError):
+            return None
@@ -0,0 +1,200 @@
+import datetime
+import re
+import time
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# "Sat 09:00-17:00", "Mon-Fri 14:00-18:00", "2025-07-12 09:00-17:00" or "09:00-17:00" (every day)
+SCHEDULE_PATTERN = re.compile(
+    r"^\s*(?:(?P<days>[A-Za-z]{3}(?:-[A-Za-z]{3})?|\d{4}-\d{2}-\d{2})\s+)?"
+    r"(?P<start>\d{1,2}:\d{2})\s*-\s*(?P<end>\d{1,2}:\d{2})\s*$"
+)
+
+
+class OpeningHours:
+    """
+    The times visitors are expected, e.g. the opening hours of the Teddy Bear Hospital.
+
+    Every entry is a time range in local time, optionally limited to a weekday, a range of
+    weekdays or a date: "Sat 09:00-17:00", "Mon-Fri 14:00-18:00", "2025-07-12 09:00-17:00".
+    An entry without a day applies to every day.
+    """
+
+    def __init__(self, entries):
+        self.windows = []  # (set of weekdays or a date, start time, end time)
+        for entry in entries:
+            match = SCHEDULE_PATTERN.match(entry)
+            if match is None:
+                raise ValueError(f"Invalid opening hours '{entry}', expected e.g. 'Sat 09:00-17:00'")
+            start = datetime.datetime.strptime(match["start"], "%H:%M").time()
+            end = datetime.datetime.strptime(match["end"], "%H:%M").time()
+            self.windows.append((self._parse_days(match["days"]), start, end))
+
+    @staticmethod
+    def _parse_days(days):
+        if days is None:
+            return set(range(7))
+        if days[0].isdigit():
+            return datetime.date.fromisoformat(days)
+        first, _, last = days.lower().partition("-")
+        if first not in WEEKDAYS or (last and last not in WEEKDAYS):
+            raise ValueError(f"Invalid weekday in '{days}', expected e.g. 'Mon' or 'Mon-Fri'")
+        first, last = WEEKDAYS.index(first), WEEKDAYS.index(last or first)
+        return {day % 7 for day in range(first, last + 1 if last >= first else last + 8)}
+
+    def occurrences(self, now: datetime.datetime):
+        """Returns the (start, end) datetimes of all windows from yesterday until a week from now."""
+        result = []
+        for offset in range(-1, 8):
+            date = now.date() + datetime.timedelta(days=offset)
+            for days, start, end in self.windows:
+                if date == days if isinstance(days, datetime.date) else date.weekday() in days:
+                    start_dt = datetime.datetime.combine(date, start)
+                    end_dt = datetime.datetime.combine(date, end)
+                    if end_dt <= start_dt:  # Ends after midnight
+                        end_dt += datetime.timedelta(days=1)
+                    result.append((start_dt, end_dt))
+        return result
+
+    def is_open(self, now: datetime.datetime) -> bool:
+        return any(start <= now < end for start, end in self.occurrences(now))
+
+    def next_opening(self, now: datetime.datetime):
+        """Returns the start of the next window, or None if there is none within a week."""
+        starts = [start for start, _ in self.occurrences(now) if start > now]
+        return min(starts) if starts else None
+
+
+class IdlePolicy:
+    """
+    Decides how long the worker waits between empty polls and how far it powers down while idle.
+
+    Everything is based on the wall-clock time since the last activity (a job, a pre-warm or
+    the end of the opening hours), so slow requests or long polls don't shift the thresholds.
+
+    - Polling backs off exponentially: after every empty poll the interval doubles, from
+      `poll_interval` up to `max_poll_interval`. A job resets it.
+    - Tiers of increasing idle time: "warm" (nothing happens), "offload" (loaded workflows are
+      moved to host RAM), "release" (all VRAM is freed) and "restart" (the worker restarts).
+      Each tier is entered once per idle period; a threshold of None disables the tier.
+    - With opening hours, the worker stays warm and polls at the shortest interval while they
+      last, and pre-warms its workflows `prewarm_minutes` before they begin.
+    """
+
+    TIERS = ("warm", "offload", "release", "restart")
+
+    def __init__(self, poll_interval: float = 2, max_poll_interval: float = 30, offload_after: float = 900,
+                 release_after: float = 1800, restart_after: float = 3600, opening_hours: OpeningHours = None,
+                 prewarm_seconds: float = 600, clock=time.time):
+        """
+        Args:
+            poll_interval: Seconds between polls right after a job.
+            max_poll_interval: Upper limit of the interval after many empty polls.
+            offload_after, release_after, restart_after: Seconds of idle time before the tier is entered.
+            opening_hours: Optional times visitors are expected (see OpeningHours).
+            prewarm_seconds: How long before the opening hours the workflows are loaded.
+            clock: Returns the current Unix time, replaceable for testing.
+        """
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(poll_interval, max_poll_interval)
+        self.thresholds = {"offload": offload_after, "release": release_after, "restart": restart_after}
+        self.opening_hours = opening_hours
+        self.prewarm_seconds = prewarm_seconds
+        self.clock = clock
+
+        self.last_activity = clock()
+        self.empty_polls = 0
+        self.tier = "warm"  # The deepest tier entered in the current idle period
+        self._prewarmed_for = None  # Start of the opening the workflows were pre-warmed for
+
+    @classmethod
+    def from_config(cls, settings: dict) -> "IdlePolicy":
+        """Creates the policy from the [server.idle] table of config.toml (tiers and pre-warm in minutes)."""
+        def minutes(key, default):
+            value = settings.get(key, default)
+            return value * 60 if value else None
+
+        schedule = settings.get("opening_hours", [])
+        return cls(
+            poll_interval=settings.get("poll_interval", 2),
+            max_poll_interval=settings.get("max_poll_interval", 30),
+            offload_after=minutes("offload_after", 15),
+            release_after=minutes("release_after", 30),
+            restart_after=minutes("restart_after", 60),
+            opening_hours=OpeningHours(schedule) if schedule else None,
+            prewarm_seconds=minutes("prewarm_minutes", 10) or 0,
+        )
+
+    def _now(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.clock())
+
+    def is_open(self) -> bool:
+        """True during the opening hours and the pre-warm time before them."""
+        if self.opening_hours is None:
+            return False
+        now = self._now()
+        return self.opening_hours.is_open(now) or self._upcoming_opening(now) is not None
+
+    def _upcoming_opening(self, now: datetime.datetime):
+        """Returns the start of the opening hours if they begin within the pre-warm time."""
+        start = self.opening_hours.next_opening(now)
+        if start is not None and (start - now).total_seconds() <= self.prewarm_seconds:
+            return start
+        return None
+
+    def idle_seconds(self) -> float:
+        return self.clock() - self.last_activity
+
+    def job_received(self):
+        """Resets the idle time, the poll interval and the tier."""
+        self.last_activity = self.clock()
+        self.empty_polls = 0
+        self.tier = "warm"
+
+    def empty_poll(self) -> float:
+        """Records an empty poll and returns the seconds until the next poll should start."""
+        if self.is_open():
+            # Visitors are expected: stay warm and answer quickly
+            self.last_activity = self.clock()
+            self.empty_polls = 0
+            return self.poll_interval
+        self.empty_polls += 1
+        return min(self.max_poll_interval, self.poll_interval * 2 ** (self.empty_polls - 1))
+
+    def due_tier(self):
+        """Returns the deepest tier whose idle time has passed but that was not entered yet, or None."""
+        idle = self.idle_seconds()
+        due = None
+        for tier in self.TIERS[self.TIERS.index(self.tier) + 1:]:
+            threshold = self.thresholds[tier]
+            if threshold is not None and idle >= threshold:
+                due = tier
+        return due
+
+    def entered(self, tier: str):
+        """Marks a tier as entered, once the worker has actually powered down that far."""
+        self.tier = tier
+
+    def should_prewarm(self) -> bool:
+        """True once per opening, when it begins within the pre-warm time."""
+        if self.opening_hours is None:
+            return False
+        start = self._upcoming_opening(self._now())
+        return start is not None and start != self._prewarmed_for
+
+    def prewarmed(self):
+        """Records that the workflows were loaded for the upcoming opening."""
+        self._prewarmed_for = self._upcoming_opening(self._now())
+        self.job_received()
+
+    def describe(self) -> str:
+        """A short status line for the log."""
+        text = f"idle for {self.idle_seconds() / 60:.1f} min, tier {self.tier}"
+        if self.opening_hours is not None:
+            now = self._now()
+            start = self.opening_hours.next_opening(now)
+            if self.opening_hours.is_open(now):
+                text += ", open now"
+            elif start is not None:
+                text += f", opens {start:%a %H:%M}"
+        return text
@@ -1,4 +1,3 @@
-import requests
 import time
 import os
 import click
@@ -6,12 +5,33 @@ import toml
 import sys
 import torch
 import signal
+import socket
 
 from dispatcher import WorkflowDispatcher
+from http_client import BackendClient, TOKEN_ENV
+from pipeline import JobPipeline
+from spool import ResultSpool
+import encoding
+from tracing import NodeTracer
+from metrics import worker_metrics
+from forkserver import ForkServer, FORK_CHILD_ENV
+from idle import IdlePolicy
+from functions import Functions
+from supervisor import Supervisor, RESTART_EXIT_CODE, SUPERVISED_ENV, WORKER_NAME_ENV, WORKER_INDEX_ENV, RESTART_COUNT_ENV
 
 # Global flag to handle clean shutdown via signals like Ctrl+C
 shutdown_requested = False
 
+# Generated results are stored here until the backend has accepted them
+DEFAULT_SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "result_spool")
+DEFAULT_TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces")
+# Image the warm-up run generates from (see warm_up)
+DEFAULT_WARMUP_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testing", "test_images", "test_image.jpg")
+result_spool = None
+
+# Command-line arguments the program was started with, re-used when restarting
+launch_args = sys.argv[1:]
+
 
 def signal_handler(sig, frame):
     """Signal handler to set the global shutdown flag."""
@@ -42,8 +62,6 @@ def load_config():
 
 def restart_program():
     """Restarts the script to perform a hard reset, primarily for clearing GPU memory."""
-    global shutdown_requested
-    
     # Do not restart if a graceful shutdown was initiated by the user
     if shutdown_requested:
         print("Shutdown requested - NOT restarting program")
@@ -54,10 +72,27 @@ def restart_program():
         print("=" * 60)
         print("RESTARTING PROGRAM TO CLEAR GPU MEMORY")
         print("=" * 60)
+
+        # Try to upload pending results first; whatever is left stays on disk for the new process
+        if result_spool is not None:
+            result_spool.stop(timeout=30)
+
+        # A worker forked by the fork server is replaced by a fresh fork, so it only has to exit
+        if os.environ.get(FORK_CHILD_ENV):
+            print("Exiting so the fork server forks a fresh worker...")
+            sys.exit(RESTART_EXIT_CODE)
+
+        # A supervised worker is restarted by its supervisor, so it only has to exit
+        if os.environ.get(SUPERVISED_ENV):
+            print("Exiting so the supervisor starts a fresh worker...")
+            sys.exit(RESTART_EXIT_CODE)
         
-        # Get the path to the current script and its arguments
+        # Get the path to the current script and the arguments it was launched with
         script_path = sys.argv[0]
-        script_args = sys.argv[1:]
+        script_args = launch_args
+
+        # The new process inherits the environment, which carries the restart count for the metrics
+        os.environ[RESTART_COUNT_ENV] = str(int(os.environ.get(RESTART_COUNT_ENV, 0)) + 1)
         
         # Launch a new instance of the script with the same arguments
         subprocess.Popen([sys.executable, script_path] + script_args)
@@ -71,8 +106,20 @@ def restart_program():
         print("Continuing with current process...")
 
 
+def sleep_unless_shutdown(seconds: float) -> bool:
+    """Sleeps in short steps so a shutdown is noticed. Returns False if a shutdown was requested."""
+    deadline = time.time() + seconds
+    while not shutdown_requested:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return True
+        time.sleep(min(remaining, 1))
+    return False
+
+
 def cleanup_gpu_memory():
     """Attempts to free up GPU memory by unloading models and clearing caches."""
+    worker_metrics.gpu_cleanups.inc()
     try:
         if torch.cuda.is_available():
             print("Starting GPU memory cleanup...")
@@ -127,29 +174,256 @@ def cleanup_gpu_memory():
         print(f"Error during GPU cleanup: {e}")
 
 
-def get_access_token(WEB_SERVER: str, password: str) -> str:
-    """Authenticates with the backend server to obtain a JWT for subsequent requests."""
-    url = f"{WEB_SERVER}/token"
-    data = {"password": password}
-    response = requests.post(url, data=data)
-    response.raise_for_status()  # Raise an exception for HTTP errors (e.g., 401, 500)
-    return response.json()["access_token"]
+def warm_up(dispatcher: WorkflowDispatcher, workflows: list, image_path: str = DEFAULT_WARMUP_IMAGE) -> dict:
+    """
+    Loads the given workflows and generates one image with each, which is thrown away.
 
+    The first generate() after loading pays for ComfyUI moving the models to the GPU, cuDNN
+    picking its algorithms, the allocator growing its pools and the LLM being loaded. A warm-up
+    run does all of this before the worker polls, instead of while the first child waits.
 
-def poll_job(url: str, apassword: str):
-    """The main loop that polls the server for jobs and processes them."""
-    global shutdown_requested
+    Args:
+        dispatcher: The dispatcher the workflows are activated with. They stay resident.
+        workflows: The names of the workflows to warm up, in this order.
+        image_path: The input image of the warm-up runs.
+
+    Returns:
+        dict: workflow -> {"load": seconds, "generate": seconds} of the cold runs that succeeded.
+    """
+    try:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+    except OSError as e:
+        print(f"Skipping the warm-up, could not read {image_path}: {e}")
+        return {}
+
+    cold_times = {}
+    for workflow in workflows:
+        if shutdown_requested:
+            break
+        if workflow not in dispatcher.workflow_names():
+            print(f"Skipping the warm-up of unknown workflow {workflow}")
+            continue
+        print(f"Warming up workflow {workflow}...")
+        try:
+            start_time = time.time()
+            workflow_obj = dispatcher.activate(workflow)
+            load_seconds = time.time() - start_time
+            start_time = time.time()
+            workflow_obj.generate(workflow, image_bytes, "teddy bear", "Warm", "Up", "Teddy")
+            generate_seconds = time.time() - start_time
+        except Exception as e:
+            print(f"Warm-up of {workflow} failed: {e}")
+            continue
+        # The result is discarded, but the first run still counts for the footprint and swap-in statistics
+        dispatcher.residency.record_run(workflow, generate_seconds)
+        cold_times[workflow] = {"load": load_seconds, "generate": generate_seconds}
+        print(f"Warm-up of {workflow} done: loading took {load_seconds:.2f} seconds, "
+              f"the cold generate() {generate_seconds:.2f} seconds")
+    return cold_times
+
+
+def parse_job(response) -> dict:
+    """Extracts the input image and the job metadata from a /job response."""
+    return {
+        "image_bytes": response.content,  # The image data is sent in the response body
+        "job_id": response.headers.get("img_id"),  # The metadata is sent in the response headers
+        "first_name": response.headers.get("first_name"),
+        "last_name": response.headers.get("last_name"),
+        "animal_name": response.headers.get("animal_name"),
+        "animal_type": response.headers.get("animal_type"),
+        "workflow": response.headers.get("workflow"),
+        # Set by servers with workflow affinity when they preferred this job to spare us a model swap
+        "swap_avoided": response.headers.get("X-Swap-Avoided") == "1",
+        "received_at": time.time(),  # For the queue wait metric
+    }
+
+
+def fetch_job(client: BackendClient, poll_state: dict = None):
+    """
+    Polls the server once for a new job.
+
+    If long polling is enabled, the server holds the request for up to `poll_state["wait"]`
+    seconds until a job arrives. Servers without long-poll support answer immediately and
+    without an X-Long-Poll header; in that case long polling is switched off and the caller
+    falls back to short polling.
+
+    The currently loaded workflow is sent along, so servers with workflow affinity can hand
+    out a job that doesn't require a model swap. Other servers ignore the parameter. The
+    same goes for the worker name, which servers with job leases use to track who holds a job.
+
+    Args:
+        client: The authenticated backend client.
+        poll_state: A dict with the keys "wait" (seconds, 0 disables long polling),
+            "workflow" (the loaded workflow or None) and "worker" (the name of this worker).
+            "wait" is updated in place when the server turns out not to support long polling.
+
+    Returns:
+        The job as a dict (see parse_job), or None if no job is available.
+    """
+    poll_state = poll_state or {}
+    wait = poll_state.get("wait", 0)
+    params = {}
+    if poll_state.get("workflow"):
+        params["workflow"] = poll_state["workflow"]
+    if poll_state.get("worker"):
+        params["worker"] = poll_state["worker"]
+
+    if wait > 0:
+        # Leave some headroom so the server answers before the client gives up
+        params["wait"] = wait
+        response = client.get("/job", params=params, timeout=wait + 15)
+    else:
+        response = client.get("/job", params=params)
+
+    # The client already refreshed the token and retried once; give up on this poll
+    if response.status_code == 401:
+        print("Still unauthorized after refreshing the token")
+        return None
+
+    # No job is available
+    if response.status_code == 204:
+        if wait > 0 and "X-Long-Poll" not in response.headers:
+            print("Server does not support long polling, falling back to short polling")
+            poll_state["wait"] = 0
+        return None
+
+    return parse_job(response)
+
+
+def collect_batch(get_job, workflow: str, known_workflows, max_batch_size: int, max_batch_wait: float,
+                  deferred_jobs: list, discard_fn=None) -> list:
+    """
+    Collects more jobs for the given workflow, so they can be generated in one batched sampler pass.
+
+    Jobs that were deferred earlier are taken first. Then new jobs are requested until the batch
+    is full or `max_batch_wait` seconds have passed. A job for another workflow ends the collection
+    and is appended to `deferred_jobs`, so it is processed right after the batch.
+
+    Args:
+        get_job: Returns the next job or None, waiting at most the given number of seconds.
+        workflow: The workflow of the batch.
+        known_workflows: The registered workflow names. Unknown workflows fall back to FLUX_Kontext.
+        max_batch_size: The maximum number of jobs in a batch, including the one already taken.
+        max_batch_wait: Seconds to wait for further jobs.
+        deferred_jobs: Jobs for other workflows, processed after the batch. Updated in place.
+        discard_fn: Called with invalid jobs, so the pipeline can forget them.
+
+    Returns:
+        list: The additional jobs for the batch.
+    """
+    def job_workflow(job):
+        return job["workflow"] if job["workflow"] in known_workflows else "FLUX_Kontext"
+
+    batch = [job for job in deferred_jobs if job_workflow(job) == workflow][:max_batch_size - 1]
+    for job in batch:
+        deferred_jobs.remove(job)
+
+    deadline = time.time() + max_batch_wait
+    while len(batch) < max_batch_size - 1 and not shutdown_requested:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        job = get_job(remaining)
+        if job is None:
+            continue
+        if not job["job_id"] or not job["image_bytes"]:
+            print("No valid job data received, skipping...")
+            if discard_fn is not None:
+                discard_fn(job)
+            continue
+        if job_workflow(job) != workflow:
+            # Don't let the other workflow wait for the rest of the batch
+            deferred_jobs.append(job)
+            break
+        batch.append(job)
+
+    return batch
+
+
+def result_files(img_buffer) -> dict:
+    """Prepares the generated image as multipart upload fields: {field: (filename, bytes, content type)}."""
+    # Encoded images carry their format (see encoding.py), plain buffers are PNG
+    filename = getattr(img_buffer, "filename", "result.png")
+    content_type = getattr(img_buffer, "content_type", "image/png")
+    files = {
+        "result": (filename, img_buffer.getvalue(), content_type),
+    }
+    # Smaller renditions (display size, thumbnail) are uploaded in the same request
+    for field, rendition in getattr(img_buffer, "renditions", {}).items():
+        files[field] = (rendition.filename, rendition.getvalue(), rendition.content_type)
+    return files
+
+
+def send_result(client: BackendClient, image_id: str, files: dict) -> None:
+    """Posts a generated image back to the server. Raises an exception if the upload failed."""
+    data = {
+        "image_id": image_id,
+    }
+
+    # Post the result back to the server
+    start_time = time.time()
+    try:
+        res = client.post("/job", files=files, data=data)
+        print("Result sent:", res.status_code, res.text)
+        res.raise_for_status()
+    except Exception:
+        worker_metrics.upload_failures.inc()
+        raise
+    worker_metrics.upload_seconds.observe(time.time() - start_time)
+
+
+def poll_job(url: str, apassword: str, pipelined: bool = False, prefetch: int = 2, spool_dir: str = DEFAULT_SPOOL_DIR,
+             long_poll_wait: float = 25, vram_budget_gb: float = None, host_ram_budget_gb: float = None,
+             max_batch_size: int = 1, max_batch_wait: float = 2, trace_dir: str = None, metrics_port: int = None,
+             idle_settings: dict = None, warmup_workflows: list = None, metrics_host: str = "127.0.0.1"):
+    """
+    The main loop that polls the server for jobs and processes them.
+
+    Args:
+        url: The URL of the backend server.
+        apassword: The password used to obtain an access token.
+        pipelined: If True, jobs are prefetched and results are uploaded in background threads,
+            so the GPU only ever waits for `generate()`.
+        prefetch: The number of jobs buffered ahead of the GPU in pipelined mode.
+        spool_dir: The directory generated results are stored in until they are uploaded.
+        long_poll_wait: How long the server may hold a poll open until a job arrives (0 disables long polling).
+        vram_budget_gb: The VRAM resident workflows may use together (default: 85% of the GPU's memory).
+        host_ram_budget_gb: The pinned host RAM for evicted workflows in warm standby (default: 25% of the RAM, 0 disables it).
+        max_batch_size: The maximum number of jobs of the same workflow generated in one batched sampler pass
+            (1 disables batching). Only used for workflows that implement `generate_batch`.
+        max_batch_wait: Seconds to wait for more jobs of the same workflow before a batch is started.
+        trace_dir: If set, every node call is profiled and a Chrome trace per job is written to this directory.
+        metrics_port: If set, Prometheus metrics are served on this port at /metrics. Supervised workers
+            use the port plus their index, so every GPU gets its own endpoint.
+        metrics_host: The address the metrics endpoint listens on. The default only accepts local
+            connections; "0.0.0.0" exposes the unauthenticated endpoint on all interfaces.
+        idle_settings: The [server.idle] table of config.toml: poll backoff, idle tiers and opening hours
+            (see IdlePolicy.from_config).
+        warmup_workflows: Workflows that are loaded and run once on a test image before the first poll
+            (see warm_up). Their first real job reports its latency next to the cold run.
+    """
+    global shutdown_requested, result_spool
     WEB_SERVER = url
     password = apassword
 
     # Register the signal handler for graceful shutdown on Ctrl+C
     signal.signal(signal.SIGINT, signal_handler)
     
-    # Continuously try to get an access token until successful or shutdown is requested
+    # All backend requests go through one pooled client that keeps the token fresh. Requests time out
+    # a bit after the longest time the server may hold a long poll open
+    client = BackendClient(WEB_SERVER, password, timeout=max(30, long_poll_wait + 15))
+
+    # A worker forked by the fork server uses the token the fork server obtained
     token = None
+    if os.environ.get(TOKEN_ENV):
+        token = client.use_token(os.environ[TOKEN_ENV])
+        print("Using the access token of the fork server")
+
+    # Continuously try to get an access token until successful or shutdown is requested
     while token is None and not shutdown_requested:
         try:
-            token = get_access_token(WEB_SERVER, password)
+            token = client.login()
             print("Successfully obtained access token")
         except Exception as e:
             print(f"Failed to get access token: {e}")
@@ -160,144 +434,257 @@ def poll_job(url: str, apassword: str):
         print("Shutdown requested during token acquisition")
         return
 
-    # Prepare headers for authenticated API requests
-    headers = {"Authorization": f"Bearer {token}"}
+    # Results are written to disk first and uploaded in the background with retries,
+    # so a failed upload never loses a generated image. Supervised workers get their own folder.
+    worker_name = os.environ.get(WORKER_NAME_ENV)
+    if worker_name:
+        spool_dir = os.path.join(spool_dir, worker_name)
+    result_spool = ResultSpool(
+        spool_dir,
+        upload_fn=lambda image_id, files: send_result(client, image_id, files),
+    )
+    result_spool.start()
+
+    # Serve the metrics for Prometheus while the worker runs
+    if metrics_port:
+        worker_metrics.add_gauge("iap_spool_pending", "Results waiting in the spool for upload.", result_spool.pending)
+        worker_metrics.start_server(metrics_port + int(os.environ.get(WORKER_INDEX_ENV, 0)), metrics_host)
 
     # Initialize the WorkflowDispatcher to manage and load different workflows
-    dispatcher = WorkflowDispatcher()
-    # Create placeholder objects for all available workflows without loading models yet
-    workflow_objects = dispatcher.create_workflow_obj()
+    # Workflows are loaded on first use and stay resident while they fit into the VRAM budget,
+    # evicted workflows wait in pinned host RAM until they are needed again
+    tracer = NodeTracer(trace_dir) if trace_dir else None
+    if tracer is not None:
+        print(f"Node tracing enabled, writing traces to {trace_dir}")
+    dispatcher = WorkflowDispatcher(vram_budget_gb, host_ram_budget_gb, tracer)
 
     last_workflow = None # Keep track of the previously used workflow to manage memory
-    no_job_count = 1 # Counter for consecutive polls with no job
+
+    # Decides how long to wait between empty polls and when to free memory while no jobs arrive
+    idle_policy = IdlePolicy.from_config(idle_settings or {})
+    prewarm_workflows = (idle_settings or {}).get("prewarm_workflows", [])
+    next_poll_interval = idle_policy.poll_interval
+    if metrics_port:
+        worker_metrics.add_gauge("iap_idle_seconds", "Seconds since the last job or other activity.", idle_policy.idle_seconds)
+
+    # Poll parameters, shared with the fetcher: the long-poll wait (switched off if the server
+    # doesn't support it), the loaded workflow for servers with workflow affinity and a name
+    # that tells the workers of one machine apart on servers that track who holds which job
+    poll_state = {"wait": long_poll_wait, "workflow": None,
+                  "worker": f"{socket.gethostname()}/{worker_name}" if worker_name else socket.gethostname()}
+    workflow_swaps = 0 # Number of times the loaded workflow had to be changed
+    swaps_avoided = 0 # Number of jobs the server preferred so we could keep the loaded workflow
+    deferred_jobs = [] # Jobs for another workflow that arrived while a batch was collected
+
+    # Pay for the first-run costs of the default workflows before any job waits for them
+    cold_times = {} # workflow -> seconds of its warm-up run, until its first job reported the warm latency
+    if warmup_workflows:
+        cold_times = warm_up(dispatcher, warmup_workflows)
+        if cold_times:
+            # The last warmed-up workflow is the one most surely still resident
+            last_workflow = list(cold_times)[-1]
+            poll_state["workflow"] = last_workflow
+
+    # In pipelined mode, fetching and uploading run in background threads
+    pipeline = None
+    if pipelined:
+        pipeline = JobPipeline(
+            fetch_fn=lambda: fetch_job(client, poll_state),
+            upload_fn=lambda job, img_buffer: result_spool.put(job["job_id"], result_files(img_buffer)),
+            prefetch=prefetch,
+            # Empty polls follow the idle policy's backoff and opening hours, like the direct polls
+            poll_interval=lambda: next_poll_interval,
+        )
+        pipeline.start()
+        print(f"Pipelined mode enabled (prefetching up to {prefetch} jobs)")
+
+    def get_batch_job(timeout):
+        """Returns the next job for a batch without long polling, or None after an empty poll."""
+        if pipeline is not None:
+            return pipeline.next_job(timeout=timeout)
+        batch_job = fetch_job(client, dict(poll_state, wait=0))
+        if batch_job is None:
+            time.sleep(min(0.5, timeout))
+        return batch_job
 
     while not shutdown_requested:
+        job = None
+        batch = []
         try:
-            # Poll the server for a new job
-            response = requests.get(f"{WEB_SERVER}/job", headers=headers)
-            
-            # If the token has expired or is invalid, refresh it
-            if response.status_code == 401:
-                print("Unauthorized, refreshing token...")
-                token = get_access_token(password)
-                headers["Authorization"] = f"Bearer {token}"
-                time.sleep(2)
-                continue
-            
-            # If no job is available, enter a sleep cycle
-            if response.status_code == 204:
-                print("No job received...")
-                no_job_count += 1
-
-                # After 1 hour of inactivity, trigger a full program restart to clear memory
-                if no_job_count >= 960: # no jobs for one hour
-                    print("Total sleep mode reached! Polling again in 1 minute.")
-
-                    if last_workflow is not None:
-                        print("Resetting program to free GPU memory.")
-                        print("(Press Ctrl+C to terminate the program)")
+            # Get the next job: jobs deferred while collecting a batch come first, then the
+            # prefetch buffer or a direct poll of the server
+            poll_start = time.time()
+            if deferred_jobs:
+                job = deferred_jobs.pop(0)
+            elif pipeline is not None:
+                job = pipeline.next_job(timeout=next_poll_interval)
+            else:
+                job = fetch_job(client, poll_state)
+            poll_duration = time.time() - poll_start
+
+            # If no job is available, wait for the next poll and power down step by step
+            if job is None:
+                next_poll_interval = idle_policy.empty_poll()
+                print(f"No job received... ({idle_policy.describe()})")
+
+                # Load the workflows before the opening hours begin, so the first visitor doesn't wait
+                if idle_policy.should_prewarm():
+                    for prewarm_workflow in prewarm_workflows or ([last_workflow] if last_workflow else []):
+                        print(f"Pre-warming workflow {prewarm_workflow} for the opening hours")
+                        try:
+                            dispatcher.activate(prewarm_workflow)
+                        except Exception as e:
+                            print(f"Could not pre-warm {prewarm_workflow}: {e}")
+                            continue
+                        last_workflow = prewarm_workflow
+                        poll_state["workflow"] = prewarm_workflow
+                    idle_policy.prewarmed()
+
+                tier = idle_policy.due_tier()
+                if tier == "offload":
+                    # Keep the weights in host RAM, so the next job only has to copy them back
+                    print("Idle - moving the loaded workflows to host RAM.")
+                    dispatcher.residency.offload_all()
+                elif tier == "release":
+                    print("Going into sleep mode! Freeing the GPU memory.")
+                    # Unload the workflows through the residency manager first, so it stops counting them as
+                    # resident and modules outside ComfyUI's model management (e.g. Janus) are freed as well
+                    dispatcher.residency.evict_all()
+                    cleanup_gpu_memory()
+                elif tier == "restart" and last_workflow is not None:
+                    # Never restart while a prefetched job or an upload is still pending
+                    if pipeline is not None and not pipeline.drain_for_restart():
+                        continue
+                    print("Total sleep mode reached! Resetting program to free GPU memory.")
+                    print("(Press Ctrl+C to terminate the program)")
+                    try:
                         restart_program()
-
-                    for _ in range(2):  # Wait for 2*30 seconds, checking for shutdown
-                        if shutdown_requested:
-                            return
-                        time.sleep(30)
-
-                # After 30 minutes of inactivity, clean up GPU memory
-                elif no_job_count >= 900: # Approx. 30 minutes
-                    print("Going into sleep mode! Polling again in 30 seconds.")
-                    if last_workflow is not None:
-                        cleanup_gpu_memory()
-                    for _ in range(3):  # Wait for 3*10 seconds, checking for shutdown
-                        if shutdown_requested:
-                            return
-                        time.sleep(10)
-
-                else:
-                    # Default short sleep between polls
-                    if shutdown_requested:
-                        return
-                    time.sleep(2)
+                    except Exception as e:
+                        print(f"Failed to restart program: {e}")
+                    # Still running, so the restart failed: resume fetching and uploading
+                    if pipeline is not None:
+                        pipeline.start()
+                    if result_spool is not None:
+                        result_spool.start()
+                if tier is not None:
+                    idle_policy.entered(tier)
+
+                # The prefetch buffer waits for the next job itself; a direct poll waits here, minus
+                # the time the poll itself already waited (long polls usually wait the full interval or longer)
+                if pipeline is None:
+                    sleep_unless_shutdown(next_poll_interval - poll_duration)
                 continue
 
-            # Reset the inactivity counter since a job was received
-            no_job_count = 1
+            # Reset the idle time and the poll interval since a job was received
+            idle_policy.job_received()
+            next_poll_interval = idle_policy.poll_interval
 
-            # Extract the image data from the response body
-            image_bytes = response.content
-
-            # Extract job metadata from response headers
-            job_id = response.headers.get("img_id")
-            first_name = response.headers.get("first_name")
-            last_name = response.headers.get("last_name")
-            animal_name = response.headers.get("animal_name")
-            animal_type = response.headers.get("animal_type")
-            workflow = response.headers.get("workflow")
+            image_bytes = job["image_bytes"]
+            job_id = job["job_id"]
+            first_name = job["first_name"]
+            last_name = job["last_name"]
+            animal_name = job["animal_name"]
+            animal_type = job["animal_type"]
+            workflow = job["workflow"]
 
             # Validate that essential job data is present
             if not job_id or not image_bytes:
                 print("No valid job data received, skipping...")
+                if pipeline is not None:
+                    pipeline.discard_job(job)
                 time.sleep(2)
                 continue
 
             # Ensure the requested workflow is known; otherwise, default to a fallback
-            if workflow not in workflow_objects:
-                print(f"Unknown workflow: {workflow}. Available: {list(workflow_objects.keys())}")
+            if workflow not in dispatcher.workflow_names():
+                print(f"Unknown workflow: {workflow}. Available: {dispatcher.workflow_names()}")
                 workflow = "FLUX_Kontext"  # Fallback to a default workflow
             
             # Standardize the animal type for better prompting consistency
             if animal_type == "other":
                 animal_type = "stuffed animal"
 
-            # If the requested workflow is different from the last one, manage memory
-            if workflow != last_workflow: 
-                if last_workflow is not None:
-                    print(f"Switching from {last_workflow} to {workflow}, cleaning GPU memory...")
-                    try:
-                        # Clear the internal state of the old workflow object
-                        workflow_objects[last_workflow].__dict__.clear()
-                        del workflow_objects[last_workflow]
-                        
-                        # Run the full GPU cleanup process
-                        cleanup_gpu_memory()
-                        
-                        # Re-create the old workflow object so it can be used again later
-                        workflow_objects[last_workflow] = dispatcher.create_single_workflow_obj(last_workflow)
-                        print(f"GPU memory cleaned and {last_workflow} workflow recreated")
-                    except Exception as e:
-                        print(f"Error during workflow cleanup: {e}")
-                        # Ensure the object is recreated even if cleanup fails
-                        workflow_objects[last_workflow] = dispatcher.create_single_workflow_obj(last_workflow)
-                
-                # Load the models for the new workflow
-                print(f"Loading workflow: {workflow}")
-                workflow_objects[workflow].start_load_once()
-
-            # Update the last workflow tracker
+            # If the requested workflow is different from the last one, switch to it. The dispatcher
+            # loads it unless it is still resident, evicting least recently used workflows if needed.
+            swapping = workflow != last_workflow and last_workflow is not None
+            if swapping:
+                workflow_swaps += 1
+                print(f"Switching from {last_workflow} to {workflow}...")
+            if tracer is not None:
+                # The trace includes load_once if the workflow has to be loaded for this job
+                tracer.begin(job_id)
+            activate_start = time.time()
+            workflow_obj = dispatcher.activate(workflow)
+            if swapping:
+                worker_metrics.workflow_swaps.inc(workflow=workflow)
+                worker_metrics.workflow_swap_seconds.observe(time.time() - activate_start, workflow=workflow)
+
+            # Update the last workflow tracker and tell the server which workflow is loaded now
             last_workflow = workflow
+            poll_state["workflow"] = workflow
+            if job.get("swap_avoided"):
+                swaps_avoided += 1
             
             print(f"Job received: {job_id}; Using workflow: {workflow}")
             print(f"Patient: {first_name} {last_name}, Animal: {animal_name}, AnimalType: {animal_type}")
 
+            # If the workflow supports it, collect more waiting jobs of the same workflow and
+            # denoise them together in one batched sampler pass
+            job["animal_type"] = animal_type
+            batch = [job]
+            if max_batch_size > 1 and hasattr(workflow_obj, "generate_batch"):
+                batch += collect_batch(
+                    get_batch_job, workflow, dispatcher.workflow_names(), max_batch_size, max_batch_wait,
+                    deferred_jobs, discard_fn=pipeline.discard_job if pipeline is not None else None,
+                )
+                for batch_job in batch[1:]:
+                    if batch_job["animal_type"] == "other":
+                        batch_job["animal_type"] = "stuffed animal"
+                    if batch_job.get("swap_avoided"):
+                        swaps_avoided += 1
+                    print(f"Job added to batch: {batch_job['job_id']}; Patient: {batch_job['first_name']} {batch_job['last_name']}, "
+                          f"Animal: {batch_job['animal_name']}, AnimalType: {batch_job['animal_type']}")
+
             # Main generation loop (currently set to run once per job)
             for i in range(1):
                 start_time = time.time()
+                for batch_job in batch:
+                    worker_metrics.queue_wait_seconds.observe(start_time - batch_job.get("received_at", start_time))
                 # Call the generate method of the selected workflow
-                img_buffer = workflow_objects[workflow].generate(workflow, image_bytes, animal_type, first_name, last_name, animal_name)
+                if len(batch) == 1:
+                    img_buffers = [workflow_obj.generate(workflow, image_bytes, animal_type, first_name, last_name, animal_name)]
+                else:
+                    img_buffers = workflow_obj.generate_batch(workflow, batch)
                 elapsed_time = time.time() - start_time
-                print(f"Time taken to generate image: {elapsed_time:.2f} seconds")
-
-                # Prepare the generated image and metadata for sending back to the server
-                files = {
-                    "result": ("result.png", img_buffer.getvalue(), "image/png"),
-                }
-                data = {
-                    "image_id": job_id,
-                }
-
-                # Post the result back to the server
-                res = requests.post(f"{WEB_SERVER}/job", headers={"Authorization": f"Bearer {token}"}, files=files, data=data)
-                print("Result sent:", res.status_code, res.text)
+                if len(batch) > 1:
+                    print(f"Time taken to generate batch of {len(batch)} images: {elapsed_time:.2f} seconds")
+                # One line per image, so per-image statistics stay comparable with unbatched runs
+                for _ in batch:
+                    print(f"Time taken to generate image: {elapsed_time / len(batch):.2f} seconds")
+                dispatcher.residency.record_run(workflow, elapsed_time)
+                if workflow in cold_times:
+                    cold = cold_times.pop(workflow)
+                    print(f"Cold vs. warm latency of {workflow}: warm-up {cold['load'] + cold['generate']:.2f}s "
+                          f"(loading {cold['load']:.2f}s + generate {cold['generate']:.2f}s), "
+                          f"first job {elapsed_time / len(batch):.2f}s")
+                worker_metrics.jobs.inc(len(batch), workflow=workflow)
+                for _ in batch:
+                    worker_metrics.generation_seconds.observe(elapsed_time / len(batch), workflow=workflow)
+                if tracer is not None:
+                    trace_path = tracer.end(workflow=workflow, jobs=[batch_job["job_id"] for batch_job in batch])
+                    print(f"Trace written to {trace_path}")
+                    print(tracer.summary())
+                print(dispatcher.residency.summary())
+                print(f"Workflow swaps: {workflow_swaps} | Swaps avoided by workflow affinity: {swaps_avoided}")
+
+                # Hand the results to the spool, which uploads them in the background
+                for batch_job, img_buffer in zip(batch, img_buffers):
+                    if pipeline is not None:
+                        pipeline.submit_result(batch_job, img_buffer)
+                    else:
+                        result_spool.put(batch_job["job_id"], result_files(img_buffer))
+                if pipeline is not None:
+                    print(f"Pipeline queue depths: {pipeline.format_queue_depths()} | spooled: {result_spool.pending()}")
 
         # Handle Ctrl+C gracefully
         except KeyboardInterrupt:
@@ -307,11 +694,30 @@ def poll_job(url: str, apassword: str):
         # Catch all other exceptions to prevent the poller from crashing
         except Exception as e:
             print("Error:", e)
+            worker_metrics.job_errors.inc()
+            if pipeline is not None:
+                for failed_job in batch or ([job] if job is not None else []):
+                    pipeline.discard_job(failed_job)
+            if tracer is not None:
+                # Keep the trace of the failed job, it shows which node was reached
+                tracer.end(error=str(e))
             if shutdown_requested:
                 break
             # Attempt to clean up GPU memory on error before continuing
             cleanup_gpu_memory()
             time.sleep(3)
+
+    # Flush pending uploads before exiting
+    if pipeline is not None:
+        print("Waiting for pending uploads...")
+        leftover = pipeline.stop()
+        if leftover:
+            print(f"Dropping {len(leftover)} prefetched job(s): {[job['job_id'] for job in leftover]}")
+    if deferred_jobs:
+        print(f"Dropping {len(deferred_jobs)} deferred job(s): {[job['job_id'] for job in deferred_jobs]}")
+    result_spool.stop(timeout=30)
+    worker_metrics.stop_server()
+    client.close()
     
     # Final message on graceful shutdown
     print("Program terminated gracefully")
@@ -320,30 +726,106 @@ def poll_job(url: str, apassword: str):
 
 @click.command()
 @click.option('-test', '-t', is_flag=True, help='Run in test mode using local test server settings.')
-def main(test):
+@click.option('-pipelined', '-p', is_flag=True, help='Prefetch jobs and upload results in the background while the GPU generates.')
+@click.option('-prefetch', default=2, show_default=True, help='Number of jobs buffered ahead of the GPU in pipelined mode.')
+@click.option('-supervise', '-s', is_flag=True, help='Run one worker per visible CUDA device and restart them if they crash.')
+@click.option('-gpus', default=None, help='Comma-separated CUDA device IDs to supervise (default: all visible devices).')
+@click.option('-trace', is_flag=True, help='Profile every node call and write a Chrome trace per job (slows generation down a little).')
+@click.option('-fork-server', '-f', is_flag=True, help='Import once and fork fresh workers on a restart instead of starting a new process.')
+@click.option('-warmup', default=None, help='Comma-separated workflows to load and run once on a test image before polling.')
+def main(test, pipelined, prefetch, supervise, gpus, trace, fork_server, warmup):
     """Main entry point for the script, controlled by command-line flags."""
-    # Preserve original command-line arguments for potential restarts
-    # Remove the --test flag so it's not passed to other processes (like ComfyUI)
-    if '-test' in sys.argv:
-        sys.argv.remove('-test')
-    if '-t' in sys.argv:
-        sys.argv.remove('-t')
+    # The original command-line arguments are preserved in `launch_args` for potential restarts
+    # Remove our flags so they're not passed to other processes (like ComfyUI)
+    del sys.argv[1:]
+
+    # In supervisor mode this process only manages the workers, which get all other flags
+    if supervise:
+        worker_args = []
+        skip_next = False
+        for arg in launch_args:
+            if skip_next:
+                skip_next = False
+            elif arg in ('-supervise', '-s'):
+                continue
+            elif arg == '-gpus':
+                skip_next = True
+            else:
+                worker_args.append(arg)
+        devices = [device.strip() for device in gpus.split(",")] if gpus else None
+        Supervisor(worker_args, devices).run()
+        return
     
+    # Workflows warmed up before the first poll, from the -warmup flag or the config
+    warmup_workflows = [workflow.strip() for workflow in warmup.split(",")] if warmup else None
+
     # Test mode uses a hardcoded local server configuration for development
     if test: 
         print("Running in test mode...")
         WEB_SERVER = "http://localhost:8001"
         password = "Password"
-        poll_job(WEB_SERVER, password)
+        run_worker = lambda: poll_job(WEB_SERVER, password, pipelined, prefetch, trace_dir=DEFAULT_TRACE_DIR if trace else None,
+                                      warmup_workflows=warmup_workflows)
     else:
         # Normal mode connects to the production backend server defined in config.toml
         # Load configuration from the file
         config = load_config()
         WEB_SERVER = config.get("WEB_SERVER") # URL of the backend server
         password = config.get("password") # Password for authentication
+        spool_dir = config.get("spool_dir", DEFAULT_SPOOL_DIR) # Where results wait for upload
+        long_poll_wait = config.get("long_poll_wait", 25) # Seconds the server may hold a poll, 0 disables long polling
+        vram_budget_gb = config.get("vram_budget_gb") # VRAM for resident workflows, default 85% of the GPU
+        host_ram_budget_gb = config.get("host_ram_budget_gb") # Pinned RAM for the warm standby, default 25% of the RAM
+        max_batch_size = config.get("max_batch_size", 1) # Jobs of one workflow generated together, 1 disables batching
+        max_batch_wait = config.get("max_batch_wait", 2) # Seconds to wait for more jobs before starting a batch
+        metrics_port = config.get("metrics_port", 0) # Port of the Prometheus endpoint, 0 disables it
+        metrics_host = config.get("metrics_host", "127.0.0.1") # Address the endpoint listens on, local only by default
+        idle_settings = config.get("idle", {}) # Poll backoff, idle tiers and opening hours ([server.idle])
+        # Per-node profiling, enabled by the -trace flag or the config
+        trace_dir = config.get("trace_dir", DEFAULT_TRACE_DIR) if trace or config.get("trace", False) else None
+        # Warm restarts from a fork server, enabled by the -fork-server flag or the config
+        fork_server = fork_server or config.get("fork_server", False)
+        if warmup_workflows is None:
+            warmup_workflows = config.get("warmup_workflows", []) # Workflows run once on a test image at startup
+
+        # Format of the uploaded images: "png", "webp" (lossless) or "jpeg"
+        encoding.configure(
+            output_format=config.get("output_format", "png"),
+            png_compress_level=config.get("png_compress_level", 3),
+            webp_method=config.get("webp_method", 4),
+            jpeg_quality=config.get("jpeg_quality", 95),
+            # Smaller versions uploaded along with the full image, field name -> longest side in pixels
+            renditions=config.get("renditions", encoding.DEFAULT_RENDITIONS),
+            rendition_format=config.get("rendition_format", "jpeg"),
+        )
         
-        # Start the main job polling loop
-        poll_job(WEB_SERVER, password)
+        run_worker = lambda: poll_job(WEB_SERVER, password, pipelined, prefetch, spool_dir, long_poll_wait, vram_budget_gb,
+                                      host_ram_budget_gb, max_batch_size, max_batch_wait, trace_dir, metrics_port,
+                                      idle_settings, warmup_workflows, metrics_host)
+
+    # Start the main job polling loop
+    if fork_server:
+        # This process only imports and forks; every worker sets its own restart count and start time
+        def run_forked_worker():
+            worker_metrics.process_started()
+            run_worker()
+
+        # Paid once in the fork server instead of in every worker: the login and the import of
+        # ComfyUI and the custom nodes
+        def prepare_workers():
+            try:
+                client = BackendClient(WEB_SERVER, password)
+                os.environ[TOKEN_ENV] = client.login(start_refresher=False)
+                client.session.close()
+                print("[fork-server] Obtained the access token for the workers")
+            except Exception as e:
+                print(f"[fork-server] Login failed, the workers log in themselves: {e}")
+            WorkflowDispatcher(nodes_only=True)
+
+        exit(ForkServer(run_forked_worker, setup=Functions().add_comfyui_directory_to_sys_path,
+                        import_nodes=prepare_workers).run())
+    else:
+        run_worker()
 
 
 if __name__ == "__main__":
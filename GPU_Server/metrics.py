@@ -0,0 +1,223 @@
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from supervisor import RESTART_COUNT_ENV
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """Formats label names and values as `{name="value",...}`."""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """Base class of all metrics: a name, a help text and one value per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, label_values: dict) -> tuple:
+        if set(label_values) != set(self.labels):
+            raise ValueError(f"{self.name} expects the labels {self.labels}, got {tuple(label_values)}")
+        return tuple(label_values[name] for name in self.labels)
+
+    def samples(self) -> list:
+        """Returns the lines of this metric in the text exposition format."""
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. the number of processed jobs."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **label_values):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down.
+
+    Gauges created with a `read_fn` are evaluated on every scrape, e.g. the VRAM currently in use.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), read_fn=None):
+        super().__init__(name, help_text, labels)
+        self.read_fn = read_fn
+
+    def set(self, value: float, **label_values):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> list:
+        if self.read_fn is not None:
+            try:
+                self.set(self.read_fn())
+            except Exception as e:
+                print(f"Could not read metric {self.name}: {e}")
+                return []
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Counts observations (e.g. latencies in seconds) in cumulative buckets, like Prometheus expects."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **label_values):
+        key = self._key(label_values)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> list:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    bucket_labels = _format_labels(self.labels, key, 'le="' + _format_value(bound) + '"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class WorkerMetrics:
+    """
+    All metrics of a worker, served in the Prometheus text format by `start_server()`.
+
+    The metrics are recorded by `poll_job` and its helpers. Scraping is cheap and happens on
+    a separate thread, so it never delays a job.
+    """
+
+    # Bucket bounds in seconds
+    GENERATION_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+    QUEUE_WAIT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+    UPLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+    SWAP_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.jobs = Counter("iap_jobs_total", "Jobs processed, by workflow.", ("workflow",))
+        self.job_errors = Counter("iap_job_errors_total", "Jobs that failed with an exception.")
+        self.generation_seconds = Histogram(
+            "iap_generation_seconds", "Time generate() took per image, by workflow.", self.GENERATION_BUCKETS, ("workflow",))
+        self.queue_wait_seconds = Histogram(
+            "iap_queue_wait_seconds", "Time from receiving a job until its generation started.", self.QUEUE_WAIT_BUCKETS)
+        self.upload_seconds = Histogram(
+            "iap_upload_seconds", "Time a successful result upload took.", self.UPLOAD_BUCKETS)
+        self.upload_failures = Counter("iap_upload_failures_total", "Result uploads that failed and will be retried.")
+        self.workflow_swaps = Counter("iap_workflow_swaps_total", "Switches to another workflow, by the new workflow.", ("workflow",))
+        self.workflow_swap_seconds = Histogram(
+            "iap_workflow_swap_seconds", "Time it took to activate the new workflow on a switch.", self.SWAP_BUCKETS, ("workflow",))
+        self.gpu_cleanups = Counter("iap_gpu_cleanups_total", "Calls of cleanup_gpu_memory().")
+        self.restarts = Gauge("iap_worker_restarts", "How often this worker was restarted since it was first started.")
+        self.start_time = Gauge("iap_worker_start_time_seconds", "Unix time the worker process was started.")
+        self.process_started()
+        self.vram_allocated = Gauge("iap_vram_allocated_bytes", "VRAM currently allocated by tensors.",
+                                    read_fn=lambda: self._cuda_memory("memory_allocated"))
+        self.vram_reserved = Gauge("iap_vram_reserved_bytes", "VRAM currently reserved by the PyTorch caching allocator.",
+                                   read_fn=lambda: self._cuda_memory("memory_reserved"))
+        self._server = None
+
+    @staticmethod
+    def _cuda_memory(function: str) -> int:
+        import torch
+        if not torch.cuda.is_available():
+            return 0
+        return getattr(torch.cuda, function)()
+
+    def process_started(self):
+        """Sets the restart count and start time, again in every worker forked by the fork server."""
+        self.restarts.set(int(os.environ.get(RESTART_COUNT_ENV, 0)))
+        self.start_time.set(time.time())
+
+    def add_gauge(self, name: str, help_text: str, read_fn) -> Gauge:
+        """Adds a gauge that is read on every scrape, e.g. the length of a queue owned by the caller."""
+        gauge = Gauge(name, help_text, read_fn=read_fn)
+        setattr(self, name, gauge)
+        return gauge
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        metrics = [value for value in vars(self).values() if isinstance(value, Metric)]
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def start_server(self, port: int, host: str = "127.0.0.1"):
+        """Serves the metrics at http://<host>:<port>/metrics in a background thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Don't fill the worker log with a line per scrape
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"Could not start the metrics endpoint on port {port}: {e}")
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Metrics available at http://{host}:{port}/metrics")
+
+    def stop_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# The metrics of this worker process
+worker_metrics = WorkerMetrics()
@@ -0,0 +1,191 @@
+import queue
+import threading
+import time
+from typing import Callable, Optional, Union
+
+
+class JobPipeline:
+    """
+    Overlaps job fetching and result uploading with image generation.
+
+    In the sequential worker the GPU sits idle while a job is fetched and while the
+    result is uploaded. The pipeline moves both network steps into background threads:
+    - A fetcher thread keeps up to `prefetch` jobs buffered ahead of the GPU.
+    - An uploader thread sends finished results while the next job is generating.
+    The GPU thread (the caller) only takes jobs with `next_job()` and hands back results
+    with `submit_result()`.
+    """
+
+    def __init__(self, fetch_fn: Callable[[], Optional[dict]], upload_fn: Callable[[dict, object], None],
+                 prefetch: int = 2, poll_interval: Union[float, Callable[[], float]] = 2):
+        """
+        Args:
+            fetch_fn: Polls the backend once and returns a job dict, or None if no job is available.
+            upload_fn: Sends a finished result (job dict, image buffer) back to the backend.
+            prefetch: The maximum number of jobs to keep buffered ahead of the GPU.
+            poll_interval: Seconds to wait before polling again after an empty poll, or a function
+                returning them, which is called before every wait (e.g. to follow an idle backoff).
+        """
+        self.fetch_fn = fetch_fn
+        self.upload_fn = upload_fn
+        self.prefetch = max(1, prefetch)
+        self.poll_interval = poll_interval
+
+        self.job_queue = queue.Queue()
+        self.upload_queue = queue.Queue()
+        self.in_flight = set()  # IDs of the jobs currently owned by the GPU thread
+
+        self._stop_fetching = threading.Event()
+        self._fetcher = None
+        self._uploader = None
+        self._uploader_stopping = False  # A stop marker was queued for the current uploader
+
+    def start(self):
+        """Starts the fetcher and uploader threads."""
+        self._stop_fetching.clear()
+        if self._fetcher is None or not self._fetcher.is_alive():
+            self._fetcher = threading.Thread(target=self._fetch_loop, name="job-fetcher", daemon=True)
+            self._fetcher.start()
+        if self._uploader_stopping and self._uploader is not None and self._uploader.is_alive():
+            # stop() timed out: take the stop marker back so the uploader keeps running. If it already
+            # read the marker, it exits after its current upload and a new uploader takes over.
+            with self.upload_queue.mutex:
+                stale = None in self.upload_queue.queue
+                if stale:
+                    self.upload_queue.queue.remove(None)
+            if not stale:
+                self._uploader.join()
+        self._uploader_stopping = False
+        if self._uploader is None or not self._uploader.is_alive():
+            self._uploader = threading.Thread(target=self._upload_loop, name="result-uploader", daemon=True)
+            self._uploader.start()
+
+    def stop(self, timeout: float = 60) -> list:
+        """
+        Stops fetching new jobs and waits for all pending uploads to finish.
+
+        If the uploads don't finish within the timeout, the uploader keeps working on them in
+        the background and `uploads_pending()` returns True.
+
+        Returns:
+            list: Jobs that were prefetched but never handed to the GPU thread.
+        """
+        self._stop_fetching.set()
+        if self._fetcher is not None:
+            self._fetcher.join(timeout)
+
+        # Let the uploader finish everything that is already queued, then stop it
+        self.upload_queue.put(None)
+        self._uploader_stopping = True
+        if self._uploader is not None:
+            self._uploader.join(timeout)
+            if self._uploader.is_alive():
+                print(f"Uploader did not finish within {timeout} seconds, {self.upload_queue.qsize()} result(s) pending")
+
+        leftover = []
+        while True:
+            try:
+                leftover.append(self.job_queue.get_nowait())
+            except queue.Empty:
+                break
+        return leftover
+
+    def uploads_pending(self) -> bool:
+        """Returns True if results are still queued or being uploaded after `stop()`."""
+        return self._uploader is not None and self._uploader.is_alive()
+
+    def drain_for_restart(self) -> bool:
+        """
+        Prepares the pipeline for a program restart.
+
+        Stops the fetcher and flushes all uploads. If a job slipped into the buffer in the
+        meantime, or the uploads didn't finish in time, the pipeline is started again so
+        nothing is lost.
+
+        Returns:
+            bool: True if the pipeline is empty and the program can safely restart.
+        """
+        leftover = self.stop()
+        if not leftover and not self.uploads_pending():
+            return True
+        if self.uploads_pending():
+            print("Not restarting while results are still being uploaded")
+        for job in leftover:
+            self.job_queue.put(job)
+        self.start()
+        return False
+
+    def next_job(self, timeout: float = None) -> Optional[dict]:
+        """
+        Hands the next buffered job to the GPU thread.
+
+        Args:
+            timeout: Seconds to wait for a job. None waits forever.
+
+        Returns:
+            The job dict, or None if no job arrived within the timeout.
+        """
+        try:
+            job = self.job_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.in_flight.add(job["job_id"])
+        return job
+
+    def submit_result(self, job: dict, img_buffer) -> None:
+        """Queues a finished result for upload and returns immediately."""
+        self.in_flight.discard(job["job_id"])
+        self.upload_queue.put((job, img_buffer))
+
+    def discard_job(self, job: dict) -> None:
+        """Marks a job as finished without a result (e.g. invalid data or a failed generation)."""
+        self.in_flight.discard(job["job_id"])
+
+    def queue_depths(self) -> dict:
+        """Returns the number of jobs currently waiting in each pipeline stage."""
+        return {
+            "prefetched": self.job_queue.qsize(),
+            "generating": len(self.in_flight),
+            "uploading": self.upload_queue.qsize(),
+        }
+
+    def format_queue_depths(self) -> str:
+        """Returns the queue depths as a single log line."""
+        depths = self.queue_depths()
+        return " | ".join(f"{stage}: {count}" for stage, count in depths.items())
+
+    def _fetch_loop(self):
+        """Keeps the job buffer filled until fetching is stopped."""
+        while not self._stop_fetching.is_set():
+            # Only poll when there is room in the buffer, so we never hold more than `prefetch` jobs
+            if self.job_queue.qsize() >= self.prefetch:
+                self._stop_fetching.wait(0.1)
+                continue
+
+            poll_start = time.time()
+            try:
+                job = self.fetch_fn()
+            except Exception as e:
+                print(f"Error while fetching job: {e}")
+                self._stop_fetching.wait(3)
+                continue
+
+            if job is None:
+                # No job available, wait before polling again (a long poll has already waited)
+                interval = self.poll_interval() if callable(self.poll_interval) else self.poll_interval
+                self._stop_fetching.wait(max(0, interval - (time.time() - poll_start)))
+                continue
+
+            self.job_queue.put(job)
+
+    def _upload_loop(self):
+        """Uploads finished results until a stop marker is received."""
+        while True:
+            item = self.upload_queue.get()
+            if item is None:
+                break
+            job, img_buffer = item
+            try:
+                self.upload_fn(job, img_buffer)
+            except Exception as e:
+                print(f"Error uploading result for {job['job_id']}: {e}")
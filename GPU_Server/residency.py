@@ -0,0 +1,423 @@
+import gc
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import torch
+
+from functions import conditioning_cache, shared_loader_cache
+
+
+def release_unreferenced_memory():
+    """
+    Frees the VRAM of models that are no longer referenced by any workflow.
+
+    Unlike `cleanup_gpu_memory()` in main.py this does not unload all models, so the
+    workflows that stay resident keep their weights on the GPU.
+    """
+    gc.collect()
+    try:
+        import comfy.model_management
+        # Drop ComfyUI's bookkeeping for models whose owners are gone
+        if hasattr(comfy.model_management, 'cleanup_models_gc'):
+            comfy.model_management.cleanup_models_gc()
+        if hasattr(comfy.model_management, 'cleanup_models'):
+            comfy.model_management.cleanup_models()
+        comfy.model_management.soft_empty_cache()
+    except ImportError:
+        pass
+    except Exception as e:
+        print(f"Error releasing ComfyUI models: {e}")
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def get_host_memory() -> int:
+    """Returns the physical memory of this machine in bytes (0 if unknown)."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def find_weights(value, patchers: list, modules: list, seen: set, depth: int = 0):
+    """
+    Collects the models referenced by a workflow's `load_once` config.
+
+    ComfyUI models (ModelPatcher, also reached through the `patcher` of CLIP and VAE
+    objects) are collected in `patchers`; plain PyTorch modules that bypass ComfyUI's
+    model management (e.g. the Janus model) are collected in `modules`.
+    """
+    if depth > 4 or id(value) in seen or isinstance(value, (str, bytes, int, float, type, torch.Tensor)):
+        return
+    seen.add(id(value))
+
+    if isinstance(value, torch.nn.Module):
+        modules.append(value)
+    elif hasattr(value, "model_size") and isinstance(getattr(value, "model", None), torch.nn.Module):
+        # Clones of a ModelPatcher (e.g. after a LoRA) share the underlying model
+        if id(value.model) not in seen:
+            patchers.append(value)
+            seen.add(id(value.model))
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            find_weights(item, patchers, modules, seen, depth + 1)
+    elif isinstance(value, dict):
+        for item in value.values():
+            find_weights(item, patchers, modules, seen, depth + 1)
+    elif hasattr(value, "__dict__"):
+        # Node outputs like CLIP, VAE or ControlNet keep their models in attributes
+        for item in vars(value).values():
+            find_weights(item, patchers, modules, seen, depth + 1)
+
+
+def weights_size(patchers: list, modules: list) -> int:
+    """Returns the size in bytes of the weights found by `find_weights`, wherever they are stored."""
+    size = sum(patcher.model_size() for patcher in patchers)
+    size += sum(t.numel() * t.element_size() for m in modules for t in list(m.parameters()) + list(m.buffers()))
+    return size
+
+
+def workflow_footprint(workflow_obj) -> int:
+    """Returns the size of the weights a loaded workflow holds in its `load_once` config."""
+    patchers, modules = [], []
+    find_weights(getattr(workflow_obj, "config", None) or {}, patchers, modules, set())
+    return weights_size(patchers, modules)
+
+
+def move_module(module: torch.nn.Module, device, pin: bool = False) -> int:
+    """
+    Moves all parameters and buffers of a module in place.
+
+    Args:
+        module: The module to move.
+        device: The target device.
+        pin: Place the weights in pinned (page-locked) host memory, which makes the later
+            copy back to the GPU considerably faster. Only valid for the CPU.
+
+    Returns:
+        int: The size of the moved weights in bytes.
+    """
+    size = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        if pin:
+            if not tensor.data.is_pinned():
+                pinned = torch.empty_like(tensor.data, device="cpu", pin_memory=True)
+                pinned.copy_(tensor.data)
+                tensor.data = pinned
+        else:
+            tensor.data = tensor.data.to(device, non_blocking=True)
+        size += tensor.data.numel() * tensor.data.element_size()
+    return size
+
+
+def unload_patcher(patcher):
+    """
+    Asks ComfyUI to move a single model off the GPU without touching any other model.
+
+    ComfyUI may have loaded a clone of the patcher instead of the patcher itself (e.g. the
+    result of a LoRA loader), so every loaded model on top of the same weights is unloaded.
+    """
+    try:
+        import comfy.model_management
+        loaded_models = comfy.model_management.current_loaded_models
+        for i in reversed(range(len(loaded_models))):
+            loaded = loaded_models[i].model
+            if loaded is None:
+                continue
+            if loaded is patcher or getattr(loaded, "model", None) is patcher.model:
+                loaded_models[i].model_unload()
+                loaded_models.pop(i)
+    except ImportError:
+        pass
+
+
+class ResidencyManager:
+    """
+    Keeps as many loaded workflows on the GPU as a VRAM budget allows.
+
+    Previously every workflow change unloaded the old workflow completely. The residency
+    manager instead remembers how much VRAM each workflow's `load_once` models need and
+    only evicts workflows when the one being activated would not fit into the budget.
+    Evictions follow least-recently-used order, and switching back to a workflow that is
+    still resident costs nothing.
+
+    A workflow's footprint is the size of the weights it holds (ComfyUI models and plain
+    PyTorch modules in its `load_once` config). Unlike the growth of allocated VRAM during
+    loading, this stays correct when ComfyUI moves weights lazily or frees other models meanwhile.
+
+    Evicted workflows are not thrown away right away: as long as a host-RAM budget allows,
+    their weights are moved to pinned CPU memory (warm standby). Reactivating such a
+    workflow is a host-to-device copy instead of reading and deserializing every model file
+    from disk again. Only when the standby budget is exhausted are the least recently used
+    standby workflows dropped for good.
+    """
+
+    def __init__(self, create_workflow_obj, vram_budget_gb: float = None, host_ram_budget_gb: float = None):
+        """
+        Args:
+            create_workflow_obj: Creates a fresh (not yet loaded) workflow object by name.
+            vram_budget_gb: The VRAM the resident workflows may use together. Defaults to 85% of
+                the GPU's memory. Without CUDA, only one workflow is kept resident.
+            host_ram_budget_gb: The pinned host RAM that workflows in warm standby may use together.
+                Defaults to 25% of the physical memory; 0 disables the warm standby.
+        """
+        self.create_workflow_obj = create_workflow_obj
+
+        if vram_budget_gb is not None:
+            self.budget = int(vram_budget_gb * 1024**3)
+        elif torch.cuda.is_available():
+            self.budget = int(torch.cuda.get_device_properties(0).total_memory * 0.85)
+        else:
+            self.budget = 0
+
+        if not torch.cuda.is_available():
+            self.host_budget = 0
+        elif host_ram_budget_gb is not None:
+            self.host_budget = int(host_ram_budget_gb * 1024**3)
+        else:
+            self.host_budget = int(get_host_memory() * 0.25)
+
+        self.resident = OrderedDict()  # name -> loaded workflow object, least recently used first
+        self.standby = OrderedDict()  # name -> workflow object with its weights in pinned host RAM
+        self.standby_sizes = {}  # name -> pinned host memory used by the workflow in bytes
+        self._standby_modules = {}  # name -> [(module, original device)] to restore on reactivation
+        self._standby_patchers = {}  # name -> [(ComfyUI model patcher, pinned bytes)], reloaded by ComfyUI on use
+        self.swap_in_times = {"standby": [], "cold": []}  # Seconds to activate a workflow, per path
+        self.first_run_times = {"standby": [], "cold": []}  # Seconds of the first job after a swap-in
+        self._swap_in_path = {}  # name -> path of the latest swap-in, until its first job finished
+        self.footprints = {}  # name -> size of the workflow's weights in bytes
+
+    def activate(self, name: str):
+        """
+        Returns the loaded workflow object, loading it (and evicting others) if necessary.
+
+        Args:
+            name: The registered workflow name.
+        """
+        if name in self.resident:
+            # Mark it as most recently used
+            self.resident.move_to_end(name)
+            return self.resident[name]
+
+        # Make room for the workflow before loading, based on earlier measurements
+        self._make_room(self.footprints.get(name, 0))
+
+        start_time = time.time()
+        if name in self.standby:
+            print(f"Reactivating workflow {name} from warm standby")
+            workflow_obj = self._restore_from_standby(name)
+            self.resident[name] = workflow_obj
+            path = "standby"
+        else:
+            print(f"Loading workflow: {name}")
+            workflow_obj = self.create_workflow_obj(name)
+            workflow_obj.start_load_once()
+            self.resident[name] = workflow_obj
+            self._record(name, workflow_footprint(workflow_obj))
+            path = "cold"
+        self._reclaim_shared(name)
+
+        elapsed = time.time() - start_time
+        self.swap_in_times[path].append(elapsed)
+        self._swap_in_path[name] = path
+        print(f"Swap-in of {name} from {'pinned host RAM' if path == 'standby' else 'disk'} took {elapsed:.2f} seconds")
+
+        # The first load of a workflow has no footprint estimate yet, so check the budget afterwards
+        self._make_room(0, keep=name)
+        return workflow_obj
+
+    def record_run(self, name: str, generate_seconds: float = None):
+        """
+        Records the duration of a workflow's first generate() call after a swap-in.
+
+        Args:
+            name: The workflow that just generated an image.
+            generate_seconds: How long generate() took. The first job after a swap-in includes
+                ComfyUI's lazy model loading, so it is recorded per swap-in path.
+        """
+        path = self._swap_in_path.pop(name, None)
+        if path is not None and generate_seconds is not None:
+            self.first_run_times[path].append(generate_seconds)
+            print(self.swap_in_report())
+
+    def evict(self, name: str):
+        """Moves a resident workflow to the warm standby, or unloads it if it does not fit there."""
+        workflow_obj = self.resident.pop(name, None)
+        if workflow_obj is None:
+            return
+
+        if self.host_budget > 0 and self._move_to_standby(name, workflow_obj):
+            return
+        self._drop(name, workflow_obj)
+
+    def _drop(self, name: str, workflow_obj):
+        """Unloads a workflow completely and frees its memory."""
+        print(f"Unloading workflow {name} ({self._format_size(self.footprints.get(name, 0))})")
+        # generate() copies the loaded nodes into its module's globals, remove them there as well
+        module = sys.modules.get(type(workflow_obj).__module__)
+        config = getattr(workflow_obj, "config", None) or {}
+        if module is not None:
+            for key, value in config.items():
+                if module.__dict__.get(key) is value:
+                    del module.__dict__[key]
+        # Drop every reference to the models so they can be freed, except models other workflows share
+        workflow_obj.__dict__.clear()
+        shared_loader_cache.release(name)
+        conditioning_cache.release(name)
+        release_unreferenced_memory()
+
+    def _move_to_standby(self, name: str, workflow_obj) -> bool:
+        """
+        Moves the weights of a workflow into pinned host memory.
+
+        Returns:
+            bool: False if the workflow does not fit into the host-RAM budget.
+        """
+        # Models shared with a resident workflow (see SharedLoaderCache) must stay where they are
+        seen = set()
+        for result in shared_loader_cache.shared_results(self.resident):
+            find_weights(result, [], [], seen)
+
+        patchers, modules = [], []
+        find_weights(getattr(workflow_obj, "config", {}), patchers, modules, seen)
+
+        # Estimate the size first so we never pin more than the budget allows
+        estimate = weights_size(patchers, modules)
+        if estimate > self.host_budget:
+            return False
+        while self.standby and sum(self.standby_sizes.values()) + estimate > self.host_budget:
+            oldest = next(iter(self.standby))
+            self._drop(oldest, self.standby.pop(oldest))
+            self.standby_sizes.pop(oldest, None)
+            self._standby_modules.pop(oldest, None)
+            self._standby_patchers.pop(oldest, None)
+
+        start_time = time.time()
+        size = 0
+        restore = []
+        pinned_patchers = []
+        try:
+            for patcher in patchers:
+                # Let ComfyUI move the model off the GPU first, so its bookkeeping stays correct
+                unload_patcher(patcher)
+                patcher_size = move_module(patcher.model, "cpu", pin=True)
+                pinned_patchers.append((patcher, patcher_size))
+                size += patcher_size
+            for module in modules:
+                parameter = next(module.parameters(), None)
+                original_device = parameter.device if parameter is not None else torch.device("cpu")
+                size += move_module(module, "cpu", pin=True)
+                restore.append((module, original_device))
+        except Exception as e:
+            print(f"Could not move {name} to warm standby: {e}")
+            return False
+
+        release_unreferenced_memory()
+        self.standby[name] = workflow_obj
+        self.standby_sizes[name] = size
+        self._standby_modules[name] = restore
+        self._standby_patchers[name] = pinned_patchers
+        print(f"Moved workflow {name} to warm standby ({self._format_size(size)} pinned host RAM) "
+              f"in {time.time() - start_time:.2f} seconds")
+        return True
+
+    def _restore_from_standby(self, name: str):
+        """Copies a standby workflow's weights back to the GPU and returns the workflow object."""
+        workflow_obj = self.standby.pop(name)
+        self.standby_sizes.pop(name, None)
+        self._standby_patchers.pop(name, None)
+        # ComfyUI models are loaded from the pinned memory by ComfyUI itself on their next use;
+        # models ComfyUI doesn't manage are copied back to where they were
+        for module, device in self._standby_modules.pop(name, []):
+            move_module(module, device)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return workflow_obj
+
+    def _reclaim_shared(self, name: str):
+        """
+        Moves models the workflow shares with a standby workflow back to the GPU.
+
+        A shared model is pinned together with the last resident workflow that used it. When
+        another workflow gets the same model from the loader cache, it has to be on the GPU again.
+        """
+        shared_modules, shared_models = {}, set()
+        for result in shared_loader_cache.shared_results([name]):
+            patchers, modules = [], []
+            find_weights(result, patchers, modules, set())
+            shared_modules.update((id(module), module) for module in modules)
+            shared_models.update(id(patcher.model) for patcher in patchers)
+        if not shared_modules and not shared_models:
+            return
+
+        for standby_name, restore in self._standby_modules.items():
+            for module, device in [entry for entry in restore if id(entry[0]) in shared_modules]:
+                self.standby_sizes[standby_name] -= move_module(module, device)
+                restore.remove((module, device))
+
+        # ComfyUI models were taken out of ComfyUI's loaded models (see unload_patcher), so ComfyUI
+        # loads them onto the GPU itself on their next use, copying from the pinned memory.
+        # They only have to leave the standby's bookkeeping.
+        for standby_name, pinned in self._standby_patchers.items():
+            for patcher, patcher_size in [entry for entry in pinned if id(entry[0].model) in shared_models]:
+                self.standby_sizes[standby_name] -= patcher_size
+                pinned.remove((patcher, patcher_size))
+
+    def offload_all(self):
+        """Moves all resident workflows to the warm standby, or unloads them if they don't fit there."""
+        for name in list(self.resident):
+            self.evict(name)
+
+    def evict_all(self):
+        """Unloads all resident workflows and empties the warm standby."""
+        for name in list(self.resident):
+            self._drop(name, self.resident.pop(name))
+        for name in list(self.standby):
+            self._drop(name, self.standby.pop(name))
+        self.standby_sizes.clear()
+        self._standby_modules.clear()
+        self._standby_patchers.clear()
+
+    def swap_in_report(self) -> str:
+        """Compares the average swap-in times of the warm standby and a cold load from disk."""
+        parts = []
+        for path, label in (("standby", "pinned host RAM"), ("cold", "disk")):
+            times = self.swap_in_times[path]
+            if not times:
+                continue
+            first_runs = self.first_run_times[path]
+            first_run = f", first job {sum(first_runs) / len(first_runs):.2f}s" if first_runs else ""
+            parts.append(f"{label}: {len(times)}x avg {sum(times) / len(times):.2f}s{first_run}")
+        return "Swap-in times - " + (" | ".join(parts) if parts else "none yet")
+
+    def used(self) -> int:
+        """Returns the summed footprint of all resident workflows in bytes."""
+        return sum(self.footprints.get(name, 0) for name in self.resident)
+
+    def summary(self) -> str:
+        """Returns the resident workflows and the budget as a single log line."""
+        resident = ", ".join(f"{name} ({self._format_size(self.footprints.get(name, 0))})" for name in self.resident)
+        standby = ", ".join(f"{name} ({self._format_size(size)})" for name, size in self.standby_sizes.items())
+        return (f"Resident workflows: {resident or 'none'} | {self._format_size(self.used())} of {self._format_size(self.budget)} budget"
+                f" | Warm standby: {standby or 'none'}"
+                f" | Shared models: {len(shared_loader_cache.entries)} ({shared_loader_cache.hits} reused)")
+
+    def _record(self, name: str, footprint: int):
+        self.footprints[name] = footprint
+
+    def _make_room(self, needed: int, keep: str = None):
+        """Evicts least recently used workflows until `needed` more bytes fit into the budget."""
+        while self.resident:
+            candidates = [name for name in self.resident if name != keep]
+            if not candidates:
+                break
+            # Without a budget (e.g. no CUDA) only a single workflow stays resident
+            if self.budget > 0 and self.used() + needed <= self.budget:
+                break
+            self.evict(candidates[0])
+
+    @staticmethod
+    def _format_size(num_bytes: int) -> str:
+        return f"{num_bytes / 1024**3:.1f} GB"
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable
+
+import requests
+
+
+class ResultSpool:
+    """
+    Durable on-disk queue for generated results.
+
+    Every result is written to the spool directory before it is uploaded. A background
+    thread drains the directory oldest-first and only deletes a result once the backend
+    accepted it. Uploads that fail on the network or the server are retried with exponential
+    backoff, and anything still in the directory when the program exits (or restarts) is
+    picked up again on the next start, so a flaky connection never costs another generation.
+    Results that can't be read or that the backend rejects are moved to `failed/`.
+
+    Each spooled job consists of one file per uploaded part plus a JSON manifest. The
+    manifest is written last, so only complete results are ever uploaded.
+    """
+
+    def __init__(self, spool_dir: str, upload_fn: Callable[[str, dict], None],
+                 initial_backoff: float = 1, max_backoff: float = 60):
+        """
+        Args:
+            spool_dir: The directory results are stored in until they are uploaded.
+            upload_fn: Uploads one result. Called with the image ID and a dict mapping the
+                multipart field name to a (filename, bytes, content type) tuple. Must raise
+                an exception if the upload failed.
+            initial_backoff: Seconds to wait after the first failed upload.
+            max_backoff: Upper limit for the wait between retries.
+        """
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, "failed")
+        self.upload_fn = upload_fn
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._uploader = None
+
+    def start(self):
+        """Starts the background uploader. Results left over from a previous run are uploaded first."""
+        leftover = self.pending()
+        if leftover:
+            print(f"Found {leftover} result(s) from a previous run in {self.spool_dir}, uploading...")
+        self._stop.clear()
+        if self._uploader is None or not self._uploader.is_alive():
+            self._uploader = threading.Thread(target=self._upload_loop, name="spool-uploader", daemon=True)
+            self._uploader.start()
+
+    def stop(self, timeout: float = 30) -> int:
+        """
+        Gives the uploader up to `timeout` seconds to drain the spool, then stops it.
+
+        Returns:
+            int: The number of results still on disk. They are uploaded on the next start.
+        """
+        deadline = time.time() + timeout
+        while self.pending() and time.time() < deadline:
+            self._wakeup.set()
+            time.sleep(0.2)
+
+        self._stop.set()
+        self._wakeup.set()
+        if self._uploader is not None:
+            self._uploader.join(max(0, deadline - time.time()) + 1)
+
+        remaining = self.pending()
+        if remaining:
+            print(f"{remaining} result(s) remain in {self.spool_dir} and will be uploaded on the next start")
+        return remaining
+
+    def put(self, image_id: str, files: dict) -> None:
+        """
+        Writes a result to disk and wakes up the uploader.
+
+        Args:
+            image_id: The ID of the job the result belongs to.
+            files: A dict mapping the multipart field name to a (filename, bytes, content type) tuple.
+        """
+        name = self._safe_name(image_id)
+        manifest = {"image_id": image_id, "created": time.time(), "files": {}}
+
+        for field, (filename, content, content_type) in files.items():
+            part_path = f"{name}.{field}"
+            self._write_atomic(os.path.join(self.spool_dir, part_path), content)
+            manifest["files"][field] = {"filename": filename, "content_type": content_type, "path": part_path}
+
+        # The manifest is written last: its presence marks the result as complete
+        self._write_atomic(os.path.join(self.spool_dir, f"{name}.json"), json.dumps(manifest).encode("utf-8"))
+        self._wakeup.set()
+
+    def pending(self) -> int:
+        """Returns the number of results waiting to be uploaded."""
+        return len(self._manifests())
+
+    def _manifests(self) -> list:
+        """Returns the paths of all complete results, oldest first."""
+        try:
+            names = [name for name in os.listdir(self.spool_dir) if name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        # The uploader thread removes manifests while other threads count them
+        dated = []
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            try:
+                dated.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue
+        return [path for _, path in sorted(dated)]
+
+    def _upload_loop(self):
+        """
+        Uploads spooled results until stopped.
+
+        Network errors and server errors are retried with exponential backoff. Results that
+        can't be read or that the backend rejects are moved to the `failed` folder, so they
+        never block the results behind them.
+        """
+        backoff = self.initial_backoff
+        while not self._stop.is_set():
+            manifests = self._manifests()
+            if not manifests:
+                # Sleep until a new result is spooled
+                self._wakeup.wait(5)
+                self._wakeup.clear()
+                continue
+
+            manifest_path = manifests[0]
+            try:
+                manifest, files = self._read(manifest_path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                if not os.path.exists(manifest_path):
+                    continue  # Removed while we read it
+                # A corrupt manifest or a missing part will not go away by retrying, and would block every later result
+                print(f"Spooled result {os.path.basename(manifest_path)} is unreadable ({e!r}), moving it to {self.failed_dir}")
+                self._move_to_failed(manifest_path)
+                continue
+
+            try:
+                self._upload(manifest_path, manifest, files)
+                backoff = self.initial_backoff
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                # A client error other than auth, timeout or rate limiting will not go away by retrying
+                if status is not None and 400 <= status < 500 and status not in (401, 408, 429):
+                    print(f"Upload of {os.path.basename(manifest_path)} rejected ({status}), moving it to {self.failed_dir}")
+                    self._move_to_failed(manifest_path)
+                    continue
+                print(f"Upload failed: {e}. Retrying in {backoff:.0f} seconds...")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            except requests.RequestException as e:
+                # Connection errors and timeouts
+                print(f"Upload failed: {e}. Retrying in {backoff:.0f} seconds...")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            except Exception as e:
+                print(f"Upload of {os.path.basename(manifest_path)} failed ({e!r}), moving it to {self.failed_dir}")
+                self._move_to_failed(manifest_path)
+
+    def _read(self, manifest_path: str) -> tuple:
+        """
+        Reads a spooled result from disk.
+
+        Returns:
+            tuple: The manifest and the files to upload, as `put` received them.
+
+        Raises:
+            OSError, ValueError, KeyError, TypeError: If the manifest or one of its parts is missing or corrupt.
+        """
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+        files = {}
+        for field, part in manifest["files"].items():
+            with open(os.path.join(self.spool_dir, part["path"]), "rb") as f:
+                files[field] = (part["filename"], f.read(), part["content_type"])
+        return manifest, files
+
+    def _upload(self, manifest_path: str, manifest: dict, files: dict):
+        """Uploads a single spooled result and removes it from disk afterwards."""
+        start_time = time.time()
+        self.upload_fn(manifest["image_id"], files)
+        print(f"Upload of {manifest['image_id']} took {time.time() - start_time:.2f} seconds")
+
+        # Remove the manifest first, so a crash in between never uploads a result twice
+        os.remove(manifest_path)
+        for part in manifest["files"].values():
+            try:
+                os.remove(os.path.join(self.spool_dir, part["path"]))
+            except FileNotFoundError:
+                pass
+
+    def _move_to_failed(self, manifest_path: str):
+        """Moves a result the backend rejected, or that can't be read, out of the upload queue."""
+        os.makedirs(self.failed_dir, exist_ok=True)
+        try:
+            with open(manifest_path, "r") as f:
+                parts = [part["path"] for part in json.load(f)["files"].values()]
+        except (ValueError, KeyError, TypeError):
+            # A corrupt manifest doesn't name its parts, they are moved by their common file name prefix
+            prefix = os.path.basename(manifest_path)[:-len(".json")] + "."
+            parts = [name for name in os.listdir(self.spool_dir) if name.startswith(prefix) and name != os.path.basename(manifest_path)]
+        for part in parts:
+            source = os.path.join(self.spool_dir, part)
+            if os.path.exists(source):
+                os.replace(source, os.path.join(self.failed_dir, part))
+        os.replace(manifest_path, os.path.join(self.failed_dir, os.path.basename(manifest_path)))
+
+    @staticmethod
+    def _safe_name(image_id: str) -> str:
+        """
+        Turns an image ID into a safe file name.
+
+        A short hash of the raw ID is appended, so IDs that only differ in replaced
+        characters (e.g. "a/b" and "a_b") never share a file.
+        """
+        digest = hashlib.sha1(str(image_id).encode("utf-8")).hexdigest()[:8]
+        return f"{re.sub(r'[^A-Za-z0-9._-]', '_', str(image_id))}-{digest}"
+
+    @staticmethod
+    def _write_atomic(path: str, content: bytes):
+        """Writes a file so that it is either complete or not there at all, even after a crash."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
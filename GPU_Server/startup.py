@@ -0,0 +1,95 @@
+import importlib.util
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+
+# Results of slow startup lookups, kept between starts of the worker
+STARTUP_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_cache.json")
+
+# How the workflow scripts create their nodes: NODE_CLASS_MAPPINGS["KSampler"]()
+NODE_TYPE_PATTERN = re.compile(r"""NODE_CLASS_MAPPINGS\[\s*["']([^"']+)["']\s*\]""")
+
+
+class StartupCache:
+    """
+    A small JSON file with values that are slow to find at startup but rarely change,
+    like the location of the ComfyUI directory or which custom node pack defines which node.
+
+    Every user of a value checks that it is still valid (e.g. that a cached path still exists),
+    so deleting the file is always safe.
+    """
+
+    def __init__(self, path: str = STARTUP_CACHE_PATH):
+        self.path = path
+        self._data = None
+
+    def _load(self) -> dict:
+        if self._data is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, key: str, default=None):
+        return self._load().get(key, default)
+
+    def set(self, key: str, value):
+        """Stores a value and writes the file right away."""
+        self._load()[key] = value
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"  # Supervised workers may write at the same time
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not write the startup cache {self.path}: {e}")
+
+
+class StartupTimer:
+    """Measures the phases of the worker startup, e.g. `with timer.phase("Custom nodes"): ...`"""
+
+    def __init__(self):
+        self.phases = []  # (name, seconds) in the order they ran
+
+    @contextmanager
+    def phase(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start_time))
+
+    def summary(self) -> str:
+        """Returns the breakdown as printable lines, with the share of every phase."""
+        total = sum(seconds for _, seconds in self.phases)
+        lines = [f"Startup took {total:.2f} seconds:"]
+        for name, seconds in self.phases:
+            share = seconds / total * 100 if total > 0 else 0
+            lines.append(f"  {name:<24} {seconds:7.2f}s {share:5.1f}%")
+        return "\n".join(lines)
+
+
+def required_node_types(module_names) -> set:
+    """
+    Returns the node types the given workflow modules create, read from their source code.
+
+    The modules are not imported, so this is cheap and works before ComfyUI is set up.
+    Modules that can't be found are skipped.
+    """
+    node_types = set()
+    for module_name in module_names:
+        spec = importlib.util.find_spec(module_name)
+        if spec is None or not spec.origin:
+            print(f"Workflow module {module_name} not found")
+            continue
+        with open(spec.origin, "r", encoding="utf-8") as f:
+            node_types.update(NODE_TYPE_PATTERN.findall(f.read()))
+    return node_types
+
+
+# The startup cache of this worker
+startup_cache = StartupCache()
@@ -0,0 +1,252 @@
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import List
+
+# Exit code a supervised worker uses to ask for a restart (instead of re-executing itself)
+RESTART_EXIT_CODE = 3
+
+# Environment variables passed to supervised workers
+SUPERVISED_ENV = "IAP_SUPERVISED"
+WORKER_NAME_ENV = "IAP_WORKER_NAME"
+WORKER_INDEX_ENV = "IAP_WORKER_INDEX"  # Position of the worker, e.g. to give every worker its own metrics port
+RESTART_COUNT_ENV = "IAP_RESTART_COUNT"  # How often the worker was restarted, exported as a metric
+
+
+def get_visible_devices() -> List[str]:
+    """
+    Returns the IDs of all CUDA devices this machine exposes.
+
+    Respects CUDA_VISIBLE_DEVICES if it is set, otherwise asks nvidia-smi and falls back to PyTorch.
+    """
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        return [device.strip() for device in visible.split(",") if device.strip()]
+
+    try:
+        result = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"],
+            capture_output=True, text=True, check=True,
+        )
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+    except (OSError, subprocess.CalledProcessError):
+        print("nvidia-smi not available, falling back to PyTorch device enumeration")
+
+    import torch
+    return [str(i) for i in range(torch.cuda.device_count())]
+
+
+class WorkerProcess:
+    """A single `main.py` worker pinned to one CUDA device, plus the statistics parsed from its log."""
+
+    def __init__(self, device: str, command: List[str], index: int = 0):
+        self.device = device
+        self.index = index
+        self.name = f"gpu{device}"
+        self.command = command
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+
+        # Statistics parsed from the worker's output
+        self.jobs = 0
+        self.generation_time = 0.0
+        self.uploads = 0
+        self.errors = 0
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        """Starts the worker with only its own device visible."""
+        env = os.environ.copy()
+        env["CUDA_VISIBLE_DEVICES"] = self.device
+        env[SUPERVISED_ENV] = "1"
+        env[WORKER_NAME_ENV] = self.name
+        env[WORKER_INDEX_ENV] = str(self.index)
+        env[RESTART_COUNT_ENV] = str(self.restarts)
+        env["PYTHONUNBUFFERED"] = "1"  # Stream log lines as they are printed
+
+        self.process = subprocess.Popen(
+            self.command, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+        )
+        self.started_at = time.time()
+        threading.Thread(target=self._forward_output, args=(self.process,), name=f"{self.name}-log", daemon=True).start()
+        print(f"[supervisor] Started worker {self.name} (PID {self.process.pid})")
+
+    def _forward_output(self, process):
+        """Prints the worker's output with a device prefix and collects statistics from it."""
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            print(f"[{self.name}] {line}")
+            self._parse_line(line)
+
+    def _parse_line(self, line: str):
+        with self._stats_lock:
+            match = re.search(r"Time taken to generate image: ([\d.]+) seconds", line)
+            if match:
+                self.jobs += 1
+                self.generation_time += float(match.group(1))
+            elif line.startswith("Upload of ") and " took " in line:
+                self.uploads += 1
+            elif line.startswith("Error:"):
+                self.errors += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "jobs": self.jobs,
+                "avg_generation_time": self.generation_time / self.jobs if self.jobs else 0.0,
+                "uploads": self.uploads,
+                "errors": self.errors,
+                "restarts": self.restarts,
+            }
+
+
+class Supervisor:
+    """
+    Runs one `poll_job` worker per CUDA device.
+
+    Each worker is a separate `main.py` process that only sees its own GPU, so every device
+    processes its own jobs in parallel. The supervisor:
+    - restarts workers that crashed or asked for a restart to clear their VRAM, and leaves
+      workers stopped that exited cleanly (code 0) or keep failing with code 1 right after
+      their start, which usually means a configuration error a restart can't fix,
+    - prefixes every log line with the device it came from,
+    - prints combined statistics of all workers at a fixed interval and on shutdown.
+    """
+
+    def __init__(self, worker_args: List[str], devices: List[str] = None, stats_interval: float = 300,
+                 max_restart_backoff: float = 60, max_failed_starts: int = 5):
+        """
+        Args:
+            worker_args: Command-line arguments passed to every worker's main.py.
+            devices: The CUDA device IDs to run workers on. Defaults to all visible devices.
+            stats_interval: Seconds between two combined statistics reports.
+            max_restart_backoff: Upper limit for the delay before restarting a crashing worker.
+            max_failed_starts: How often in a row a worker may exit with code 1 within 5 minutes
+                of its start before it is given up.
+        """
+        if devices is None:
+            devices = get_visible_devices()
+        script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        command = [sys.executable, script_path] + list(worker_args)
+
+        self.workers = [WorkerProcess(device, command, index) for index, device in enumerate(devices)]
+        self.stats_interval = stats_interval
+        self.max_restart_backoff = max_restart_backoff
+        self.max_failed_starts = max_failed_starts
+        self.shutdown_requested = False
+        self.started_at = None
+
+    def _handle_signal(self, sig, frame):
+        """Forwards the shutdown to all workers, which then stop gracefully."""
+        if not self.shutdown_requested:
+            print("[supervisor] Shutdown requested - stopping all workers...")
+        self.shutdown_requested = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.poll() is None:
+                worker.process.send_signal(signal.SIGINT)
+
+    def run(self):
+        """Starts all workers and keeps them running until shutdown is requested."""
+        if not self.workers:
+            print("[supervisor] No CUDA devices found, nothing to supervise.")
+            return
+
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+
+        print("=" * 60)
+        print(f"Supervising {len(self.workers)} worker(s) on device(s): {', '.join(w.device for w in self.workers)}")
+        print("=" * 60)
+
+        self.started_at = time.time()
+        for worker in self.workers:
+            worker.start()
+
+        next_restart = {worker.name: None for worker in self.workers}
+        backoff = {worker.name: 1.0 for worker in self.workers}
+        failed_starts = {worker.name: 0 for worker in self.workers}
+        stopped = set()  # Workers that are not restarted anymore
+        last_report = time.time()
+
+        while not self.shutdown_requested and len(stopped) < len(self.workers):
+            for worker in self.workers:
+                if worker.name in stopped:
+                    continue
+                exit_code = worker.process.poll()
+                if exit_code is None:
+                    continue
+
+                # Decide once per exit whether and when to restart, backing off if the worker keeps failing right after start
+                if next_restart[worker.name] is None:
+                    uptime = time.time() - worker.started_at
+                    if exit_code == 0:
+                        print(f"[supervisor] Worker {worker.name} stopped after {uptime:.0f}s, not restarting it")
+                        stopped.add(worker.name)
+                        continue
+                    if exit_code == RESTART_EXIT_CODE:
+                        print(f"[supervisor] Worker {worker.name} requested a restart")
+                        backoff[worker.name] = 1.0
+                        failed_starts[worker.name] = 0
+                    else:
+                        if exit_code < 0:
+                            print(f"[supervisor] Worker {worker.name} was killed by signal {-exit_code} after {uptime:.0f}s")
+                        else:
+                            print(f"[supervisor] Worker {worker.name} exited with code {exit_code} after {uptime:.0f}s")
+                        failed_starts[worker.name] = failed_starts[worker.name] + 1 if exit_code == 1 and uptime <= 300 else 0
+                        if failed_starts[worker.name] >= self.max_failed_starts:
+                            print(f"[supervisor] Worker {worker.name} failed {failed_starts[worker.name]} times in a row "
+                                  f"right after starting, giving up on it")
+                            stopped.add(worker.name)
+                            continue
+                        backoff[worker.name] = 1.0 if uptime > 300 else min(backoff[worker.name] * 2, self.max_restart_backoff)
+                    next_restart[worker.name] = time.time() + backoff[worker.name]
+
+                if time.time() >= next_restart[worker.name]:
+                    worker.restarts += 1
+                    next_restart[worker.name] = None
+                    worker.start()
+
+            if time.time() - last_report >= self.stats_interval:
+                self.print_stats()
+                last_report = time.time()
+            time.sleep(1)
+
+        if not self.shutdown_requested:
+            print("[supervisor] No worker is running anymore")
+        self._wait_for_workers()
+        self.print_stats()
+        print("[supervisor] All workers stopped")
+
+    def _wait_for_workers(self, timeout: float = 120):
+        """Gives the workers time to finish their current job and uploads, then kills the rest."""
+        deadline = time.time() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(max(0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                print(f"[supervisor] Worker {worker.name} did not stop in time, killing it")
+                worker.process.kill()
+                worker.process.wait()
+
+    def print_stats(self):
+        """Prints the combined statistics of all workers."""
+        runtime = time.time() - self.started_at
+        total_jobs = 0
+        print("=" * 60)
+        print(f"[supervisor] Combined statistics after {runtime / 60:.1f} minutes")
+        for worker in self.workers:
+            stats = worker.stats()
+            total_jobs += stats["jobs"]
+            print(f"  {worker.name}: {stats['jobs']} jobs, avg {stats['avg_generation_time']:.2f}s per image, "
+                  f"{stats['uploads']} uploads, {stats['errors']} errors, {stats['restarts']} restarts")
+        throughput = total_jobs / (runtime / 60) if runtime > 0 else 0.0
+        print(f"  Total: {total_jobs} jobs ({throughput:.2f} jobs/minute)")
+        print("=" * 60)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Output Encoding Benchmark
+Compares encode time and file size of the output formats supported by encoding.py
+on an image of the size the workflows generate (1024x1152 by default).
+"""
+
+import os
+import sys
+import time
+
+import click
+import numpy as np
+from PIL import Image
+
+# Make the GPU_Server modules importable when the script is started from this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoding import ImageEncoder, tensor_to_uint8
+
+DEFAULT_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_images", "test_image.jpg")
+
+# (label, ImageEncoder arguments)
+CANDIDATES = [
+    ("PNG level 0", {"output_format": "png", "png_compress_level": 0}),
+    ("PNG level 1", {"output_format": "png", "png_compress_level": 1}),
+    ("PNG level 3", {"output_format": "png", "png_compress_level": 3}),
+    ("PNG level 6 (PIL default)", {"output_format": "png", "png_compress_level": 6}),
+    ("PNG level 9", {"output_format": "png", "png_compress_level": 9}),
+    ("WebP lossless method 0", {"output_format": "webp", "webp_method": 0}),
+    ("WebP lossless method 4", {"output_format": "webp", "webp_method": 4}),
+    ("WebP lossless method 6", {"output_format": "webp", "webp_method": 6}),
+    ("JPEG quality 90", {"output_format": "jpeg", "jpeg_quality": 90}),
+    ("JPEG quality 95", {"output_format": "jpeg", "jpeg_quality": 95}),
+]
+
+
+def load_test_array(path: str, width: int, height: int) -> np.ndarray:
+    """Loads the test image as uint8 RGB array in the output size of the workflows."""
+    with Image.open(path) as img:
+        return np.array(img.convert("RGB").resize((width, height), Image.LANCZOS))
+
+
+def bench_conversion(arr: np.ndarray, repeats: int):
+    """Compares the former float path (copy float32 to the host, clip in NumPy) with the uint8 conversion on the device."""
+    try:
+        import torch
+    except ImportError:
+        print("PyTorch not installed, skipping the conversion benchmark")
+        return
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    tensor = torch.from_numpy(arr.astype(np.float32) / 255.0)[None,].to(device)
+
+    def old_path():
+        host = np.squeeze(tensor.cpu().numpy())
+        return np.clip(host * 255, 0, 255).astype(np.uint8)
+
+    def new_path():
+        return tensor_to_uint8(tensor)
+
+    assert np.array_equal(old_path(), new_path()), "Both conversions must give the same pixels"
+    for label, fn in (("float copy + NumPy clip", old_path), (f"uint8 on {device} + copy", new_path)):
+        fn()  # Warm-up
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        print(f"  {label:<32} {(time.perf_counter() - start) / repeats * 1000:8.1f} ms")
+
+
+@click.command()
+@click.option('-image', '-i', default=DEFAULT_IMAGE, show_default=True, help='Image used for the benchmark.')
+@click.option('-width', default=1024, show_default=True, help='Width of the benchmark image.')
+@click.option('-height', default=1152, show_default=True, help='Height of the benchmark image.')
+@click.option('-repeats', '-r', default=5, show_default=True, help='Encodes per format; the average is reported.')
+def main(image, width, height, repeats):
+    arr = load_test_array(image, width, height)
+    raw_size = arr.nbytes
+
+    print("=" * 72)
+    print(f"Encoding a {width}x{height} image, {repeats} repeats per format")
+    print("=" * 72)
+    print(f"  {'Format':<32} {'Time':>10} {'Size':>12} {'Ratio':>8}")
+
+    for label, kwargs in CANDIDATES:
+        encoder = ImageEncoder(**kwargs)
+        data = encoder.encode(arr)  # Warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            data = encoder.encode(arr)
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"  {label:<32} {elapsed * 1000:8.1f} ms {len(data) / 1024:9.0f} KB {raw_size / len(data):7.1f}x")
+
+    print("-" * 72)
+    print("Tensor to uint8 array conversion:")
+    bench_conversion(arr, repeats)
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,643 @@
+#!/usr/bin/env python3
+"""
+Orchestration Benchmark
+Runs the real worker loop (`poll_job`) with all workflows against stub ComfyUI nodes, so it
+needs neither a GPU nor any model files. The stub nodes sleep for a configurable time and
+return tensors of the real shapes, everything else is the production code: polling, image
+decoding, the dispatcher and its swap logic, encoding, spooling and uploading.
+
+A small in-process backend hands out the images from `test_images` and receives the
+results. The benchmark reports throughput and p50/p95/p99 latencies, and how much time the
+worker spent outside of the stub nodes, which is the overhead of our own code.
+"""
+
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import click
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# Make the GPU_Server modules importable when the script is started from this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_images")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+# Output types of the nodes the workflows use. Nodes that are not listed return a single IMAGE.
+NODE_OUTPUTS = {
+    "CheckpointLoaderSimple": ("MODEL", "CLIP", "VAE"),
+    "UNETLoader": ("MODEL",),
+    "CLIPLoader": ("CLIP",),
+    "DualCLIPLoader": ("CLIP",),
+    "VAELoader": ("VAE",),
+    "ControlNetLoader": ("CONTROL_NET",),
+    "LoraLoader": ("MODEL", "CLIP"),
+    "LoraLoaderModelOnly": ("MODEL",),
+    "T5TokenizerOptions": ("CLIP",),
+    "JanusModelLoader": ("MODEL", "PROCESSOR"),
+    "IPAdapterUnifiedLoader": ("MODEL", "IPADAPTER"),
+    "IPAdapterEncoder": ("EMBEDS", "EMBEDS"),
+    "IPAdapterCombineEmbeds": ("EMBEDS",),
+    "IPAdapterEmbeds": ("MODEL",),
+    "IPAdapter": ("MODEL",),
+    "EmptyLatentImage": ("LATENT",),
+    "EmptySD3LatentImage": ("LATENT",),
+    "VAEEncode": ("LATENT",),
+    "KSampler": ("LATENT",),
+    "KSamplerAdvanced": ("LATENT",),
+    "SamplerCustomAdvanced": ("LATENT", "LATENT"),
+    "CFGGuider": ("GUIDER",),
+    "KSamplerSelect": ("SAMPLER",),
+    "BasicScheduler": ("SIGMAS",),
+    "CLIPTextEncode": ("CONDITIONING",),
+    "FluxGuidance": ("CONDITIONING",),
+    "ControlNetApplyAdvanced": ("CONDITIONING", "CONDITIONING"),
+    "JanusImageUnderstanding": ("STRING",),
+    "OllamaConnectivityV2": ("CONNECTIVITY",),
+    "OllamaGenerateV2": ("STRING",),
+    "Text Multiline": ("STRING",),
+    "StringConcatenate": ("STRING",),
+    "easy showAnything": ("STRING",),
+    "LoadImage": ("IMAGE", "MASK"),
+    "ImageResizeKJ": ("IMAGE", "INT", "INT"),
+    "AlphaChanelAsMask": ("MASK",),
+    "VAEDecode": ("IMAGE",),
+    "SaveImage": (),
+}
+
+# Default synthetic cost per call in seconds, roughly in proportion to a real run. Nodes that are not listed cost nothing.
+DEFAULT_COSTS = {
+    "CheckpointLoaderSimple": 0.3,
+    "UNETLoader": 0.3,
+    "CLIPLoader": 0.15,
+    "DualCLIPLoader": 0.15,
+    "VAELoader": 0.03,
+    "ControlNetLoader": 0.05,
+    "JanusModelLoader": 0.1,
+    "IPAdapterUnifiedLoader": 0.1,
+    "LoraLoader": 0.03,
+    "LoraLoaderModelOnly": 0.03,
+    "CLIPTextEncode": 0.02,
+    "IPAdapterEncoder": 0.02,
+    "Image Rembg (Remove Background)": 0.03,
+    "DepthAnythingPreprocessor": 0.03,
+    "JanusImageUnderstanding": 0.08,
+    "OllamaGenerateV2": 0.08,
+    "VAEEncode": 0.02,
+    "VAEDecode": 0.03,
+    "KSampler": 0.3,
+    "KSamplerAdvanced": 0.15,
+    "SamplerCustomAdvanced": 0.3,
+}
+
+# Widget inputs of the stub nodes, in the order of the exported `widgets_values`. Only needed where
+# the graph engine must know the names (seeds with their control value, the upload button); other
+# widgets are named after the graph's widget inputs or get generic names (see graph_input_types).
+STUB_WIDGETS = {
+    "KSampler": [("seed", "INT"), ("steps", "INT"), ("cfg", "FLOAT"), ("sampler_name", "STRING"),
+                 ("scheduler", "STRING"), ("denoise", "FLOAT")],
+    "KSamplerAdvanced": [("add_noise", "STRING"), ("noise_seed", "INT"), ("steps", "INT"), ("cfg", "FLOAT"),
+                         ("sampler_name", "STRING"), ("scheduler", "STRING"), ("start_at_step", "INT"),
+                         ("end_at_step", "INT"), ("return_with_leftover_noise", "STRING")],
+    "LoadImage": [("image", "STRING")],
+    "EmptyLatentImage": [("width", "INT"), ("height", "INT"), ("batch_size", "INT")],
+    "EmptySD3LatentImage": [("width", "INT"), ("height", "INT"), ("batch_size", "INT")],
+}
+
+# Each additional image in a batched sampler pass adds this fraction of the single-image cost
+BATCH_COST_FACTOR = 0.35
+
+LATENT_CHANNELS = {"EmptySD3LatentImage": 16}  # All other latents have 4 channels
+CAPTION = "A plush toy animal sitting upright, facing the camera, with long arms, round ears and large feet."
+
+
+class StubModel(torch.nn.Module):
+    """Stands in for a loaded model. Its weights give the residency manager something to measure and move."""
+
+    def __init__(self, kind: str, size_mb: float):
+        super().__init__()
+        self.kind = kind
+        self.weight = torch.nn.Parameter(torch.zeros(max(1, int(size_mb * 1024**2 / 4))), requires_grad=False)
+
+
+class StubNode:
+    """
+    Base class of the stub nodes. Every public method call sleeps for the node's synthetic
+    cost and returns outputs of the same types and shapes the real node would return.
+    """
+
+    node_name = None
+    bench = None  # The StubNodes collection the node belongs to
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(**kwargs):
+            return self.bench.call(self.node_name, kwargs)
+        return call
+
+
+class StubNodes:
+    """Creates the stub NODE_CLASS_MAPPINGS and keeps count of the time spent in stub nodes."""
+
+    def __init__(self, costs: dict, images: list, model_mb: float):
+        """
+        Args:
+            costs: Synthetic cost per node call in seconds, by node class name.
+            images: Encoded images LoadImage returns for its file names (watermarks, references).
+            model_mb: The size of every stub model in MB.
+        """
+        self.costs = costs
+        self.model_mb = model_mb
+        self.images = [self._decode(image_bytes) for image_bytes in images]
+        self.node_time = 0.0  # Seconds spent in stub nodes, only written by the GPU thread
+        self.calls = 0
+        self._load_count = itertools.count()
+
+    def mappings(self, input_types: dict = None) -> dict:
+        """
+        Returns a NODE_CLASS_MAPPINGS dict with a stub class for every node the workflows use.
+
+        Args:
+            input_types: The INPUT_TYPES of the nodes of the exported graphs (see graph_input_types),
+                so the graph engine can run them. These nodes are called through FUNCTION "execute".
+        """
+        input_types = input_types or {}
+        names = set(NODE_OUTPUTS) | set(DEFAULT_COSTS) | set(input_types) | {
+            "ImageCompositeMasked", "TextOnImage", "MaskToImage", "MultiplyNode", "InvertImageNode", "AddNode",
+        }
+        mappings = {}
+        for name in names:
+            attributes = {"node_name": name, "bench": self, "FUNCTION": "execute"}
+            spec = input_types.get(name, {"required": {}})
+            attributes["INPUT_TYPES"] = classmethod(lambda cls, spec=spec: spec)
+            mappings[name] = type(name, (StubNode,), attributes)
+        return mappings
+
+    def call(self, node_name: str, kwargs: dict) -> tuple:
+        start = time.perf_counter()
+        cost = self.costs.get(node_name, 0)
+        latent = kwargs.get("latent_image")
+        if cost and isinstance(latent, dict):
+            cost *= 1 + BATCH_COST_FACTOR * (latent["samples"].shape[0] - 1)
+        if cost:
+            time.sleep(cost)
+
+        outputs = []
+        for index, kind in enumerate(NODE_OUTPUTS.get(node_name, ("IMAGE",))):
+            # Samplers return the same latent twice (output and denoised output)
+            if kind == "LATENT" and index > 0:
+                outputs.append(outputs[0])
+            else:
+                outputs.append(self._output(node_name, kind, index, kwargs))
+        self.node_time += time.perf_counter() - start
+        self.calls += 1
+        return tuple(outputs)
+
+    @staticmethod
+    def _decode(image_bytes: bytes) -> torch.Tensor:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            arr = np.array(img.convert("RGB").resize((1024, 1024), Image.BILINEAR)).astype(np.float32) / 255.0
+        return torch.from_numpy(arr)[None,]
+
+    def _output(self, node_name: str, kind: str, index: int, kwargs: dict):
+        if kind in ("MODEL", "CLIP", "VAE", "CONTROL_NET", "IPADAPTER", "PROCESSOR"):
+            # Patches (LoRAs, tokenizer options, IP-Adapter) return the model they were given
+            passed = kwargs.get(kind.lower())
+            return passed if passed is not None else StubModel(kind, self.model_mb)
+        if kind == "CONDITIONING":
+            # ControlNet and guidance nodes return the conditioning they were given
+            key = ("positive", "negative")[index] if node_name == "ControlNetApplyAdvanced" else "conditioning"
+            if key in kwargs:
+                return kwargs[key]
+            tokens = 77 * max(1, -(-len(str(kwargs.get("text", "")).split()) // 60))
+            return [[torch.zeros(1, tokens, 2048), {"pooled_output": torch.zeros(1, 1280)}]]
+        if kind == "LATENT":
+            return self._latent(node_name, kwargs)
+        if kind == "IMAGE":
+            return self._image(node_name, kwargs)
+        if kind == "MASK":
+            if node_name == "LoadImage":
+                return torch.zeros(1, 64, 64)  # Like LoadImage for images without an alpha channel
+            return 1.0 - self._image(node_name, kwargs)[..., 0]
+        if kind == "STRING":
+            texts = [kwargs[key] for key in ("string_a", "string_b", "text") if isinstance(kwargs.get(key), str)]
+            return kwargs.get("delimiter", "").join(texts) if len(texts) > 1 else (texts[0] if texts else CAPTION)
+        if kind == "EMBEDS":
+            embeds = [value for key, value in sorted(kwargs.items()) if key.startswith("embed") and value is not None]
+            return torch.cat(embeds, dim=1) if embeds else torch.randn(1, 4, 2048)
+        if kind == "SIGMAS":
+            return torch.linspace(1, 0, kwargs.get("steps", 20) + 1)
+        if kind == "INT":
+            return kwargs.get("width" if index == 1 else "height", 1024)
+        return {"kind": kind, **{key: value for key, value in kwargs.items() if not isinstance(value, torch.Tensor)}}
+
+    def _latent(self, node_name: str, kwargs: dict) -> dict:
+        if "latent_image" in kwargs:
+            # Sampler: the latent stays the same, the noise source is used like the real sampler would
+            samples = kwargs["latent_image"]["samples"]
+            noise = kwargs.get("noise")
+            if hasattr(noise, "generate_noise"):
+                samples = samples + 0.05 * noise.generate_noise(kwargs["latent_image"])
+            return {"samples": samples.clone()}
+        if "pixels" in kwargs:
+            # VAE encode: 8x smaller, 16 channels like the Chroma/FLUX VAE
+            pixels = kwargs["pixels"].movedim(-1, 1)
+            pooled = F.avg_pool2d(pixels, 8)
+            return {"samples": pooled.repeat(1, 6, 1, 1)[:, :16]}
+        channels = LATENT_CHANNELS.get(node_name, 4)
+        return {"samples": torch.zeros(kwargs.get("batch_size", 1), channels,
+                                       kwargs.get("height", 1024) // 8, kwargs.get("width", 1024) // 8)}
+
+    def _image(self, node_name: str, kwargs: dict) -> torch.Tensor:
+        if node_name == "VAEDecode":
+            samples = kwargs["samples"]["samples"]
+            decoded = F.interpolate(samples[:, :3], scale_factor=8, mode="bilinear", align_corners=False)
+            return decoded.movedim(1, -1).clamp(0, 1)
+        if node_name == "LoadImage":
+            return self.images[next(self._load_count) % len(self.images)]
+        if node_name == "MaskToImage":
+            return kwargs["mask"][..., None].expand(-1, -1, -1, 3)
+
+        for key in ("source", "image", "images", "pixels", "input1", "destination"):
+            image = kwargs.get(key)
+            if isinstance(image, torch.Tensor) and image.ndim == 4:
+                break
+        else:
+            return torch.rand(1, 1024, 1024, 3)
+        if "width" in kwargs and "height" in kwargs and tuple(image.shape[1:3]) != (kwargs["height"], kwargs["width"]):
+            image = F.interpolate(image.movedim(-1, 1), size=(kwargs["height"], kwargs["width"]), mode="nearest").movedim(1, -1)
+        return image.clone()
+
+
+def graph_input_types(graph_files: list) -> dict:
+    """
+    Derives INPUT_TYPES for the stub nodes from exported workflow graphs.
+
+    Connected inputs become inputs of their link type, widgets are taken from STUB_WIDGETS, the
+    graph's widget inputs or get generic names, one per saved widget value.
+    """
+    input_types = {}
+    for path in graph_files:
+        with open(path, "r", encoding="utf-8") as f:
+            graph = json.load(f)
+        for node in graph["nodes"]:
+            spec = input_types.setdefault(node["type"], {"required": {}})["required"]
+            widget_names = [node_input["name"] for node_input in node.get("inputs", []) if "widget" in node_input]
+            for node_input in node.get("inputs", []):
+                if "widget" not in node_input:
+                    spec.setdefault(node_input["name"], (node_input["type"],))
+
+            values = node.get("widgets_values")
+            if node["type"] in STUB_WIDGETS:
+                for name, kind in STUB_WIDGETS[node["type"]]:
+                    options = {"image_upload": True} if node["type"] == "LoadImage" else {}
+                    spec.setdefault(name, (kind, options))
+            elif isinstance(values, list):
+                for index in range(len(values)):
+                    name = widget_names[index] if index < len(widget_names) else f"widget_{index}"
+                    spec.setdefault(name, ("STRING", {}))
+    return input_types
+
+
+def install_comfy_stubs(mappings: dict):
+    """Registers stand-ins for the ComfyUI modules the worker imports, so no ComfyUI installation is needed."""
+    nodes = types.ModuleType("nodes")
+    nodes.NODE_CLASS_MAPPINGS = mappings
+    nodes.init_extra_nodes = lambda *args, **kwargs: None
+
+    model_management = types.ModuleType("comfy.model_management")
+    model_management.current_loaded_models = []
+    model_management.get_torch_device = lambda: torch.device("cpu")
+    model_management.unload_all_models = lambda: None
+    model_management.free_memory = lambda *args, **kwargs: None
+    model_management.soft_empty_cache = lambda *args, **kwargs: None
+
+    sample = types.ModuleType("comfy.sample")
+
+    def prepare_noise(latent_image, seed, noise_inds=None):
+        generator = torch.manual_seed(seed % 2**63)
+        return torch.randn(latent_image.size(), dtype=torch.float32, generator=generator)
+    sample.prepare_noise = prepare_noise
+
+    comfy = types.ModuleType("comfy")
+    comfy.model_management = model_management
+    comfy.sample = sample
+    sys.modules.update({"nodes": nodes, "comfy": comfy, "comfy.model_management": model_management, "comfy.sample": sample})
+
+
+class BenchmarkBackend:
+    """
+    A minimal backend with the API of the real one (/token, GET /job, POST /job).
+
+    It hands out a fixed list of jobs and records when each job was handed out and when its
+    result arrived. Once every result is in, the worker is asked to shut down.
+    """
+
+    def __init__(self, jobs: list, upload_latency: float, on_complete):
+        self.jobs = list(jobs)
+        self.upload_latency = upload_latency
+        self.on_complete = on_complete
+        self.handed_out = {}  # job ID -> time the job was handed out
+        self.completed = {}  # job ID -> time the result arrived
+        self.result_bytes = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> str:
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == "/token":
+                    self._send(200, json.dumps({"access_token": "benchmark", "token_type": "bearer"}).encode())
+                elif self.path == "/job":
+                    backend.receive(body)
+                    self._send(200, b'{"status": "success"}')
+                else:
+                    self._send(404, b"")
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/job":
+                    self._send(404, b"")
+                    return
+                workflow = parse_qs(url.query).get("workflow", [None])[0]
+                job = backend.take_job(workflow)
+                if job is None:
+                    self._send(204, b"", {"X-Long-Poll": "0"})
+                    return
+                headers = {key: job[key] for key in ("first_name", "last_name", "animal_name", "animal_type", "workflow")}
+                headers["img_id"] = job["job_id"]
+                self._send(200, job["image_bytes"], headers, content_type="image/jpeg")
+
+            def _send(self, status, body, headers=None, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="benchmark-backend", daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def take_job(self, workflow: str = None):
+        """Hands out the next job, preferring the worker's loaded workflow among the next few like the test server."""
+        with self._lock:
+            if not self.jobs:
+                return None
+            index = next((i for i, job in enumerate(self.jobs[:3]) if job["workflow"] == workflow), 0)
+            job = self.jobs.pop(index)
+            self.handed_out[job["job_id"]] = time.perf_counter()
+            return job
+
+    def receive(self, body: bytes):
+        match = re.search(rb'name="image_id"\r\n\r\n([^\r]*)\r\n', body)
+        if match is None:
+            return
+        if self.upload_latency:
+            time.sleep(self.upload_latency)
+        with self._lock:
+            self.completed[match.group(1).decode()] = time.perf_counter()
+            self.result_bytes += len(body)
+            done = len(self.completed) >= len(self.handed_out) and not self.jobs
+        if done:
+            self.on_complete()
+
+
+class LogCapture(io.TextIOBase):
+    """Collects the timings the worker prints, and forwards its output if requested."""
+
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.generation_times = []
+        self.upload_times = []
+        self.swaps = 0
+        self._buffer = ""
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            if self.forward is not None:
+                self.forward.write(text)
+            self._buffer += text
+            *lines, self._buffer = self._buffer.split("\n")
+            for line in lines:
+                match = re.search(r"Time taken to generate image: ([\d.]+) seconds", line)
+                if match:
+                    self.generation_times.append(float(match.group(1)))
+                match = re.search(r"Upload of .* took ([\d.]+) seconds", line)
+                if match:
+                    self.upload_times.append(float(match.group(1)))
+                if line.startswith("Switching from "):
+                    self.swaps += 1
+        return len(text)
+
+    def flush(self):
+        if self.forward is not None:
+            self.forward.flush()
+
+
+def percentile(values: list, p: float) -> float:
+    """Returns the p-th percentile (nearest rank) of the values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def format_latencies(label: str, values: list) -> str:
+    return (f"  {label:<28} p50 {percentile(values, 50) * 1000:8.1f} ms   p95 {percentile(values, 95) * 1000:8.1f} ms   "
+            f"p99 {percentile(values, 99) * 1000:8.1f} ms   (n={len(values)})")
+
+
+def find_test_images(folder: str) -> list:
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise click.ClickException(f"No test images found in {folder}")
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images
+
+
+def create_jobs(images: list, workflows: list, count: int, run_length: int) -> list:
+    """Creates `count` jobs cycling through the images, `run_length` jobs in a row per workflow."""
+    jobs = []
+    for i in range(count):
+        jobs.append({
+            "job_id": f"bench-{i:05d}",
+            "image_bytes": images[i % len(images)],
+            "first_name": "Bench",
+            "last_name": f"Mark{i}",
+            "animal_name": "Teddy",
+            "animal_type": "bear",
+            "workflow": workflows[(i // run_length) % len(workflows)],
+        })
+    return jobs
+
+
+def compare_precomputed_embeds(test_images: list, runs: int) -> dict:
+    """
+    Times IP_Adapter_SDXL's generate() with the reference embeddings encoded on every job and
+    precomputed in load_once (see `precompute_embeds` in the workflow script).
+
+    Returns:
+        dict: The generate() durations in seconds for "per job" and "precomputed".
+    """
+    from dispatcher import WorkflowDispatcher
+
+    dispatcher = WorkflowDispatcher()
+    times = {}
+    for label, precompute in (("per job", False), ("precomputed", True)):
+        workflow_obj = dispatcher.create_single_workflow_obj("IP_Adapter_SDXL")
+        workflow_obj.precompute_embeds = precompute
+        workflow_obj.start_load_once()
+        times[label] = []
+        for i in range(runs):
+            start = time.perf_counter()
+            workflow_obj.generate("IP_Adapter_SDXL", test_images[i % len(test_images)], "bear", "Bench", f"Mark{i}", "Teddy")
+            times[label].append(time.perf_counter() - start)
+    return times
+
+
+@click.command()
+@click.option('-jobs', '-n', default=60, show_default=True, help='Number of jobs to run.')
+@click.option('-workflows', '-w', default="ChromaV44,FLUX_Kontext,IP_Adapter_SDXL", show_default=True,
+              help='Comma-separated workflows the jobs cycle through.')
+@click.option('-run-length', default=5, show_default=True, help='Jobs in a row for the same workflow before the next one (controls the swap rate).')
+@click.option('-images', default=TEST_IMAGES_DIR, show_default=True, help='Folder with the images to replay.')
+@click.option('-cost-scale', default=1.0, show_default=True, help='Factor for all synthetic node costs (0 measures our code only).')
+@click.option('-cost', 'cost_overrides', multiple=True, help='Cost of a node in seconds, e.g. -cost KSampler=1.5 (repeatable).')
+@click.option('-model-mb', default=32.0, show_default=True, help='Size of every stub model in MB.')
+@click.option('-upload-latency', default=0.05, show_default=True, help='Seconds the backend takes to accept a result.')
+@click.option('-pipelined', '-p', is_flag=True, help='Run the worker in pipelined mode.')
+@click.option('-prefetch', default=2, show_default=True, help='Jobs buffered ahead of the GPU in pipelined mode.')
+@click.option('-batch', 'max_batch_size', default=1, show_default=True, help='max_batch_size of the worker.')
+@click.option('-batch-wait', 'max_batch_wait', default=0.5, show_default=True, help='max_batch_wait of the worker in seconds.')
+@click.option('-output-format', default="png", show_default=True, help='Output format of the encoder (png, webp, jpeg).')
+@click.option('-graphs', is_flag=True, help='Also run the exported graphs of the workflows through graph_engine.py (the "_graph" workflows).')
+@click.option('-compare-embeds', is_flag=True, help="Only compare IP_Adapter_SDXL's generate() time with the reference embeddings encoded per job and precomputed once.")
+@click.option('-verbose', '-v', is_flag=True, help='Show the worker log.')
+def main(jobs, workflows, run_length, images, cost_scale, cost_overrides, model_mb, upload_latency,
+         pipelined, prefetch, max_batch_size, max_batch_wait, output_format, graphs, compare_embeds, verbose):
+    costs = {name: cost * cost_scale for name, cost in DEFAULT_COSTS.items()}
+    for override in cost_overrides:
+        name, _, seconds = override.rpartition("=")
+        costs[name] = float(seconds)
+
+    test_images = find_test_images(images)
+    stubs = StubNodes(costs, test_images, model_mb)
+    from graph_engine import WORKFLOWS_DIR
+    graph_files = [os.path.join(WORKFLOWS_DIR, name) for name in sorted(os.listdir(WORKFLOWS_DIR)) if name.endswith(".json")]
+    install_comfy_stubs(stubs.mappings(graph_input_types(graph_files)))
+
+    # Imported after the stubs are in place, so the dispatcher picks up the stub node mappings
+    import main as worker
+    import encoding
+
+    if compare_embeds:
+        print("=" * 96)
+        print(f"Running IP_Adapter_SDXL's generate() {jobs} times with and without precomputed reference embeddings")
+        print("=" * 96)
+        with contextlib.redirect_stdout(LogCapture(sys.stdout if verbose else None)):
+            times = compare_precomputed_embeds(test_images, jobs)
+        for label, values in times.items():
+            print(format_latencies(f"generate() {label}", values))
+        saved = percentile(times["per job"], 50) - percentile(times["precomputed"], 50)
+        print(f"  {'Saved per job (p50)':<28} {saved * 1000:.1f} ms")
+        print("=" * 96)
+        return
+
+    workflow_names = [name.strip() for name in workflows.split(",") if name.strip()]
+    if graphs:
+        workflow_names += [f"{name}_graph" for name in workflow_names if not name.endswith("_graph")]
+    job_list = create_jobs(test_images, workflow_names, jobs, max(1, run_length))
+
+    def finish():
+        worker.shutdown_requested = True
+
+    backend = BenchmarkBackend(job_list, upload_latency, on_complete=finish)
+    url = backend.start()
+    spool_dir = tempfile.mkdtemp(prefix="iap-benchmark-")
+    capture = LogCapture(sys.stdout if verbose else None)
+
+    print("=" * 96)
+    print(f"Running {jobs} jobs ({', '.join(workflow_names)}, {run_length} in a row) against stub nodes"
+          f"{' in pipelined mode' if pipelined else ''}, batch size {max_batch_size}")
+    print("=" * 96)
+
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(capture):
+            encoding.configure(output_format=output_format)
+            worker.poll_job(url, "benchmark", pipelined, prefetch, spool_dir=spool_dir, long_poll_wait=0,
+                            max_batch_size=max_batch_size, max_batch_wait=max_batch_wait)
+    finally:
+        elapsed = time.perf_counter() - start
+        backend.stop()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    latencies = [backend.completed[job_id] - handed_out for job_id, handed_out in backend.handed_out.items()
+                 if job_id in backend.completed]
+    if not latencies:
+        raise click.ClickException("No results were received, run with -verbose to see the worker log")
+    first = min(backend.handed_out.values())
+    last = max(backend.completed.values())
+    span = last - first
+    workflow_of = {job["job_id"]: job["workflow"] for job in job_list}
+
+    print(f"  {'Completed jobs':<28} {len(latencies)} of {jobs} in {span:.2f} s "
+          f"({len(latencies) / span * 60:.1f} jobs/minute, {len(latencies) / span:.2f} jobs/s)")
+    print(f"  {'Workflow swaps':<28} {capture.swaps}")
+    print(f"  {'Uploaded':<28} {backend.result_bytes / 1024**2:.1f} MB")
+    print("-" * 96)
+    print(format_latencies("End to end (poll to upload)", latencies))
+    for name in workflow_names:
+        print(format_latencies(f"  {name}", [backend.completed[job_id] - handed_out for job_id, handed_out in backend.handed_out.items()
+                                             if job_id in backend.completed and workflow_of[job_id] == name]))
+    print(format_latencies("generate()", capture.generation_times))
+    print(format_latencies("Upload", capture.upload_times))
+    print("-" * 96)
+
+    # The stub nodes run on the worker's main thread, everything else there is our own code
+    overhead = span - stubs.node_time
+    print(f"  {'Time in stub nodes':<28} {stubs.node_time:.2f} s ({stubs.calls} calls)")
+    print(f"  {'Orchestration overhead':<28} {overhead:.2f} s total, {overhead / len(latencies) * 1000:.1f} ms per job")
+    print(f"  {'Benchmark wall time':<28} {elapsed:.2f} s")
+    print("=" * 96)
+
+
+if __name__ == "__main__":
+    main()
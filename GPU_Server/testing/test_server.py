@@ -3,18 +3,22 @@ Test server to simulate the web backend for testing main.py
 This server provides jobs with images and receives generated results.
 """
 
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import Response
 import uvicorn
+import asyncio
+import click
+import json
+import math
 import os
+import random
 import time
 import threading
 from datetime import datetime, timedelta
 import jwt
 import glob
 from PIL import Image
-import io
 
 app = FastAPI(title="Test Server for GPU Processing")
 security = HTTPBearer()
@@ -27,9 +31,25 @@ TOKEN_EXPIRE_HOURS = 24
 
 # Test data
 TEST_WORKFLOWS = ["FLUX_Kontext", "IP_Adapter_SDXL"]
-current_workflow_index = 0
-job_counter = 0
-jobs_per_workflow = 3  # Switch workflow after this many jobs
+JOBS_PER_WORKFLOW = 3  # Switch workflow after this many jobs
+
+# Pending jobs: the rotation above fills a small backlog the workers pick jobs from
+BACKLOG_SIZE = 6
+
+# Workflow affinity: GET /job?workflow=X prefers pending jobs for the workflow the worker has loaded
+MAX_AFFINITY_SKIPS = 3  # A job is handed out once it was passed over this many times...
+MAX_AFFINITY_WAIT = 120  # ...or after waiting this many seconds, so no workflow starves
+
+# Leases: a job handed out is requeued if its result doesn't arrive within this many seconds
+LEASE_TIMEOUT = 300
+
+# Long polling: GET /job?wait=N holds the request until a job is available or N seconds passed
+MAX_LONG_POLL_WAIT = 60  # Upper limit for the wait parameter in seconds
+LONG_POLL_INTERVAL = 0.25  # How often a held request checks for a new job
+
+# Load generation mode (-load): jobs arrive over time instead of on demand, see generate_load
+load_settings = {}
+load_report_printed = False
 
 def find_test_images():
     """Find test images in the 'test_images' subdirectory"""
@@ -66,7 +86,6 @@ def find_test_images():
     return test_images
 
 TEST_IMAGES = find_test_images()
-current_image_index = 0
 
 # Test animal data
 TEST_ANIMALS = [
@@ -101,27 +120,329 @@ async def login(password: str = Form(...)):
     access_token = create_access_token(data={"sub": "test_user"})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.get("/job")
-async def get_job(user=Depends(verify_token)):
-    """Get a job with image and metadata"""
-    global job_counter, current_workflow_index, current_image_index
-    
+class JobQueue:
+    """Thread-safe in-memory job queue with leases
+
+    All state lives here, guarded by one lock, so request handlers, several workers and the
+    load generator thread can use the queue at the same time.
+
+    A job handed to a worker is leased, not removed: it stays in flight until its result
+    arrives. If no result arrives within the lease timeout (e.g. the worker died mid-job),
+    the lease expires and the job is put back at the front of the queue for the next worker.
+    A result for a job that is already completed is detected as a duplicate.
+    """
+
+    def __init__(self, images, workflows, jobs_per_workflow=JOBS_PER_WORKFLOW, backlog_size=BACKLOG_SIZE,
+                 lease_timeout=LEASE_TIMEOUT):
+        self.images = images
+        self.workflows = workflows
+        self.jobs_per_workflow = jobs_per_workflow
+        self.backlog_size = backlog_size
+        self.lease_timeout = lease_timeout
+        self.auto_fill = True  # Create rotation jobs on demand; off in load generation mode
+
+        self._lock = threading.RLock()
+        self._job_counter = 0
+        self._workflow_index = 0
+        self._image_index = 0
+        self.pending = []  # Jobs waiting for a worker, oldest first
+        self.leases = {}  # job ID -> job currently leased to a worker
+        self.records = {}  # job ID -> timings and lease history of every job
+        self.stats = {"handed_out": 0, "swaps_avoided": 0, "starvation_overrides": 0,
+                      "expired_leases": 0, "duplicates": 0, "late_results": 0}
+
+    @property
+    def current_workflow(self):
+        return self.workflows[self._workflow_index]
+
+    def create_job(self, workflow=None):
+        """Create the next job of the rotation (or for the given workflow) and add it to the queue"""
+        with self._lock:
+            # Switch workflow after certain number of jobs
+            if workflow is None and self._job_counter > 0 and self._job_counter % self.jobs_per_workflow == 0:
+                self._workflow_index = (self._workflow_index + 1) % len(self.workflows)
+                print(f"Switching to workflow: {self.current_workflow}")
+
+            # Get current test data
+            job = {
+                "job_id": f"job_{self._job_counter:04d}",
+                "workflow": workflow or self.current_workflow,
+                "animal_data": TEST_ANIMALS[self._job_counter % len(TEST_ANIMALS)],
+                "image_path": self.images[self._image_index % len(self.images)],
+                "enqueued_at": time.time(),
+                "skipped": 0,  # How often a younger job was preferred over this one
+            }
+            self.pending.append(job)
+            self.records[job["job_id"]] = {
+                "workflow": job["workflow"], "enqueued_at": job["enqueued_at"],
+                "handed_out_at": None,  # First handout
+                "leased_at": None,  # Latest handout
+                "completed_at": None, "expired_at": None,  # expired_at: first lease expiry
+                "attempts": 0, "worker": None, "completed_by": None,
+            }
+            self._job_counter += 1
+            self._image_index += 1
+            return job
+
+    def lease(self, workflow=None, worker=None):
+        """Lease the next job to a worker, or return None if no job is available"""
+        with self._lock:
+            self.requeue_expired()
+            # Keep the backlog filled, then pick a job from it
+            while self.auto_fill and len(self.pending) < self.backlog_size:
+                self.create_job()
+            if not self.pending:
+                return None
+
+            job = self._select(workflow)
+            now = time.time()
+            job["lease_expires_at"] = now + self.lease_timeout
+            self.leases[job["job_id"]] = job
+
+            record = self.records[job["job_id"]]
+            if record["handed_out_at"] is None:
+                record["handed_out_at"] = now
+            record["leased_at"] = now
+            record["attempts"] += 1
+            record["worker"] = worker
+            self.stats["handed_out"] += 1
+            return job
+
+    def complete(self, job_id, worker=None):
+        """Mark a job as done
+
+        Returns "completed" for the first result of a job, "duplicate" if the job was already
+        completed, or "unknown" for job IDs this queue never created.
+        """
+        with self._lock:
+            record = self.records.get(job_id)
+            if record is None:
+                return "unknown"
+            if record["completed_at"] is not None:
+                self.stats["duplicates"] += 1
+                return "duplicate"
+
+            # A result after the lease expired still counts; drop the job from the queue again
+            if job_id not in self.leases or self.leases[job_id]["lease_expires_at"] < time.time():
+                self.stats["late_results"] += 1
+            self.leases.pop(job_id, None)
+            self.pending = [job for job in self.pending if job["job_id"] != job_id]
+
+            record["completed_at"] = time.time()
+            record["completed_by"] = worker or record["worker"]
+            return "completed"
+
+    def is_completed(self, job_id):
+        """Return True if a result for the job was already received"""
+        with self._lock:
+            record = self.records.get(job_id)
+            return record is not None and record["completed_at"] is not None
+
+    def release(self, job_id):
+        """Give a leased job back right away, e.g. when it could not be sent to the worker"""
+        with self._lock:
+            job = self.leases.pop(job_id, None)
+            if job is None:
+                return
+            job["skipped"] = MAX_AFFINITY_SKIPS  # Hand it out next, regardless of workflow affinity
+            self.pending.insert(0, job)
+
+    def requeue_expired(self):
+        """Put jobs whose lease expired back at the front of the queue"""
+        with self._lock:
+            now = time.time()
+            expired = [job for job in self.leases.values() if job["lease_expires_at"] <= now]
+            for job in sorted(expired, key=lambda job: job["enqueued_at"], reverse=True):
+                del self.leases[job["job_id"]]
+                record = self.records[job["job_id"]]
+                if record["expired_at"] is None:
+                    record["expired_at"] = now
+                self.stats["expired_leases"] += 1
+                job["skipped"] = MAX_AFFINITY_SKIPS  # Hand it out next, regardless of workflow affinity
+                self.pending.insert(0, job)
+                print(f"Lease of {job['job_id']} ({record['worker']}) expired after {self.lease_timeout}s, requeued")
+
+    def _select(self, workflow=None):
+        """Remove and return the next pending job, preferring jobs for the given workflow.
+
+        Jobs are handed out oldest first. If the worker has `workflow` loaded and the oldest
+        job needs a different one, the oldest matching job is handed out instead, which saves
+        the worker a model swap. The passed-over jobs are handed out anyway once they were
+        skipped MAX_AFFINITY_SKIPS times or waited MAX_AFFINITY_WAIT seconds.
+        """
+        oldest = self.pending[0]
+        oldest.pop("swap_avoided", None)
+        if workflow is None or oldest["workflow"] == workflow:
+            return self.pending.pop(0)
+
+        # Starvation bound: the oldest job has waited long enough
+        if oldest["skipped"] >= MAX_AFFINITY_SKIPS or time.time() - oldest["enqueued_at"] >= MAX_AFFINITY_WAIT:
+            self.stats["starvation_overrides"] += 1
+            return self.pending.pop(0)
+
+        for index, job in enumerate(self.pending):
+            if job["workflow"] == workflow:
+                for older_job in self.pending[:index]:
+                    older_job["skipped"] += 1
+                self.stats["swaps_avoided"] += 1
+                job["swap_avoided"] = True
+                return self.pending.pop(index)
+
+        # No job for the loaded workflow, the worker has to swap
+        return self.pending.pop(0)
+
+    def snapshot(self):
+        """Return a consistent copy of the records and the queue state"""
+        with self._lock:
+            self.requeue_expired()
+            now = time.time()
+            return {
+                "records": {job_id: dict(record) for job_id, record in self.records.items()},
+                "pending": [job["workflow"] for job in self.pending],
+                "in_flight": [{"job_id": job_id, "worker": self.records[job_id]["worker"],
+                               "leased_for": round(now - self.records[job_id]["leased_at"], 1)}
+                              for job_id in self.leases],
+                "stats": dict(self.stats),
+                "next_workflow_in": self.jobs_per_workflow - (self._job_counter % self.jobs_per_workflow),
+            }
+
+job_queue = JobQueue(TEST_IMAGES, TEST_WORKFLOWS)
+
+def parse_workflow_mix(mix):
+    """Parse a workflow mix like "FLUX_Kontext=3,IP_Adapter_SDXL=1" into {workflow: weight}"""
+    if not mix:
+        return {workflow: 1.0 for workflow in TEST_WORKFLOWS}
+    weights = {}
+    for part in mix.split(","):
+        workflow, _, weight = part.strip().partition("=")
+        weights[workflow] = float(weight) if weight else 1.0
+    return weights
+
+def arrival_gaps(arrival, rate, burst_size, rng):
+    """Yield the seconds between two arrivals (0 within a burst)
+
+    Both patterns have the same mean rate (jobs per minute):
+    - poisson: jobs arrive one by one with exponentially distributed gaps.
+    - bursty: groups of `burst_size` jobs arrive at once (e.g. a school class at the booth),
+      the groups with exponentially distributed gaps.
+    """
+    while True:
+        if arrival == "bursty":
+            yield rng.expovariate(rate / 60 / burst_size)
+            for _ in range(burst_size - 1):
+                yield 0.0
+        else:
+            yield rng.expovariate(rate / 60)
+
+def generate_load(arrival, rate, burst_size, mix, total, seed):
+    """Enqueue `total` jobs following the arrival pattern. Runs in a background thread."""
+    rng = random.Random(seed)
+    workflows, weights = list(mix), list(mix.values())
+    gaps = arrival_gaps(arrival, rate, burst_size, rng)
+    for _ in range(total):
+        time.sleep(next(gaps))
+        workflow = rng.choices(workflows, weights)[0]
+        job = job_queue.create_job(workflow)
+        print(f"Enqueued {job['job_id']} ({workflow}), {len(job_queue.pending)} job(s) pending")
+    print(f"Load generator finished: {total} jobs enqueued")
+
+def percentile(values, p):
+    """Return the p-th percentile (nearest rank) of the values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def latency_stats(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+def load_report():
+    """Summarize the latencies of all jobs: queue wait, service time and end to end (enqueue to result)"""
+    snapshot = job_queue.snapshot()
+    records = list(snapshot["records"].values())
+    done = [record for record in records if record["completed_at"] is not None]
+    # Jobs whose lease expired (e.g. their worker died): time from the requeue to the result
+    recovered = [record for record in done if record["expired_at"] is not None]
+
+    def stats(selected):
+        return {
+            "end_to_end": latency_stats([r["completed_at"] - r["enqueued_at"] for r in selected]),
+            "queue_wait": latency_stats([r["handed_out_at"] - r["enqueued_at"] for r in selected]),
+            "service": latency_stats([r["completed_at"] - r["leased_at"] for r in selected]),
+        }
+
+    span = (max(r["completed_at"] for r in done) - min(r["enqueued_at"] for r in records)) if done else 0
+    return {
+        "settings": load_settings,
+        "enqueued": len(records),
+        "completed": len(done),
+        "pending": sum(1 for r in records if r["handed_out_at"] is None),
+        "in_progress": sum(1 for r in records if r["handed_out_at"] is not None and r["completed_at"] is None),
+        "throughput_per_minute": len(done) / span * 60 if span > 0 else 0,
+        "workers": sorted({r["completed_by"] or "unknown" for r in done}),
+        "queue_stats": snapshot["stats"],
+        "recovery": latency_stats([r["completed_at"] - r["expired_at"] for r in recovered]),
+        "overall": stats(done),
+        "per_workflow": {workflow: stats([r for r in done if r["workflow"] == workflow])
+                         for workflow in sorted({r["workflow"] for r in records})},
+    }
+
+def print_load_report():
+    """Print the load report and save it as JSON next to the generated results"""
+    report = load_report()
+
+    def line(label, values):
+        if not values["count"]:
+            return f"  {label:<30} -"
+        return (f"  {label:<30} p50 {values['p50']:7.1f}s  p95 {values['p95']:7.1f}s  "
+                f"p99 {values['p99']:7.1f}s  max {values['max']:7.1f}s")
+
+    print("=" * 60)
+    print("Load report")
+    print("=" * 60)
+    print(f"Settings: {report['settings']}")
+    print(f"Jobs: {report['completed']} of {report['enqueued']} completed, {report['pending']} pending, "
+          f"{report['in_progress']} in progress")
+    queue_stats = report["queue_stats"]
+    print(f"Throughput: {report['throughput_per_minute']:.2f} jobs/minute with {len(report['workers'])} worker(s) | "
+          f"Swaps avoided: {queue_stats['swaps_avoided']}")
+    print(f"Expired leases: {queue_stats['expired_leases']} | Late results: {queue_stats['late_results']} | "
+          f"Duplicates: {queue_stats['duplicates']}")
+    for label, key in (("End to end (enqueue->result)", "end_to_end"), ("Queue wait", "queue_wait"), ("Service (handout->result)", "service")):
+        print(line(label, report["overall"][key]))
+    print(line("Recovery (requeue->result)", report["recovery"]))
+    for workflow, stats in report["per_workflow"].items():
+        print(line(f"{workflow} end to end", stats["end_to_end"]))
+    print("=" * 60)
+
+    output_dir = os.path.join(os.path.dirname(__file__), "generated_results")
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = os.path.join(output_dir, f"load_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to {report_path}")
+
+def take_next_job(workflow=None, worker=None):
+    """Lease the next job to a worker and create its response, or return None if no job is available"""
     # Check if we have any test images
     if not TEST_IMAGES:
-        print("No test images available - returning 204")
-        return Response(status_code=204)  # No Content
-    
+        return None
     
-    # Switch workflow after certain number of jobs
-    if job_counter > 0 and job_counter % jobs_per_workflow == 0:
-        current_workflow_index = (current_workflow_index + 1) % len(TEST_WORKFLOWS)
-        print(f"Switching to workflow: {TEST_WORKFLOWS[current_workflow_index]}")
-    
-    # Get current test data
-    workflow = TEST_WORKFLOWS[current_workflow_index]
-    animal_data = TEST_ANIMALS[job_counter % len(TEST_ANIMALS)]
-    image_path = TEST_IMAGES[current_image_index % len(TEST_IMAGES)]
+    job = job_queue.lease(workflow, worker)
+    if job is None:
+        return None
     
+    animal_data = job["animal_data"]
+    image_path = job["image_path"]
     print(f"Reading image: {image_path}")
     
     # Read image
@@ -130,26 +451,25 @@ async def get_job(user=Depends(verify_token)):
             image_bytes = f.read()
     except Exception as e:
         print(f"Error reading image {image_path}: {e}")
-        job_counter += 1  # Increment counter even when there's an error
-        return Response(status_code=204)
-    
-    # Prepare job metadata
-    job_id = f"job_{job_counter:04d}"
+        # Don't leave the job leased until the lease times out
+        job_queue.release(job["job_id"])
+        return None
     
     # Create response with image data and headers
     headers = {
-        "img_id": job_id,
+        "img_id": job["job_id"],
         "first_name": animal_data["first_name"],
         "last_name": animal_data["last_name"],
         "animal_name": animal_data["animal_name"],
         "animal_type": animal_data["animal_type"],
-        "workflow": workflow
+        "workflow": job["workflow"],
+        "X-Enqueued-At": f"{job['enqueued_at']:.3f}",  # Unix time the job was created
+        "X-Lease-Timeout": str(job_queue.lease_timeout),  # Seconds until the job is handed to another worker
     }
+    if job.get("swap_avoided"):
+        headers["X-Swap-Avoided"] = "1"
     
-    print(f"Sending job {job_id}: {workflow} - {animal_data['animal_name']} ({animal_data['animal_type']})")
-    
-    job_counter += 1
-    current_image_index += 1
+    print(f"Sending job {job['job_id']} to {worker}: {job['workflow']} - {animal_data['animal_name']} ({animal_data['animal_type']})")
     
     return Response(
         content=image_bytes,
@@ -157,13 +477,48 @@ async def get_job(user=Depends(verify_token)):
         headers=headers
     )
 
+@app.get("/job")
+async def get_job(request: Request, wait: float = 0, workflow: str = None, worker: str = None, user=Depends(verify_token)):
+    """Get a job with image and metadata.
+
+    With ?wait=N the request is held open for up to N seconds until a job is available
+    (long polling). Every 204 response carries an X-Long-Poll header, so workers can tell
+    that this server supports long polling.
+
+    With ?workflow=X the worker reports the workflow it currently has loaded, and jobs for
+    that workflow are handed out first (see JobQueue._select).
+
+    ?worker=NAME identifies the worker in the lease bookkeeping (default: its address).
+    """
+    wait = max(0.0, min(wait, MAX_LONG_POLL_WAIT))
+    deadline = time.time() + wait
+    worker = worker or (request.client.host if request.client else None)
+
+    while True:
+        response = take_next_job(workflow, worker)
+        if response is not None:
+            return response
+        if time.time() >= deadline:
+            break
+        await asyncio.sleep(LONG_POLL_INTERVAL)
+
+    print(f"No job available after waiting {wait:.0f}s - returning 204")
+    return Response(status_code=204, headers={"X-Long-Poll": str(wait)})  # No Content
+
 @app.post("/job")
 async def submit_result(
     image_id: str = Form(...),
+    worker: str = Form(None),  # Defaults to the worker that holds the lease
     result: UploadFile = File(...),
+    display: UploadFile = File(None),
+    thumbnail: UploadFile = File(None),
     user=Depends(verify_token)
 ):
     """Receive generated image result"""
+    # Results for jobs that are already done (e.g. a requeued job finished twice) are not saved again
+    if job_queue.is_completed(image_id):
+        record_result(image_id, worker)  # Counts and logs the duplicate
+        return {"status": "duplicate", "message": f"Result for {image_id} was already received"}
     try:
         # Create output directory
         output_dir = os.path.join(os.path.dirname(__file__), "generated_results")
@@ -174,13 +529,25 @@ async def submit_result(
         
         # Save the result
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{image_id}_{timestamp}.png"
+        # Keep the format the worker chose (png, webp or jpg)
+        suffix = os.path.splitext(result.filename or "")[1] or ".png"
+        filename = f"{image_id}_{timestamp}{suffix}"
         output_path = os.path.join(output_dir, filename)
         
         with open(output_path, "wb") as f:
             f.write(image_data)
         
         print(f"Received and saved result for {image_id}: {output_path}")
+
+        # Optional smaller renditions sent along with the full image
+        for rendition in (display, thumbnail):
+            if rendition is None:
+                continue
+            rendition_data = await rendition.read()
+            rendition_name = f"{image_id}_{timestamp}_{os.path.basename(rendition.filename or 'rendition.jpg')}"
+            with open(os.path.join(output_dir, rendition_name), "wb") as f:
+                f.write(rendition_data)
+            print(f"Received rendition {rendition_name} ({len(rendition_data) / 1024:.0f} KB)")
         
         # Validate it's a proper image
         try:
@@ -189,43 +556,111 @@ async def submit_result(
         except Exception as e:
             print(f"Warning: Could not validate image {output_path}: {e}")
         
-        return {"status": "success", "message": f"Result saved as {filename}"}
-        
     except Exception as e:
+        # The job stays open, so the worker's retry is saved instead of being taken for a duplicate
         print(f"Error saving result for {image_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Error saving result: {e}")
 
+    # Only a saved result completes the job
+    record_result(image_id, worker)
+    return {"status": "success", "message": f"Result saved as {filename}"}
+
+def record_result(image_id, worker=None):
+    """Complete the job of a result and print the load report once every generated job is done"""
+    global load_report_printed
+    status = job_queue.complete(image_id, worker)
+    snapshot = job_queue.snapshot()
+    record = snapshot["records"].get(image_id)
+    if status == "duplicate":
+        print(f"Duplicate result for {image_id} from {worker}, ignoring it")
+    elif status == "completed":
+        wait = record["handed_out_at"] - record["enqueued_at"]
+        print(f"{image_id} done after {record['completed_at'] - record['enqueued_at']:.1f}s "
+              f"(queued {wait:.1f}s, attempt {record['attempts']})")
+
+    records = snapshot["records"].values()
+    all_done = (load_settings and len(records) >= load_settings.get("total", 0)
+                and all(r["completed_at"] is not None for r in records))
+    if all_done and not load_report_printed:
+        load_report_printed = True
+        print_load_report()
+    return status
+
+@app.get("/load_report")
+async def get_load_report():
+    """Latency summary of the jobs so far (most useful in load generation mode)"""
+    return load_report()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if load_settings and not load_report_printed:
+        print_load_report()
+
 @app.get("/")
 async def root():
     """Root endpoint with server info"""
     return {
         "message": "Test Server for GPU Processing",
         "available_workflows": TEST_WORKFLOWS,
-        "current_workflow": TEST_WORKFLOWS[current_workflow_index],
-        "jobs_processed": job_counter,
+        "current_workflow": job_queue.current_workflow,
+        "jobs_processed": job_queue.stats["handed_out"],
         "test_images": len(TEST_IMAGES)
     }
 
 @app.get("/status")
 async def status():
     """Get current server status"""
+    snapshot = job_queue.snapshot()
+    stats = snapshot["stats"]
     return {
-        "jobs_processed": job_counter,
-        "current_workflow": TEST_WORKFLOWS[current_workflow_index],
-        "next_workflow_in": jobs_per_workflow - (job_counter % jobs_per_workflow),
+        "jobs_processed": stats["handed_out"],
+        "current_workflow": job_queue.current_workflow,
+        "next_workflow_in": snapshot["next_workflow_in"],
         "available_workflows": TEST_WORKFLOWS,
-        "test_images_available": len(TEST_IMAGES)
+        "test_images_available": len(TEST_IMAGES),
+        "pending_jobs": snapshot["pending"],
+        "in_flight": snapshot["in_flight"],
+        "completed_jobs": sum(1 for record in snapshot["records"].values() if record["completed_at"] is not None),
+        "swaps_avoided": stats["swaps_avoided"],
+        "starvation_overrides": stats["starvation_overrides"],
+        "expired_leases": stats["expired_leases"],
+        "late_results": stats["late_results"],
+        "duplicates": stats["duplicates"],
     }
 
-def run_server():
+@click.command()
+@click.option('-load', is_flag=True, help='Load generation mode: jobs arrive over time instead of on demand.')
+@click.option('-arrival', type=click.Choice(["poisson", "bursty"]), default="poisson", show_default=True,
+              help='Arrival pattern: single jobs with random gaps, or groups of jobs at once.')
+@click.option('-rate', default=4.0, show_default=True, help='Mean arrival rate in jobs per minute.')
+@click.option('-burst-size', default=8, show_default=True, help='Jobs per group with -arrival bursty.')
+@click.option('-mix', default=None, help='Workflow mix, e.g. "FLUX_Kontext=3,IP_Adapter_SDXL=1" (default: equal shares).')
+@click.option('-total', default=50, show_default=True, help='Number of jobs to generate in load mode.')
+@click.option('-seed', default=None, type=int, help='Random seed for reproducible arrivals.')
+@click.option('-lease-timeout', default=LEASE_TIMEOUT, show_default=True,
+              help='Seconds a worker has for a job before it is handed to another worker.')
+def run_server(load, arrival, rate, burst_size, mix, total, seed, lease_timeout):
     """Run the test server"""
+    global load_settings
     print("=" * 60)
     print("Starting Test Server for GPU Processing")
     print("=" * 60)
     print(f"Available workflows: {TEST_WORKFLOWS}")
     print(f"Test images found: {len(TEST_IMAGES)}")
-    print(f"Jobs per workflow: {jobs_per_workflow}")
-    print(f"Server URL: http://localhost:8001")
+    print(f"Lease timeout: {lease_timeout}s")
+    job_queue.lease_timeout = lease_timeout
+    if load:
+        # Only the load generator adds jobs
+        job_queue.auto_fill = False
+        weights = parse_workflow_mix(mix)
+        load_settings = {"arrival": arrival, "rate_per_minute": rate, "burst_size": burst_size,
+                         "mix": weights, "total": total, "seed": seed}
+        print(f"Load generation: {total} jobs, {arrival} arrivals at {rate} jobs/minute, mix {weights}")
+        threading.Thread(target=generate_load, args=(arrival, rate, max(1, burst_size), weights, total, seed),
+                         name="load-generator", daemon=True).start()
+    else:
+        print(f"Jobs per workflow: {job_queue.jobs_per_workflow}")
+    print("Server URL: http://localhost:8001")
     print(f"Password: {PASSWORD}")
     print("=" * 60)
     
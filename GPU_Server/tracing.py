@@ -0,0 +1,167 @@
+import json
+import os
+import re
+import time
+from collections import defaultdict, deque
+
+import torch
+
+
+class TracedNode:
+    """
+    Stands in for a ComfyUI node instance and records every method call.
+
+    Attribute access is forwarded to the real node; callables are wrapped so that the tracer
+    measures them. `node_class_name` keeps the name of the real class, so caches keyed by
+    the node type (see functions.py) still tell the nodes apart.
+    """
+
+    def __init__(self, node, node_class_name: str, tracer: "NodeTracer"):
+        self._node = node
+        self._tracer = tracer
+        self.node_class_name = node_class_name
+
+    def __getattr__(self, name):
+        value = getattr(self._node, name)
+        if not callable(value) or name.startswith("_"):
+            return value
+
+        def traced(*args, **kwargs):
+            return self._tracer.record(f"{self.node_class_name}.{name}", value, args, kwargs)
+        return traced
+
+
+class TracedNodeMappings(dict):
+    """A copy of NODE_CLASS_MAPPINGS whose classes create TracedNode instances."""
+
+    def __init__(self, mappings, tracer: "NodeTracer"):
+        super().__init__(mappings)
+        self._tracer = tracer
+
+    def __getitem__(self, name):
+        cls = super().__getitem__(name)
+        tracer = self._tracer
+
+        def create(*args, **kwargs):
+            return TracedNode(cls(*args, **kwargs), name, tracer)
+        return create
+
+
+class NodeTracer:
+    """
+    Opt-in per-node profiling of `load_once()` and `generate()`.
+
+    Every node call made through the wrapped NODE_CLASS_MAPPINGS is measured:
+    - wall time of the call itself,
+    - CUDA-synchronized time (the GPU work the call queued is included),
+    - peak VRAM growth during the call.
+    Each job is written as a Chrome trace (open it in chrome://tracing or ui.perfetto.dev),
+    and rolling statistics per node are kept over the last `stats_window` calls.
+
+    Synchronizing after every node serializes CPU and GPU work, so traced jobs run slightly
+    slower than untraced ones.
+    """
+
+    def __init__(self, trace_dir: str, stats_window: int = 100):
+        """
+        Args:
+            trace_dir: The directory the per-job trace files are written to.
+            stats_window: The number of recent calls per node the statistics are based on.
+        """
+        self.trace_dir = trace_dir
+        self.stats = defaultdict(lambda: deque(maxlen=stats_window))  # node -> [(wall, synced, vram delta)]
+        self.cuda = torch.cuda.is_available()
+
+        self._events = []
+        self._trace_name = None
+        self._trace_start = None
+        self._depth = 0
+        os.makedirs(self.trace_dir, exist_ok=True)
+
+    def wrap_mappings(self, mappings) -> TracedNodeMappings:
+        """Returns a version of NODE_CLASS_MAPPINGS that traces every node."""
+        return TracedNodeMappings(mappings, self)
+
+    def begin(self, name: str):
+        """Starts collecting the events of a job. `name` becomes the trace's file name."""
+        self._events = []
+        self._trace_name = name
+        self._trace_start = time.perf_counter()
+
+    def end(self, **job_info) -> str:
+        """
+        Writes the collected events as Chrome trace JSON.
+
+        Args:
+            **job_info: Extra information shown on the job event, e.g. the workflow.
+
+        Returns:
+            str: The path of the trace file, or None if no job was started.
+        """
+        if self._trace_name is None:
+            return None
+        total = time.perf_counter() - self._trace_start
+        events = [{
+            "name": f"job {self._trace_name}", "cat": "job", "ph": "X", "pid": os.getpid(), "tid": 0,
+            "ts": 0, "dur": total * 1e6, "args": job_info,
+        }] + self._events
+
+        safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", str(self._trace_name))
+        path = os.path.join(self.trace_dir, f"{safe_name}.json")
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+        self._trace_name = None
+        self._events = []
+        return path
+
+    def record(self, name: str, fn, args, kwargs):
+        """Calls a node method and records its timing and VRAM usage."""
+        # Nested calls are measured as part of the outer call only
+        if self._depth > 0:
+            return fn(*args, **kwargs)
+
+        if self.cuda:
+            torch.cuda.synchronize()  # Don't bill this node for GPU work queued before it
+            vram_before = torch.cuda.memory_allocated()
+            torch.cuda.reset_peak_memory_stats()
+
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._depth -= 1
+            wall = time.perf_counter() - start
+            vram_delta = 0
+            if self.cuda:
+                torch.cuda.synchronize()
+                vram_delta = torch.cuda.max_memory_allocated() - vram_before
+            synced = time.perf_counter() - start
+
+            self.stats[name].append((wall, synced, vram_delta))
+            if self._trace_name is not None:
+                self._events.append({
+                    "name": name, "cat": "node", "ph": "X", "pid": os.getpid(), "tid": 0,
+                    "ts": (start - self._trace_start) * 1e6, "dur": synced * 1e6,
+                    "args": {"wall_ms": round(wall * 1000, 2), "peak_vram_delta_mb": round(vram_delta / 1024**2, 1)},
+                })
+
+    def summary(self, top: int = 10) -> str:
+        """Returns the rolling per-node statistics, the nodes with the most total time first."""
+        rows = []
+        for name, samples in self.stats.items():
+            synced = sorted(sample[1] for sample in samples)
+            rows.append((
+                sum(synced), name, len(samples),
+                sum(sample[0] for sample in samples) / len(samples),
+                sum(synced) / len(samples),
+                synced[min(len(synced) - 1, int(len(synced) * 0.95))],
+                max(sample[2] for sample in samples),
+            ))
+        rows.sort(reverse=True)
+
+        lines = [f"{'Node':<55} {'Calls':>5} {'Wall':>8} {'Synced':>8} {'p95':>8} {'Peak VRAM':>10}"]
+        for _, name, calls, wall, synced, p95, vram in rows[:top]:
+            lines.append(f"{name[:55]:<55} {calls:>5} {wall:>7.2f}s {synced:>7.2f}s {p95:>7.2f}s {vram / 1024**2:>7.0f} MB")
+        return "\n".join(lines)
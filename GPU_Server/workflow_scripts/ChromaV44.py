@@ -12,7 +12,7 @@ parent_dir = os.path.dirname(current_dir)
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-from functions import Functions
+from functions import Functions, BatchNoise
 
 
 # Change the class name to your workflow name, e.g. "FLUX_Kontext"
@@ -30,6 +30,9 @@ class ChromaV44:
 
         NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         get_value_at_index = self.functions.get_value_at_index
+        load_shared = self.functions.load_shared
+        shared_owner = type(self).__name__
+        encode_text = self.functions.encode_text
 
         with torch.inference_mode():
             print("Loading nodes...")
@@ -40,7 +43,8 @@ class ChromaV44:
             )
 
             cliploader = NODE_CLASS_MAPPINGS["CLIPLoader"]()
-            cliploader_78 = cliploader.load_clip(
+            cliploader_78 = load_shared(
+                shared_owner, cliploader, "load_clip",
                 clip_name="t5/t5xxl_fp16.safetensors", type="chroma", device="default"
             )
 
@@ -50,19 +54,23 @@ class ChromaV44:
             )
 
             cliptextencode = NODE_CLASS_MAPPINGS["CLIPTextEncode"]()
-            cliptextencode_75 = cliptextencode.encode(
-                text="llustration, anime, drawing, artwork, bad hands, blurry, low quality, out of focus, deformed, smudged, red",
-                clip=get_value_at_index(t5tokenizeroptions_82, 0),
+            cliptextencode_75 = encode_text(
+                cliptextencode,
+                get_value_at_index(t5tokenizeroptions_82, 0),
+                "llustration, anime, drawing, artwork, bad hands, blurry, low quality, out of focus, deformed, smudged, red",
+                shared_owner,
             )
 
             unetloader = NODE_CLASS_MAPPINGS["UNETLoader"]()
-            unetloader_76 = unetloader.load_unet(
+            unetloader_76 = load_shared(
+                shared_owner, unetloader, "load_unet",
                 unet_name="chroma-unlocked-v44-detail-calibrated.safetensors",
                 weight_dtype="default",
             )
 
             vaeloader = NODE_CLASS_MAPPINGS["VAELoader"]()
-            vaeloader_80 = vaeloader.load_vae(
+            vaeloader_80 = load_shared(
+                shared_owner, vaeloader, "load_vae",
                 vae_name="diffusion_pytorch_model.safetensors"
             )
 
@@ -79,7 +87,11 @@ class ChromaV44:
             loraloadermodelonly = NODE_CLASS_MAPPINGS["LoraLoaderModelOnly"]()
             ollamaconnectivityv2 = NODE_CLASS_MAPPINGS["OllamaConnectivityV2"]()
             ollamageneratev2 = NODE_CLASS_MAPPINGS["OllamaGenerateV2"]()
-            ksampler = NODE_CLASS_MAPPINGS["KSampler"]()
+            # The exported KSampler split into its parts, so several jobs can share a sampler pass with their own seeds
+            cfgguider = NODE_CLASS_MAPPINGS["CFGGuider"]()
+            ksamplerselect = NODE_CLASS_MAPPINGS["KSamplerSelect"]()
+            basicscheduler = NODE_CLASS_MAPPINGS["BasicScheduler"]()
+            samplercustomadvanced = NODE_CLASS_MAPPINGS["SamplerCustomAdvanced"]()
             vaedecode = NODE_CLASS_MAPPINGS["VAEDecode"]()
             imagecompositemasked = NODE_CLASS_MAPPINGS["ImageCompositeMasked"]()
             textonimage = NODE_CLASS_MAPPINGS["TextOnImage"]()
@@ -104,11 +116,7 @@ class ChromaV44:
         # Make the functions available in the local scope (no self. prefix needed)
         NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         get_value_at_index = self.functions.get_value_at_index
-        get_path_from_bytes = self.functions.get_path_from_bytes
         convert_image = self.functions.converte_image
-        format_text_for_field = self.functions.format_text_for_field
-        # Load the image from bytes
-        tmp_path = get_path_from_bytes(image_bytes)
 
         with torch.inference_mode():
         # How to implement your own workflow:
@@ -124,7 +132,8 @@ class ChromaV44:
         #    Optionally, move any static assets (e.g., watermarks) that don't depend on the input image to 'load_once'.
         #
         # 6. In the 'generate' function, find the input image loading step (e.g., 'loadimage_X') and change it to:
-        #    loadimage_X = loadimage.load_image(image=tmp_path)
+        #    loadimage_X = load_image_from_bytes(image_bytes)
+        #    It decodes the received bytes in memory into the same (IMAGE, MASK) output as LoadImage.
         #    Ensure paths for constant images (like IP-Adapter inputs or watermarks) are correct.
         #    For text overlays, use format_text_for_field(your_text_input, line_length, num_lines) from 'functions.py'.
         #
@@ -135,14 +144,132 @@ class ChromaV44:
         #
         # 9. Rename the class and the file to match your workflow's name (e.g., "FLUX_Kontext").
         #
-        # Final steps in 'dispatcher.py':
-        # 10. Import your new workflow: from workflow_scripts.[workflow_name] import [ClassName]
-        # 11. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": [ClassName]
+        # Final step in 'dispatcher.py':
+        # 10. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": "workflow_scripts.[workflow_name].[ClassName]"
         #
         # You can also set your new workflow as the default in 'main.py'.
+        #
+        # Optional: To let the server batch several jobs of this workflow into one sampler pass, split the
+        # per-job steps into 'prepare_job' (everything before the sampler) and 'finish_job' (everything after
+        # the VAE decode) and add a 'generate_batch' function like the one in this workflow.
 
+            # Everything before the sampler runs per job: background removal, depth map, caption, encoding
+            prepared = self.prepare_job(image_bytes)
+
+            for q in range(1):
+                # The same sampling path as generate_batch, so a job's image doesn't depend on whether it was batched
+                vaedecode_79 = self.sample([prepared], [random.randint(1, 2**64)])
+
+                textonimage_142 = self.finish_job(
+                    vaedecode_79, first_name, last_name, animal_name
+                )
+
+            result = convert_image(textonimage_142)
             
-            loadimage_89 = loadimage.load_image(image=tmp_path)
+            return result
+
+
+    def generate_batch(self, workflow_name: str, jobs: list) -> list:
+        """
+        Generates the images of several jobs in batched sampler passes.
+
+        The per-job steps (preprocessing, caption, text overlay) still run once per job, but the
+        latents are denoised together, which uses the GPU much better than one image at a time.
+        Every job keeps its own conditioning and its own seed.
+
+        Args:
+            workflow_name: The name of the workflow.
+            jobs: Job dicts with the keys image_bytes, animal_type, first_name, last_name and animal_name.
+
+        Returns:
+            list: One image buffer per job, in the order of `jobs`.
+        """
+        globals().update(self.config)
+        convert_image = self.functions.converte_image
+
+        with torch.inference_mode():
+            prepared = [self.prepare_job(job["image_bytes"]) for job in jobs]
+            images = self.sample(prepared, [random.randint(1, 2**64) for _ in jobs])
+
+            results = []
+            for i, job in enumerate(jobs):
+                textonimage_142 = self.finish_job(
+                    images[i:i + 1], job["first_name"], job["last_name"], job["animal_name"]
+                )
+                results.append(convert_image(textonimage_142))
+
+            return results
+
+
+    def sample(self, prepared: list, seeds: list):
+        """
+        Denoises and decodes prepared jobs, batching the jobs whose captions have the same token length.
+
+        Captions of different lengths can't share a pass without padding, which would change the
+        result, so each length gets its own pass. generate() runs through here with a single job.
+
+        Args:
+            prepared: The (latent, positive conditioning) pairs returned by prepare_job.
+            seeds: One noise seed per job.
+
+        Returns:
+            The decoded images [N, H, W, 3], in the order of `prepared`.
+        """
+        get_value_at_index = self.functions.get_value_at_index
+
+        groups = {}
+        for i, (_, cond) in enumerate(prepared):
+            groups.setdefault(get_value_at_index(cond, 0)[0][0].shape[1], []).append(i)
+
+        images = [None] * len(prepared)
+        with torch.inference_mode():
+            model = get_value_at_index(loraloadermodelonly_159, 0)
+            # The settings of the exported KSampler, split into its parts so every job gets its own seed
+            ksamplerselect_batch = ksamplerselect.get_sampler(sampler_name="euler")
+            basicscheduler_batch = basicscheduler.get_sigmas(
+                scheduler="beta",
+                steps=15,
+                denoise=0.8000000000000002,
+                model=model,
+            )
+
+            for indices in groups.values():
+                # Stack the latents and the per-job conditionings into one batch
+                latent_batch = {"samples": torch.cat([get_value_at_index(prepared[i][0], 0)["samples"] for i in indices])}
+                positive = self.functions.batch_conditioning([get_value_at_index(prepared[i][1], 0) for i in indices])
+
+                cfgguider_batch = cfgguider.get_guider(
+                    cfg=4,
+                    model=model,
+                    positive=positive,
+                    negative=get_value_at_index(cliptextencode_75, 0),
+                )
+                samplercustomadvanced_batch = samplercustomadvanced.sample(
+                    noise=BatchNoise([seeds[i] for i in indices]),
+                    guider=get_value_at_index(cfgguider_batch, 0),
+                    sampler=get_value_at_index(ksamplerselect_batch, 0),
+                    sigmas=get_value_at_index(basicscheduler_batch, 0),
+                    latent_image=latent_batch,
+                )
+
+                vaedecode_batch = vaedecode.decode(
+                    samples=get_value_at_index(samplercustomadvanced_batch, 0),
+                    vae=get_value_at_index(vaeloader_80, 0),
+                )
+                decoded = get_value_at_index(vaedecode_batch, 0)
+                for j, i in enumerate(indices):
+                    images[i] = decoded[j:j + 1]
+
+        return torch.cat(images)
+
+
+    def prepare_job(self, image_bytes: bytes):
+        """Runs the per-job steps before the sampler. Returns the encoded latent and the positive conditioning."""
+        get_value_at_index = self.functions.get_value_at_index
+        load_image_from_bytes = self.functions.load_image_from_bytes
+
+        with torch.inference_mode():
+            loadimage_89 = load_image_from_bytes(image_bytes)
 
             
             imageresizekj_164 = imageresizekj.resize(
@@ -233,7 +360,6 @@ class ChromaV44:
                 vae=get_value_at_index(vaeloader_80, 0),
             )
 
-            loadimage_140 = loadimage.load_image(image="Watermark1.png")
 
             ollamaconnectivityv2_160 = ollamaconnectivityv2.ollama_connectivity(
                 url="http://127.0.0.1:11435",
@@ -257,56 +383,46 @@ class ChromaV44:
                 clip=get_value_at_index(t5tokenizeroptions_82, 0),
             )
 
-            for q in range(1):
-                ksampler_94 = ksampler.sample(
-                    seed=random.randint(1, 2**64),
-                    steps=15,
-                    cfg=4,
-                    sampler_name="euler",
-                    scheduler="beta",
-                    denoise=0.8000000000000002,
-                    model=get_value_at_index(loraloadermodelonly_159, 0),
-                    positive=get_value_at_index(cliptextencode_163, 0),
-                    negative=get_value_at_index(cliptextencode_75, 0),
-                    latent_image=get_value_at_index(vaeencode_97, 0),
-                )
+            return vaeencode_97, cliptextencode_163
 
-                vaedecode_79 = vaedecode.decode(
-                    samples=get_value_at_index(ksampler_94, 0),
-                    vae=get_value_at_index(vaeloader_80, 0),
-                )
 
-                imagecompositemasked_139 = imagecompositemasked.composite(
-                    x=0,
-                    y=0,
-                    resize_source=False,
-                    destination=get_value_at_index(loadimage_140, 0),
-                    source=get_value_at_index(vaedecode_79, 0),
-                    mask=get_value_at_index(loadimage_140, 1),
-                )
+    def finish_job(self, image, first_name: str, last_name: str, animal_name: str):
+        """Adds the watermark frame and the patient's name to a decoded image."""
+        get_value_at_index = self.functions.get_value_at_index
+        format_text_for_field = self.functions.format_text_for_field
 
-                textonimage_142 = textonimage.apply_text(
-                    text=format_text_for_field(first_name + " " + last_name + " " + animal_name), ####### Custom Text #######
-                    x=853,
-                    y=898,
-                    font_size=16,
-                    text_color="#d3c7b6",
-                    text_opacity=1,
-                    use_gradient=False,
-                    start_color="#ff0000",
-                    end_color="#0000ff",
-                    angle=0,
-                    stroke_width=0,
-                    stroke_color="#000000",
-                    stroke_opacity=1,
-                    shadow_x=0,
-                    shadow_y=0,
-                    shadow_color="#000000",
-                    shadow_opacity=1,
-                    font_file="en-AllRoundItalic.ttf",
-                    image=get_value_at_index(imagecompositemasked_139, 0),
-                )
+        with torch.inference_mode():
+            loadimage_140 = loadimage.load_image(image="Watermark1.png")
 
-            result = convert_image(textonimage_142)
-            
-            return result
\ No newline at end of file
+            imagecompositemasked_139 = imagecompositemasked.composite(
+                x=0,
+                y=0,
+                resize_source=False,
+                destination=get_value_at_index(loadimage_140, 0),
+                source=image,
+                mask=get_value_at_index(loadimage_140, 1),
+            )
+
+            textonimage_142 = textonimage.apply_text(
+                text=format_text_for_field(first_name + " " + last_name + " " + animal_name), ####### Custom Text #######
+                x=853,
+                y=898,
+                font_size=16,
+                text_color="#d3c7b6",
+                text_opacity=1,
+                use_gradient=False,
+                start_color="#ff0000",
+                end_color="#0000ff",
+                angle=0,
+                stroke_width=0,
+                stroke_color="#000000",
+                stroke_opacity=1,
+                shadow_x=0,
+                shadow_y=0,
+                shadow_color="#000000",
+                shadow_opacity=1,
+                font_file="en-AllRoundItalic.ttf",
+                image=get_value_at_index(imagecompositemasked_139, 0),
+            )
+
+            return textonimage_142
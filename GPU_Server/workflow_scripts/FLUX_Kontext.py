@@ -14,6 +14,9 @@ if parent_dir not in sys.path:
 
 from functions import Functions
 
+# The negative prompt never changes, so its conditioning is cached (see Functions.encode_text)
+NEGATIVE_PROMPT = "low quality, blurry, out of focus, noisy, distorted anatomy, deformed limbs, missing bones, broken joints, horror elements, scary, creepy, disturbing, grotesque, blood, gore, flesh, skin texture, visible eyes, open mouth, facial expression, exposed skull, colorful background, vivid colors, fantasy style, surreal, painterly, cartoon, anime, watercolor, oil painting, overexposed, underexposed, strong shadows, photo artifacts, grain, chromatic aberration, double exposure, body horror, glowing eyes, nightmare style, unsettling, low resolution, soft rendering, plastic texture, shiny surface, incorrect perspective, unrealistic proportions, extra limbs, anatomical errors, fantasy bones, melted shapes, glitch effects, artistic filter, cinematic lighting, emotional tone"
+
 # Change the class name to your workflow name, e.g. "FLUX_Kontext"
 class FLUX_Kontext:
     # You don't need to change this function
@@ -30,6 +33,9 @@ class FLUX_Kontext:
 
         NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         get_value_at_index = self.functions.get_value_at_index
+        load_shared = self.functions.load_shared
+        shared_owner = type(self).__name__
+        encode_text = self.functions.encode_text
 
         with torch.inference_mode():
             loadimage = NODE_CLASS_MAPPINGS["LoadImage"]()
@@ -54,29 +60,39 @@ class FLUX_Kontext:
             textonimage = NODE_CLASS_MAPPINGS["TextOnImage"]()
             saveimage = NODE_CLASS_MAPPINGS["SaveImage"]()
             
-            vaeloader_32 = vaeloader.load_vae(
+            vaeloader_32 = load_shared(
+                shared_owner, vaeloader, "load_vae",
                 vae_name="diffusion_pytorch_model.safetensors"
             )
 
-            checkpointloadersimple_38 = checkpointloadersimple.load_checkpoint(
+            checkpointloadersimple_38 = load_shared(
+                shared_owner, checkpointloadersimple, "load_checkpoint",
                 ckpt_name="flux1-kontext-dev.safetensors"
             )
 
-            janusmodelloader_51 = janusmodelloader.load_model(
+            janusmodelloader_51 = load_shared(
+                shared_owner, janusmodelloader, "load_model",
                 model_name="deepseek-ai/Janus-Pro-1B"
             )
 
-            dualcliploader_45 = dualcliploader.load_clip(
+            dualcliploader_45 = load_shared(
+                shared_owner, dualcliploader, "load_clip",
                 clip_name1="clip_l.safetensors",
                 clip_name2="t5/t5xxl_fp16.safetensors",
                 type="flux",
                 device="default",
             )
 
-            controlnetloader_47 = controlnetloader.load_controlnet(
+            controlnetloader_47 = load_shared(
+                shared_owner, controlnetloader, "load_controlnet",
                 control_net_name="FLUX.1/Shakker-Labs-ControlNet-Union-Pro/diffusion_pytorch_model.safetensors"
             )
 
+            # The static negative prompt is encoded once here and reused by every job
+            cliptextencode_66 = encode_text(
+                cliptextencode, get_value_at_index(dualcliploader_45, 0), NEGATIVE_PROMPT, shared_owner
+            )
+
         return {k: v for k, v in locals().items() if k != "self"}
 
 
@@ -90,11 +106,9 @@ class FLUX_Kontext:
         # Make the functions available in the local scope (no self. prefix needed)
         NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         get_value_at_index = self.functions.get_value_at_index
-        get_path_from_bytes = self.functions.get_path_from_bytes
+        load_image_from_bytes = self.functions.load_image_from_bytes
         convert_image = self.functions.converte_image
         format_text_for_field = self.functions.format_text_for_field
-        # Load the image from bytes
-        tmp_path = get_path_from_bytes(image_bytes)
 
         with torch.inference_mode():
         # How to implement your own workflow:
@@ -110,7 +124,8 @@ class FLUX_Kontext:
         #    Optionally, move any static assets (e.g., watermarks) that don't depend on the input image to 'load_once'.
         #
         # 6. In the 'generate' function, find the input image loading step (e.g., 'loadimage_X') and change it to:
-        #    loadimage_X = loadimage.load_image(image=tmp_path)
+        #    loadimage_X = load_image_from_bytes(image_bytes)
+        #    It decodes the received bytes in memory into the same (IMAGE, MASK) output as LoadImage.
         #    Ensure paths for constant images (like IP-Adapter inputs or watermarks) are correct.
         #    For text overlays, use format_text_for_field(your_text_input, line_length, num_lines) from 'functions.py'.
         #
@@ -121,9 +136,8 @@ class FLUX_Kontext:
         #
         # 9. Rename the class and the file to match your workflow's name (e.g., "FLUX_Kontext").
         #
-        # Final steps in 'dispatcher.py':
-        # 10. Import your new workflow: from workflow_scripts.[workflow_name] import [ClassName]
-        # 11. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": [ClassName]
+        # Final step in 'dispatcher.py':
+        # 10. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": "workflow_scripts.[workflow_name].[ClassName]"
         #
         # You can also set your new workflow as the default in 'main.py'.
 
@@ -131,16 +145,11 @@ class FLUX_Kontext:
                 text="\nGenerate the ainimal depicted in a clean, clinical X-ray scan style. The internal bone structure is detailed and anatomically plausible, resembling simplified mammalian bones, including a visible spine with vertebrae, ribcage, arms, legs, joints, pelvis, and digits — all proportioned to the animals plush body. The bones are semi-transparent and softly glowing in white and pale blue, rendered with subtle radiographic shadows. The background is dark and neutral to mimic a real X-ray scan. The style is medical, technical, and illustrative — no horror elements, no visible skull, no face or eyes, no soft tissue, no fur, no fabric seams. The overall mood is scientific and clean, not emotional or creepy. High-resolution, radiographic rendering, suitable for veterinary illustration or educational imaging."
             )
 
-            cliptextencode_66 = cliptextencode.encode(
-                text="low quality, blurry, out of focus, noisy, distorted anatomy, deformed limbs, missing bones, broken joints, horror elements, scary, creepy, disturbing, grotesque, blood, gore, flesh, skin texture, visible eyes, open mouth, facial expression, exposed skull, colorful background, vivid colors, fantasy style, surreal, painterly, cartoon, anime, watercolor, oil painting, overexposed, underexposed, strong shadows, photo artifacts, grain, chromatic aberration, double exposure, body horror, glowing eyes, nightmare style, unsettling, low resolution, soft rendering, plastic texture, shiny surface, incorrect perspective, unrealistic proportions, extra limbs, anatomical errors, fantasy bones, melted shapes, glitch effects, artistic filter, cinematic lighting, emotional tone",
-                clip=get_value_at_index(dualcliploader_45, 0),
-            )
-
             # watermark image change to right path 
             loadimage_58 = loadimage.load_image(image="pasted/image.png")
             
             # change the static image to the input image
-            loadimage_17 = loadimage.load_image(image=tmp_path)
+            loadimage_17 = load_image_from_bytes(image_bytes)
 
             imageresizekj_37 = imageresizekj.resize(
                 width=1024,
@@ -5,6 +5,7 @@ from typing import Any, Union, Sequence, Mapping
 import torch
 from PIL import Image  
 import random
+import time
 
 # Add the parent directory to sys.path to handle relative imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -21,6 +22,10 @@ class IP_Adapter_SDXL:
     def __init__(self, arg_function):
         self.functions = arg_function
 
+    # Encode the reference images once in load_once. With False every job encodes them again like the
+    # exported workflow did, which testing/benchmark.py -compare-embeds uses to measure the savings.
+    precompute_embeds = True
+
     def start_load_once(self):
         self.config = self.load_once()
 
@@ -31,6 +36,9 @@ class IP_Adapter_SDXL:
 
         NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         get_value_at_index = self.functions.get_value_at_index
+        load_shared = self.functions.load_shared
+        shared_owner = type(self).__name__
+        encode_text = self.functions.encode_text
 
         with torch.inference_mode():
             print("Loading nodes...")
@@ -58,7 +66,8 @@ class IP_Adapter_SDXL:
             easy_showanything = NODE_CLASS_MAPPINGS["easy showAnything"]()
             saveimage = NODE_CLASS_MAPPINGS["SaveImage"]()
 
-            checkpointloadersimple_4 = checkpointloadersimple.load_checkpoint(
+            checkpointloadersimple_4 = load_shared(
+                shared_owner, checkpointloadersimple, "load_checkpoint",
                 ckpt_name="sd_xl_base_1.0.safetensors"
             )
 
@@ -66,7 +75,8 @@ class IP_Adapter_SDXL:
                 width=1024, height=1024, batch_size=1
             )
 
-            janusmodelloader_130 = janusmodelloader.load_model(
+            janusmodelloader_130 = load_shared(
+                shared_owner, janusmodelloader, "load_model",
                 model_name="deepseek-ai/Janus-Pro-1B"
             )
 
@@ -78,21 +88,27 @@ class IP_Adapter_SDXL:
                 clip=get_value_at_index(checkpointloadersimple_4, 1),
             )
 
-            cliptextencode_7 = cliptextencode.encode(
-                text="worst quality, low quality, blurry, noisy, text, signature, watermark, UI, cartoon, drawing, illustration, sketch, painting, anime, 3D render, (photorealistic plush toy), (visible fabric texture), (visible stuffing), colorful, vibrant colors, toy bones, plastic bones, cartoon bones, unrealistic skeleton, bad anatomy, deformed skeleton, disfigured, mutated limbs, extra limbs, fused bones, skin, fur, organs, background clutter, multiple animals",
-                clip=get_value_at_index(loraloader_68, 1),
+            cliptextencode_7 = encode_text(
+                cliptextencode,
+                get_value_at_index(loraloader_68, 1),
+                "worst quality, low quality, blurry, noisy, text, signature, watermark, UI, cartoon, drawing, illustration, sketch, painting, anime, 3D render, (photorealistic plush toy), (visible fabric texture), (visible stuffing), colorful, vibrant colors, toy bones, plastic bones, cartoon bones, unrealistic skeleton, bad anatomy, deformed skeleton, disfigured, mutated limbs, extra limbs, fused bones, skin, fur, organs, background clutter, multiple animals",
+                shared_owner,
             )
 
-            checkpointloadersimple_12 = checkpointloadersimple.load_checkpoint(
+            checkpointloadersimple_12 = load_shared(
+                shared_owner, checkpointloadersimple, "load_checkpoint",
                 ckpt_name="SDXL/sd_xl_refiner_1.0.safetensors"
             )
 
-            cliptextencode_16 = cliptextencode.encode(
-                text="worst quality, low quality, blurry, noisy, text, signature, watermark, UI, cartoon, drawing, illustration, sketch, painting, anime, 3D render, (photorealistic plush toy), (visible fabric texture), (visible stuffing), colorful, vibrant colors, toy bones, plastic bones, cartoon bones, unrealistic skeleton, bad anatomy, deformed skeleton, disfigured, mutated limbs, extra limbs, fused bones, skin, fur, organs, background clutter, multiple animals",
-                clip=get_value_at_index(checkpointloadersimple_12, 1),
+            cliptextencode_16 = encode_text(
+                cliptextencode,
+                get_value_at_index(checkpointloadersimple_12, 1),
+                "worst quality, low quality, blurry, noisy, text, signature, watermark, UI, cartoon, drawing, illustration, sketch, painting, anime, 3D render, (photorealistic plush toy), (visible fabric texture), (visible stuffing), colorful, vibrant colors, toy bones, plastic bones, cartoon bones, unrealistic skeleton, bad anatomy, deformed skeleton, disfigured, mutated limbs, extra limbs, fused bones, skin, fur, organs, background clutter, multiple animals",
+                shared_owner,
             )
 
-            controlnetloader_52 = controlnetloader.load_controlnet(
+            controlnetloader_52 = load_shared(
+                shared_owner, controlnetloader, "load_controlnet",
                 control_net_name="SDXL/controlnet-union-sdxl-1.0/diffusion_pytorch_model_promax.safetensors"
             )
 
@@ -100,6 +116,16 @@ class IP_Adapter_SDXL:
                 preset="PLUS (high strength)", model=get_value_at_index(loraloader_68, 0)
             )
 
+            # The IP-Adapter reference images never change: load and encode them once and keep the
+            # combined embeddings on the GPU, so every job starts at apply_ipadapter
+            if self.precompute_embeds:
+                precompute_start = time.time()
+                ipadaptercombineembeds_138, ipadaptercombineembeds_143 = self.encode_references(
+                    loadimage, ipadapterencoder, ipadaptercombineembeds, get_value_at_index(ipadapterunifiedloader_63, 1)
+                )
+                precompute_time = time.time() - precompute_start
+                print(f"IP-Adapter reference embeddings precomputed in {precompute_time:.2f} seconds (saved on every job)")
+
         return {k: v for k, v in locals().items() if k != "self"}
 
 
@@ -107,17 +133,76 @@ class IP_Adapter_SDXL:
 
 
 
+    def encode_references(self, loadimage, ipadapterencoder, ipadaptercombineembeds, ipadapter):
+        """
+        Loads the static reference images and encodes them into the combined IP-Adapter embeddings.
+
+        Returns:
+            The positive and negative embeddings as one-element tuples, moved to the torch device.
+        """
+        get_value_at_index = self.functions.get_value_at_index
+
+        loadimage_60 = loadimage.load_image(image="Cat_back.png")
+
+        loadimage_64 = loadimage.load_image(image="Cat_front2.png")
+
+        loadimage_72 = loadimage.load_image(image="Cat_side.png")
+
+        ipadapterencoder_136 = ipadapterencoder.encode(
+            weight=1.0000000000000002,
+            ipadapter=ipadapter,
+            image=get_value_at_index(loadimage_60, 0),
+        )
+
+        ipadapterencoder_139 = ipadapterencoder.encode(
+            weight=1,
+            ipadapter=ipadapter,
+            image=get_value_at_index(loadimage_64, 0),
+        )
+
+        ipadapterencoder_140 = ipadapterencoder.encode(
+            weight=1.0000000000000002,
+            ipadapter=ipadapter,
+            image=get_value_at_index(loadimage_72, 0),
+        )
+
+        # The workflow encodes Cat_front2.png a second time with the same weight, reuse the first result
+        ipadapterencoder_141 = ipadapterencoder_139
+
+        ipadaptercombineembeds_138 = ipadaptercombineembeds.batch(
+            method="concat",
+            embed1=get_value_at_index(ipadapterencoder_139, 0),
+            embed2=get_value_at_index(ipadapterencoder_136, 0),
+            embed3=get_value_at_index(ipadapterencoder_140, 0),
+            embed4=get_value_at_index(ipadapterencoder_141, 0),
+        )
+
+        ipadaptercombineembeds_143 = ipadaptercombineembeds.batch(
+            method="concat",
+            embed1=get_value_at_index(ipadapterencoder_139, 1),
+            embed2=get_value_at_index(ipadapterencoder_136, 1),
+            embed3=get_value_at_index(ipadapterencoder_140, 1),
+            embed4=get_value_at_index(ipadapterencoder_141, 1),
+        )
+
+        import comfy.model_management
+        device = comfy.model_management.get_torch_device()
+        pos_embed = (get_value_at_index(ipadaptercombineembeds_138, 0).to(device),)
+        neg_embed = (get_value_at_index(ipadaptercombineembeds_143, 0).to(device),)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return pos_embed, neg_embed
+
+
     def generate(self, workflow_name: str, image_bytes: bytes, animal_type: str, first_name: str, last_name: str, animal_name: str) -> io.BytesIO:
         # Update local variables from self attributes (you don't need to write self. in front of the variables)
         globals().update(self.config)
         # Make the functions available in the local scope (no self. prefix needed)
         NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         get_value_at_index = self.functions.get_value_at_index
-        get_path_from_bytes = self.functions.get_path_from_bytes
+        load_image_from_bytes = self.functions.load_image_from_bytes
         converte_image = self.functions.converte_image
         format_text_for_field = self.functions.format_text_for_field
-        # Load the image from bytes
-        tmp_path = get_path_from_bytes(image_bytes)
 
         with torch.inference_mode():
         # How to implement your own workflow:
@@ -133,7 +218,8 @@ class IP_Adapter_SDXL:
         #    Optionally, move any static assets (e.g., watermarks) that don't depend on the input image to 'load_once'.
         #
         # 6. In the 'generate' function, find the input image loading step (e.g., 'loadimage_X') and change it to:
-        #    loadimage_X = loadimage.load_image(image=tmp_path)
+        #    loadimage_X = load_image_from_bytes(image_bytes)
+        #    It decodes the received bytes in memory into the same (IMAGE, MASK) output as LoadImage.
         #    Ensure paths for constant images (like IP-Adapter inputs or watermarks) are correct.
         #    For text overlays, use format_text_for_field(your_text_input, line_length, num_lines) from 'functions.py'.
         #
@@ -144,13 +230,12 @@ class IP_Adapter_SDXL:
         #
         # 9. Rename the class and the file to match your workflow's name (e.g., "FLUX_Kontext").
         #
-        # Final steps in 'dispatcher.py':
-        # 10. Import your new workflow: from workflow_scripts.[workflow_name] import [ClassName]
-        # 11. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": [ClassName]
+        # Final step in 'dispatcher.py':
+        # 10. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": "workflow_scripts.[workflow_name].[ClassName]"
         #
         # You can also set your new workflow as the default in 'main.py'.
 
-            loadimage_50 = loadimage.load_image(image=tmp_path)
+            loadimage_50 = load_image_from_bytes(image_bytes)
 
             janusimageunderstanding_129 = janusimageunderstanding.analyze_image(
                 question="Generate a descriptive text prompt intended for use in an image generation model (e.g., Stable Diffusion) to create an X-ray-style image of the given subject. This prompt should focus entirely on the skeletal structure, while intentionally avoiding any mention of the skull, face, or head to maintain a neutral and non-creepy aesthetic.\n\nStructure the prompt in the following way:\n\nSpecies and anatomical context: Begin by identifying the subject and state that it is being represented in X-ray form, focusing on internal bone structures.\n\nDetailed skeletal description (excluding head):\nDescribe key bone structures such as:\n\nSpine and vertebrae\n\nLimbs (e.g., elongated hind legs, forelimbs)\n\nDigits or toes\n\nPelvis, ribs (if applicable)\n\nJoints and connections between bones\nBe anatomically accurate and emphasize proportions and layout.\n\nVisual appearance and rendering style:\nDefine the visual style using phrases like:\n\n“semi-transparent bones glowing in white or blue”\n\n“clean medical X-ray look”\n\n“set against a dark or neutral background”\n\n“no visible soft tissue details unless subtle”\n\nStylistic tone and exclusions:\nMake it clear that the output should:\n\nBe clinical, technical, or illustrative\n\nAvoid all horror, fantasy, or emotionally charged interpretations\n\nExplicitly exclude any depiction or focus on the head or skull\n\nOptional enhancement terms:\nEncourage inclusion of terms such as:\n\n“high resolution”\n\n“medical illustration”\n\n“radiographic scan”\n\n“scientific rendering”\n\nThe result should be a clean, anatomical-style image prompt focused on skeletal anatomy below the neck, suitable for generating an X-ray-style output that is medically inspired and visually neutral.",
@@ -174,57 +259,16 @@ class IP_Adapter_SDXL:
             )
 
 
-            loadimage_60 = loadimage.load_image(image="Cat_back.png")
-
-            loadimage_64 = loadimage.load_image(image="Cat_front2.png")
-
-            loadimage_71 = loadimage.load_image(image="Cat_front2.png")
-
-            loadimage_72 = loadimage.load_image(image="Cat_side.png")
-
             loadimage_111 = loadimage.load_image(image="pasted/image.png")
 
-            ipadapterencoder_136 = ipadapterencoder.encode(
-                weight=1.0000000000000002,
-                ipadapter=get_value_at_index(ipadapterunifiedloader_63, 1),
-                image=get_value_at_index(loadimage_60, 0),
-            )
-
-            ipadapterencoder_139 = ipadapterencoder.encode(
-                weight=1,
-                ipadapter=get_value_at_index(ipadapterunifiedloader_63, 1),
-                image=get_value_at_index(loadimage_64, 0),
-            )
-
-            ipadapterencoder_140 = ipadapterencoder.encode(
-                weight=1.0000000000000002,
-                ipadapter=get_value_at_index(ipadapterunifiedloader_63, 1),
-                image=get_value_at_index(loadimage_72, 0),
-            )
-
-            ipadapterencoder_141 = ipadapterencoder.encode(
-                weight=1,
-                ipadapter=get_value_at_index(ipadapterunifiedloader_63, 1),
-                image=get_value_at_index(loadimage_71, 0),
-            )
-
-            for q in range(1):
-                ipadaptercombineembeds_138 = ipadaptercombineembeds.batch(
-                    method="concat",
-                    embed1=get_value_at_index(ipadapterencoder_139, 0),
-                    embed2=get_value_at_index(ipadapterencoder_136, 0),
-                    embed3=get_value_at_index(ipadapterencoder_140, 0),
-                    embed4=get_value_at_index(ipadapterencoder_141, 0),
-                )
-
-                ipadaptercombineembeds_143 = ipadaptercombineembeds.batch(
-                    method="concat",
-                    embed1=get_value_at_index(ipadapterencoder_139, 1),
-                    embed2=get_value_at_index(ipadapterencoder_136, 1),
-                    embed3=get_value_at_index(ipadapterencoder_140, 1),
-                    embed4=get_value_at_index(ipadapterencoder_141, 1),
+            if self.precompute_embeds:
+                reference_embeds = (ipadaptercombineembeds_138, ipadaptercombineembeds_143)
+            else:
+                reference_embeds = self.encode_references(
+                    loadimage, ipadapterencoder, ipadaptercombineembeds, get_value_at_index(ipadapterunifiedloader_63, 1)
                 )
 
+            for q in range(1):
                 ipadapterembeds_137 = ipadapterembeds.apply_ipadapter(
                     weight=1.0000000000000002,
                     weight_type="linear",
@@ -233,8 +277,8 @@ class IP_Adapter_SDXL:
                     embeds_scaling="V only",
                     model=get_value_at_index(ipadapterunifiedloader_63, 0),
                     ipadapter=get_value_at_index(ipadapterunifiedloader_63, 1),
-                    pos_embed=get_value_at_index(ipadaptercombineembeds_138, 0),
-                    neg_embed=get_value_at_index(ipadaptercombineembeds_143, 0),
+                    pos_embed=get_value_at_index(reference_embeds[0], 0),
+                    neg_embed=get_value_at_index(reference_embeds[1], 0),
                 )
 
                 imageresizekj_82 = imageresizekj.resize(
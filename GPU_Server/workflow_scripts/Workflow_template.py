@@ -30,6 +30,9 @@ class YourWorkflowName:
 
         NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         get_value_at_index = self.functions.get_value_at_index
+        # Models loaded with load_shared are reused by other workflows loading the same file
+        load_shared = self.functions.load_shared
+        shared_owner = type(self).__name__
 
         with torch.inference_mode():
             print("Loading nodes...")
@@ -50,11 +53,9 @@ class YourWorkflowName:
         # Make the functions available in the local scope (no self. prefix needed)
         NODE_CLASS_MAPPINGS = self.NODE_CLASS_MAPPINGS
         get_value_at_index = self.functions.get_value_at_index
-        get_path_from_bytes = self.functions.get_path_from_bytes
+        load_image_from_bytes = self.functions.load_image_from_bytes
         convert_image = self.functions.converte_image
         format_text_for_field = self.functions.format_text_for_field
-        # Load the image from bytes
-        tmp_path = get_path_from_bytes(image_bytes)
 
         with torch.inference_mode():
             # How to implement your own workflow:
@@ -67,10 +68,13 @@ class YourWorkflowName:
             # 3. Search for "NODE_CLASS_MAPPINGS" and move all related initializations to the 'load_once' function.
             # 4. Search for ".safetensors" and move all code lines that load these files into the 'load_once' function.
             # 5. Search for "model_name" or "modelloader" and move those lines into the 'load_once' function as well.
+            #    Loader calls with plain arguments can go through load_shared(shared_owner, loader, "method", ...),
+            #    so models other workflows use as well are only loaded once.
             #    Optionally, move any static assets (e.g., watermarks) that don't depend on the input image to 'load_once'.
             #
             # 6. In the 'generate' function, find the input image loading step (e.g., 'loadimage_X') and change it to:
-            #    loadimage_X = loadimage.load_image(image=tmp_path)
+            #    loadimage_X = load_image_from_bytes(image_bytes)
+            #    It decodes the received bytes in memory into the same (IMAGE, MASK) output as LoadImage.
             #    Ensure paths for constant images (like IP-Adapter inputs or watermarks) are correct.
             #    For text overlays, use format_text_for_field(your_text_input, line_length, num_lines) from 'functions.py'.
             #
@@ -81,9 +85,8 @@ class YourWorkflowName:
             #
             # 9. Rename the class and the file to match your workflow's name (e.g., "FLUX_Kontext").
             #
-            # Final steps in 'dispatcher.py':
-            # 10. Import your new workflow: from workflow_scripts.[workflow_name] import [ClassName]
-            # 11. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": [ClassName]
+            # Final step in 'dispatcher.py':
+            # 10. Add your workflow to the 'workflow_class' dictionary: "[workflow_name]": "workflow_scripts.[workflow_name].[ClassName]"
             #
             # You can also set your new workflow as the default in 'main.py'.
 